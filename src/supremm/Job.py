@@ -95,6 +95,10 @@ class Job(object):
 
         self._errors = {}
 
+        # Names of the plugins and preprocessors to run when the summary is
+        # updated with the stale plugins only (None to run all of them)
+        self.rerun = None
+
     def __str__(self):
         """ Return a summary string describing the job """
         return "jobid=%s nodes=%s walltime=%s" % (self.job_id, self._nodecount, self.walltime)
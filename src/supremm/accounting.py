@@ -8,6 +8,11 @@ class Accounting(object, metaclass=ABCMeta):
 
     PROCESS_VERSION = 1
 
+    # Implementations that buffer the process updates write them once batchsize
+    # updates are buffered or the oldest is batchinterval seconds old
+    batchsize = 1
+    batchinterval = 0
+
     def __init__(self, resource_id, config):
         self._resource_id = resource_id
         self._config = config
@@ -33,6 +38,11 @@ class Accounting(object, metaclass=ABCMeta):
         """ log a job as being processed (either successfully or not) """
         pass
 
+    def flush(self):
+        """ Write any buffered process updates. Implementations that do not buffer
+            the updates do not need to override this """
+        pass
+
 class ArchiveCache(object, metaclass=ABCMeta):
     """ abstract base class describing the job archive cache interface """
 
@@ -91,6 +91,24 @@ CREATE TABLE `process` (
   KEY `proc` (`process_version`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
+
+--
+-- Table structure for table `process_lease`
+--
+
+DROP TABLE IF EXISTS `process_lease`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `process_lease` (
+  `queue` varchar(64) COLLATE utf8_unicode_ci NOT NULL,
+  `jobid` int(11) NOT NULL,
+  `owner` varchar(255) COLLATE utf8_unicode_ci NOT NULL,
+  `lease_expires` int(11) NOT NULL,
+  `completed` tinyint(1) NOT NULL DEFAULT '0',
+  PRIMARY KEY (`queue`,`jobid`),
+  KEY `owner` (`queue`,`owner`,`completed`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
 /*!40103 SET TIME_ZONE=@OLD_TIME_ZONE */;
 
 /*!40101 SET SQL_MODE=@OLD_SQL_MODE */;
@@ -0,0 +1,149 @@
+""" Compact binary encoding of the job timeseries documents.
+
+    In the compact schema (timeseries version COMPACT_TIMESERIES_VERSION) the
+    arrays in the timeseries document are stored as binary blobs instead of
+    lists of floats:
+
+    * "times" is delta encoded: the first timestamp in milliseconds as a
+      64 bit integer followed by the differences as 32 bit integers.
+    * the per-host "all" values and the per-device "dev" values are packed
+      as 32 bit floats.
+
+    Every blob starts with a one byte type code and the number of values.
+    All values are little endian. decode_timeseries() converts a document in
+    either schema to lists so consumers can read both.
+
+    Large fields of the job summary documents can also be stored compressed:
+    the value is encoded as BSON and compressed with zlib (the count in the
+    header is the uncompressed size). decompress_summary() restores them.
+"""
+import zlib
+import struct
+import numpy
+import bson
+
+from supremm.summarize import TIMESERIES_VERSION, COMPACT_TIMESERIES_VERSION
+from supremm.serialize import CODEC_OPTIONS
+
+FLOAT32 = b"F"
+DELTA_TIMES = b"T"
+ZLIB_BSON = b"Z"
+
+HEADER = struct.Struct("<cI")
+
+# Keys in the timeseries document that are not plugin timeseries
+RESERVED_KEYS = ("_id", "hosts", "version")
+
+
+def encode_floats(values):
+    """ Pack a sequence of numbers as float32 """
+    data = numpy.asarray(values, dtype="<f4")
+    return HEADER.pack(FLOAT32, len(data)) + data.tobytes()
+
+
+def encode_times(times):
+    """ Delta encode a sequence of timestamps (seconds) with millisecond precision """
+    millis = numpy.round(numpy.asarray(times, dtype=numpy.float64) * 1000.0).astype(numpy.int64)
+    if len(millis) == 0:
+        return HEADER.pack(DELTA_TIMES, 0)
+    deltas = numpy.diff(millis)
+    if len(deltas) and (deltas.max() > numpy.iinfo(numpy.int32).max or deltas.min() < numpy.iinfo(numpy.int32).min):
+        raise ValueError("Timestamp delta does not fit in 32 bits")
+    return HEADER.pack(DELTA_TIMES, len(millis)) + struct.pack("<q", millis[0]) + deltas.astype("<i4").tobytes()
+
+
+def decode(blob):
+    """ Decode a blob produced by encode_floats or encode_times to a numpy array,
+        or a compressed summary field to the original value """
+    blob = bytes(blob)
+    code, count = HEADER.unpack_from(blob)
+    offset = HEADER.size
+
+    if code == ZLIB_BSON:
+        return bson.decode(zlib.decompress(blob[offset:]))["v"]
+
+    if code == FLOAT32:
+        return numpy.frombuffer(blob, dtype="<f4", count=count, offset=offset).astype(numpy.float64)
+
+    if code == DELTA_TIMES:
+        if count == 0:
+            return numpy.zeros(0)
+        first, = struct.unpack_from("<q", blob, offset)
+        deltas = numpy.frombuffer(blob, dtype="<i4", count=count - 1, offset=offset + 8)
+        millis = numpy.concatenate(([first], first + numpy.cumsum(deltas, dtype=numpy.int64)))
+        return millis / 1000.0
+
+    raise ValueError("Unknown encoding {0!r}".format(code))
+
+
+def isencoded(value):
+    """ Whether a value is an encoded blob """
+    return isinstance(value, (bytes, bytearray, memoryview))
+
+
+def encode_timeseries(timeseries):
+    """ Convert a timeseries document to the compact schema (in place) """
+    for key, data in timeseries.items():
+        if key in RESERVED_KEYS or not isinstance(data, dict):
+            continue
+        if "times" in data and not isencoded(data["times"]):
+            data["times"] = encode_times(data["times"])
+        for host in data.get("hosts", {}).values():
+            if "all" in host and not isencoded(host["all"]):
+                host["all"] = encode_floats(host["all"])
+            devices = host.get("dev", {})
+            for devid, values in devices.items():
+                if not isencoded(values):
+                    devices[devid] = encode_floats(values)
+
+    timeseries["version"] = COMPACT_TIMESERIES_VERSION
+    return timeseries
+
+
+def decode_timeseries(timeseries):
+    """ Convert a timeseries document in the compact schema to lists of floats (in place).
+        Documents in the original schema are returned unchanged.
+    """
+    if timeseries.get("version") != COMPACT_TIMESERIES_VERSION:
+        return timeseries
+
+    for key, data in timeseries.items():
+        if key in RESERVED_KEYS or not isinstance(data, dict):
+            continue
+        if isencoded(data.get("times")):
+            data["times"] = decode(data["times"]).tolist()
+        for host in data.get("hosts", {}).values():
+            if isencoded(host.get("all")):
+                host["all"] = decode(host["all"]).tolist()
+            devices = host.get("dev", {})
+            for devid, values in devices.items():
+                if isencoded(values):
+                    devices[devid] = decode(values).tolist()
+
+    timeseries["version"] = TIMESERIES_VERSION
+    return timeseries
+
+
+def compress_summary(summary, fields, threshold):
+    """ Compress the fields of a summary document (in place) whose BSON encoding
+        is at least threshold bytes. Returns the names of the compressed fields """
+    compressed = []
+    for key in fields:
+        value = summary.get(key)
+        if not isinstance(value, (dict, list)):
+            continue
+        data = bson.encode({"v": value}, codec_options=CODEC_OPTIONS)
+        if len(data) >= threshold:
+            summary[key] = HEADER.pack(ZLIB_BSON, len(data)) + zlib.compress(data)
+            compressed.append(key)
+    return compressed
+
+
+def decompress_summary(summary):
+    """ Restore the compressed fields of a summary document (in place).
+        Documents without compressed fields are returned unchanged.
+    """
+    for key, value in summary.items():
+        if isencoded(value) and bytes(value[:1]) == ZLIB_BSON:
+            summary[key] = decode(value)
+    return summary
@@ -0,0 +1,91 @@
+""" Flattening of job summaries into rows of scalar columns for columnar export.
+
+    Nested summary fields are named by joining the keys with dots, for example
+    cpu.jobcpus.user.avg. Only scalar values are kept: lists, binary data and
+    the timeseries document are dropped.
+"""
+import datetime
+import numpy
+
+# Top level summary fields that are not exported
+EXCLUDED_KEYS = ("_id", "timeseries")
+
+
+def flatten(document, prefix="", row=None):
+    """ Returns a dict of the scalar values in a nested document """
+    if row is None:
+        row = {}
+
+    for key, value in document.items():
+        if not prefix and key in EXCLUDED_KEYS:
+            continue
+        name = prefix + str(key)
+        if isinstance(value, numpy.generic):
+            # numpy scalars (numpy.float64 is also a float) are stored as the python type
+            value = value.item()
+        if isinstance(value, dict):
+            flatten(value, name + ".", row)
+        elif isinstance(value, (bool, int, float, str, datetime.datetime)):
+            row[name] = value
+
+    return row
+
+
+def columntype(values):
+    """ Type of a column: bool, float, datetime or str. All numbers are stored as
+        float so that a column has the same type in every file. Columns with
+        other mixtures are str """
+    types = set(type(v) for v in values if v is not None)
+    if not types:
+        return str
+    if types == {bool}:
+        return bool
+    if types <= {int, float}:
+        return float
+    if types == {datetime.datetime}:
+        return datetime.datetime
+    return str
+
+
+def convert(value, ctype):
+    """ Convert a value to the column type. Returns None if it does not fit """
+    if value is None:
+        return None
+    if ctype is str:
+        return str(value)
+    if ctype is float:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+        return None
+    if isinstance(value, ctype):
+        return value
+    return None
+
+
+def tocolumns(rows, schema=None):
+    """ Convert a list of rows to a dict of columns (lists with None for missing
+        values) and the type of each column. schema is a dict of the types of the
+        columns that were written before: these columns keep their type (values
+        that do not fit are dropped) and the new columns are added to it """
+    if schema is None:
+        schema = {}
+    names = sorted(set(name for row in rows for name in row))
+    columns = {}
+    types = {}
+    for name in names:
+        values = [row.get(name) for row in rows]
+        ctype = schema.get(name)
+        if ctype is None:
+            ctype = schema[name] = columntype(values)
+        columns[name] = [convert(v, ctype) for v in values]
+        types[name] = ctype
+    return columns, types
+
+
+def partition(summary):
+    """ Name of the partition of a job: the date that it ended (UTC) """
+    end_time = summary.get('acct', {}).get('end_time')
+    try:
+        return "end_date=" + datetime.datetime.fromtimestamp(float(end_time), datetime.timezone.utc).strftime("%Y-%m-%d")
+    except (TypeError, ValueError):
+        return "end_date=unknown"
@@ -0,0 +1,445 @@
+""" Adaptive control of the number of jobs that are summarized concurrently.
+
+    The pool is created with the maximum number of workers and the number of
+    jobs in flight is adjusted between the configured bounds based on the
+    available system memory, the I/O wait and the memory used by the workers.
+    Workers are replaced after a number of jobs or when their memory grows
+    too large. The system statistics are read from /proc.
+"""
+import os
+import time
+import queue
+import logging
+import threading
+import collections
+import multiprocessing as mp
+from multiprocessing.connection import wait
+
+
+def meminfo():
+    """ Returns (available, total) system memory in bytes """
+    values = {}
+    with open("/proc/meminfo", "r") as fp:
+        for line in fp:
+            fields = line.split()
+            if fields[0] in ("MemTotal:", "MemAvailable:"):
+                values[fields[0]] = int(fields[1]) * 1024
+    return values["MemAvailable:"], values["MemTotal:"]
+
+
+def cputimes():
+    """ Returns (iowait, total) cpu time in clock ticks for all cpus """
+    with open("/proc/stat", "r") as fp:
+        for line in fp:
+            if line.startswith("cpu "):
+                times = [int(x) for x in line.split()[1:]]
+                return times[4], sum(times)
+    return 0, 0
+
+
+def processrss(pid):
+    """ Returns the resident set size of a process in bytes (0 if it has exited) """
+    try:
+        with open("/proc/{0}/status".format(pid), "r") as fp:
+            for line in fp:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    return 0
+
+
+def resetpeakrss():
+    """ Reset the peak resident set size of this process (Linux 4.0 and later) """
+    try:
+        with open("/proc/self/clear_refs", "w") as fp:
+            fp.write("5")
+    except (IOError, OSError):
+        pass
+
+
+def peakrss():
+    """ Returns the peak resident set size of this process in bytes """
+    try:
+        with open("/proc/self/status", "r") as fp:
+            for line in fp:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    return 0
+
+
+def workerrss():
+    """ Returns the resident set size of each child process of this process """
+    return dict((p.pid, processrss(p.pid)) for p in mp.active_children())
+
+
+class ConcurrencyController(object):
+    """ Chooses the number of concurrent jobs between minlimit and maxlimit.
+        The limit is decreased by a quarter when available memory drops below
+        mem_low or the I/O wait is above iowait_high, and increased by one when
+        there is room for another worker.
+    """
+
+    def __init__(self, minlimit, maxlimit, mem_low=0.10, mem_high=0.25, iowait_high=25.0, interval=5.0):
+        self.minlimit = minlimit
+        self.maxlimit = maxlimit
+        self.mem_low = mem_low
+        self.mem_high = mem_high
+        self.iowait_high = iowait_high
+        self.interval = interval
+
+        self.limit = minlimit
+        self.memorytight = False
+        self.meanjobsize = None
+        self._lastupdate = 0
+        self._lastcpu = cputimes()
+
+    def iowait(self):
+        """ Percentage of cpu time spent in I/O wait since the previous call """
+        iowait, total = cputimes()
+        lastiowait, lasttotal = self._lastcpu
+        self._lastcpu = (iowait, total)
+        if total <= lasttotal:
+            return 0.0
+        return 100.0 * (iowait - lastiowait) / (total - lasttotal)
+
+    def update(self, force=False):
+        """ Recompute the limit. Returns the new limit """
+        now = time.time()
+        if not force and now - self._lastupdate < self.interval:
+            return self.limit
+        self._lastupdate = now
+
+        available, total = meminfo()
+        memfrac = float(available) / total
+        iowait = self.iowait()
+        rss = [r for r in workerrss().values() if r > 0]
+        meanrss = sum(rss) / len(rss) if rss else 0
+
+        self.memorytight = memfrac < self.mem_high
+
+        previous = self.limit
+        if memfrac < self.mem_low or iowait > self.iowait_high:
+            self.limit = max(self.minlimit, self.limit - max(1, self.limit // 4))
+        elif not self.memorytight and iowait < self.iowait_high / 2 and available - 2 * meanrss > self.mem_high * total:
+            self.limit = min(self.maxlimit, self.limit + 1)
+
+        if self.limit != previous:
+            logging.info("Concurrency %d -> %d (available memory %.0f%%, iowait %.0f%%, mean worker RSS %d MB)",
+                         previous, self.limit, 100.0 * memfrac, iowait, meanrss // (1024 * 1024))
+
+        return self.limit
+
+    def observe(self, size):
+        """ Update the running mean of the estimated job size """
+        if self.meanjobsize is None:
+            self.meanjobsize = size
+        else:
+            self.meanjobsize = 0.95 * self.meanjobsize + 0.05 * size
+
+    def holdback(self, size):
+        """ Whether a job should wait because it is much larger than the average
+            job and memory is tight
+        """
+        return self.memorytight and self.meanjobsize is not None and size > 4 * self.meanjobsize
+
+
+def runworker(conn, initializer, initargs):
+    """ Main loop of a worker process. Runs each task that it receives until it
+        receives None and sends back the result and the RSS of the process
+    """
+    if initializer is not None:
+        initializer(*initargs)
+    pid = os.getpid()
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        func, args = task
+        try:
+            result = (True, func(*args))
+        except Exception as exc:
+            result = (False, exc)
+        try:
+            conn.send((processrss(pid), result))
+        except Exception as exc:
+            # The result could not be pickled
+            conn.send((processrss(pid), (False, Exception("Error sending the result: {0}".format(exc)))))
+
+
+class Worker(object):
+    """ A worker process of the WorkerPool and its current task """
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.task = None
+        self.ntasks = 0
+
+
+class WorkerPool(object):
+    """ Process pool that recycles its workers.
+
+        Each worker runs one task at a time. A worker is retired once it has
+        run maxtasks jobs or its resident set size after a job is larger than
+        maxrss bytes, and a new worker takes its place. The other workers keep
+        running. The peak RSS of each worker is logged when the pool is closed.
+    """
+
+    def __init__(self, processes, initializer=None, initargs=(), maxtasks=None, maxrss=None):
+        self.processes = processes
+        self.initializer = initializer
+        self.initargs = initargs
+        self.maxtasks = maxtasks
+        self.maxrss = maxrss
+        self.retired = 0
+        self.peaks = {}
+
+        self._lock = threading.Lock()
+        self._workers = {}
+        self._exited = []
+        self._pending = collections.deque()
+        self._closed = False
+        # Wakes up the collector when a task is submitted or the pool is closed
+        self._wakeup, self._notify = mp.Pipe(duplex=False)
+
+        for _ in range(processes):
+            self._start()
+
+        self._collector = threading.Thread(target=self._collect)
+        self._collector.daemon = True
+        self._collector.start()
+
+    def _start(self):
+        conn, child = mp.Pipe()
+        process = mp.Process(target=runworker, args=(child, self.initializer, self.initargs))
+        process.daemon = True
+        process.start()
+        child.close()
+        self._workers[process.pid] = Worker(process, conn)
+
+    def _retire(self, worker):
+        """ Stop an idle worker and start a new one unless the pool is closed and has no pending tasks """
+        del self._workers[worker.process.pid]
+        try:
+            worker.conn.send(None)
+        except (IOError, OSError):
+            pass
+        worker.conn.close()
+        self._exited.append(worker.process)
+        if not self._closed or self._pending:
+            self._start()
+
+    def _dispatch(self):
+        """ Give the pending tasks to the idle workers. Called with the lock held """
+        for worker in list(self._workers.values()):
+            if worker.task is not None:
+                continue
+            if self._pending:
+                worker.task = self._pending.popleft()
+                func, args = worker.task[:2]
+                worker.conn.send((func, args))
+            elif self._closed:
+                self._retire(worker)
+
+    def apply_async(self, func, args, callback, error_callback):
+        with self._lock:
+            if self._closed:
+                raise ValueError("Pool not running")
+            self._pending.append((func, args, callback, error_callback))
+            self._dispatch()
+        self._notify.send(None)
+
+    def _completed(self, worker, message):
+        """ Record the result of the task of a worker and retire the worker if it
+            has run enough tasks or has grown too large. Returns the callback to run
+        """
+        _, _, callback, error_callback = worker.task
+        worker.task = None
+        worker.ntasks += 1
+
+        pid = worker.process.pid
+        rss, (success, result) = message
+        self.peaks[pid] = max(self.peaks.get(pid, 0), rss)
+
+        if self.maxrss is not None and rss > self.maxrss:
+            logging.info("Worker %d RSS %d MB exceeds the limit of %d MB. Replacing the worker.",
+                         pid, rss // (1024 * 1024), self.maxrss // (1024 * 1024))
+            self.retired += 1
+            self._retire(worker)
+        elif self.maxtasks is not None and worker.ntasks >= self.maxtasks:
+            self._retire(worker)
+
+        if success:
+            return callback, result
+        return error_callback, result
+
+    def _failed(self, worker):
+        """ Replace a worker that exited unexpectedly. Returns the error callback of its task """
+        logging.error("Worker %d exited with code %s", worker.process.pid, worker.process.exitcode)
+        task = worker.task
+        worker.task = None
+        self._retire(worker)
+        if task is None:
+            return None
+        return task[3], Exception("Worker {0} exited with code {1}".format(worker.process.pid, worker.process.exitcode))
+
+    def _collect(self):
+        """ Receive the results of the workers and run the callbacks """
+        while True:
+            with self._lock:
+                self._exited = [p for p in self._exited if p.is_alive()]
+                if self._closed and not self._workers:
+                    return
+                workers = list(self._workers.values())
+
+            ready = wait([self._wakeup] + [w.conn for w in workers] + [w.process.sentinel for w in workers])
+            while self._wakeup.poll():
+                self._wakeup.recv()
+
+            calls = []
+            with self._lock:
+                for worker in workers:
+                    if worker.conn in ready and worker.task is not None:
+                        try:
+                            calls.append(self._completed(worker, worker.conn.recv()))
+                        except (EOFError, IOError, OSError):
+                            calls.append(self._failed(worker))
+                    elif worker.process.sentinel in ready and worker.process.pid in self._workers:
+                        calls.append(self._failed(worker))
+                self._dispatch()
+
+            for call in calls:
+                if call is not None:
+                    call[0](call[1])
+
+    def report(self):
+        """ Log the peak RSS of each worker and reset the statistics """
+        for pid, peak in sorted(self.peaks.items()):
+            logging.debug("Worker %d peak RSS %d MB", pid, peak // (1024 * 1024))
+        if self.peaks:
+            peaks = list(self.peaks.values())
+            logging.info("Peak worker RSS: max %d MB, mean %d MB over %d workers",
+                         max(peaks) // (1024 * 1024), sum(peaks) // (len(peaks) * 1024 * 1024), len(peaks))
+        self.peaks = {}
+
+    def close(self):
+        """ Stop accepting tasks. The workers exit once the pending tasks have run """
+        with self._lock:
+            self._closed = True
+            self._dispatch()
+        self._notify.send(None)
+
+    def join(self):
+        self._collector.join()
+        for process in self._exited:
+            process.join()
+        self.report()
+
+
+class Dispatcher(object):
+    """ Runs tasks in a process pool with a bounded number of tasks in flight.
+        The bound is fixed or set by a ConcurrencyController.
+
+        If a memory budget is set, a task only starts if its estimated memory
+        fits in the budget next to the tasks in flight. Otherwise it is
+        deferred until enough tasks finish. A task that is estimated to need
+        more than the whole budget runs on its own. Without a budget, tasks
+        that are much larger than the average task are deferred while the
+        controller reports that memory is tight.
+    """
+
+    # Seconds that a deferred task waits before new tasks stop being started
+    MAX_DEFER = 300
+
+    def __init__(self, pool, maxinflight, controller=None, budget=None):
+        self.pool = pool
+        self.maxinflight = maxinflight
+        self.controller = controller
+        self.budget = budget
+
+    def limit(self):
+        """ Current maximum number of tasks in flight """
+        if self.controller is None:
+            return self.maxinflight
+        return self.controller.update()
+
+    def fits(self, memory):
+        """ Whether a task with the estimated memory fits in the budget """
+        return self.budget is None or memory is None or memory <= self.budget
+
+    def admit(self, memory, committed, inflight):
+        """ Whether a task with the estimated memory can start now """
+        if memory is None or inflight == 0:
+            return True
+        if self.budget is None:
+            return self.controller is None or not self.controller.holdback(memory)
+        return committed + memory <= self.budget
+
+    def run(self, func, tasks, estimate=None):
+        """ Generator that yields (task, result) for each task in completion order.
+            estimate(task) returns the estimated memory of a task in bytes.
+        """
+        results = queue.Queue()
+        tasks = iter(tasks)
+        held = collections.deque()
+        inflight = {}
+        exhausted = False
+        isolated = False
+
+        while True:
+            while not isolated and len(inflight) < self.limit():
+                committed = sum(inflight.values())
+                task = None
+
+                # If a deferred task has waited too long or needs to run on its own
+                # then only that task can start, so that the tasks in flight drain
+                starving = held and (time.time() - held[0][2] > self.MAX_DEFER or not self.fits(held[0][1]))
+                candidates = [held[0]] if starving else list(held)
+
+                # Deferred tasks are started first
+                for htask, hmemory, hdeferred in candidates:
+                    if self.admit(hmemory, committed, len(inflight)):
+                        task, memory = htask, hmemory
+                        held.remove((htask, hmemory, hdeferred))
+                        break
+
+                if task is None:
+                    if exhausted or starving or len(held) >= self.maxinflight:
+                        break
+                    try:
+                        task = next(tasks)
+                    except StopIteration:
+                        exhausted = True
+                        continue
+                    memory = estimate(task) if estimate is not None else None
+                    if self.controller is not None and memory is not None:
+                        self.controller.observe(memory)
+                    if not self.admit(memory, committed, len(inflight)):
+                        held.append((task, memory, time.time()))
+                        continue
+
+                if not self.fits(memory):
+                    logging.info("Running task alone. Estimated memory %d MB exceeds the budget", memory // (1024 * 1024))
+                    isolated = True
+
+                self.pool.apply_async(func, (task,),
+                                      callback=lambda result, t=task: results.put((t, result)),
+                                      error_callback=lambda exc, t=task: results.put((t, exc)))
+                inflight[id(task)] = memory or 0
+
+            if not inflight:
+                return
+
+            try:
+                task, result = results.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+            del inflight[id(task)]
+            isolated = False
+            if isinstance(result, BaseException):
+                raise result
+            yield task, result
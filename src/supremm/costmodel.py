@@ -0,0 +1,102 @@
+""" Estimates of the peak memory and cpu time needed to summarize a job.
+
+    The estimate is computed from the number of samples that the plugins
+    process (node count, walltime and cores per node), the number of enabled
+    plugins and the size of the raw PCP archives. The estimates are
+    calibrated against the measured peak RSS and cpu time of the jobs that
+    have been summarized so that they track the actual cost on each site.
+"""
+import os
+import logging
+
+# Archive files that are read by pmlogextract
+ARCHIVE_SUFFIXES = (".0", ".index", ".meta", ".0.xz", ".index.xz", ".meta.xz")
+
+
+def archivesize(path):
+    """ Total size in bytes of the files of a PCP archive """
+    base = path
+    for suffix in ARCHIVE_SUFFIXES:
+        if base.endswith(suffix):
+            base = base[:-len(suffix)]
+            break
+
+    total = 0
+    for suffix in ARCHIVE_SUFFIXES:
+        try:
+            total += os.path.getsize(base + suffix)
+        except OSError:
+            pass
+    return total
+
+
+class JobCost(object):
+    """ Estimated peak memory (bytes) and cpu time (seconds) of a job """
+
+    def __init__(self, memory, cputime, basememory, basecputime):
+        self.memory = memory
+        self.cputime = cputime
+        self.basememory = basememory
+        self.basecputime = basecputime
+
+    def __str__(self):
+        return "memory={0}MB cputime={1:.0f}s".format(int(self.memory // (1024 * 1024)), self.cputime)
+
+
+class CostModel(object):
+    """ Calibrated estimator of the cost to summarize a job """
+
+    # Memory used by a worker before it loads any job data
+    BASE_MEMORY = 200 * 1024 * 1024
+
+    # Uncalibrated cost per sample processed by a plugin
+    MEMORY_PER_SAMPLE = 512
+    CPUTIME_PER_SAMPLE = 2e-5
+
+    # Uncalibrated cost per byte of raw archive
+    MEMORY_PER_ARCHIVE_BYTE = 0.5
+    CPUTIME_PER_ARCHIVE_BYTE = 2e-8
+
+    SAMPLE_INTERVAL = 30.0
+
+    # Weight of each new measurement in the calibration factors
+    ALPHA = 0.1
+
+    def __init__(self, nplugins):
+        self.nplugins = max(1, nplugins)
+        self.memoryscale = 1.0
+        self.cputimescale = 1.0
+        self.observations = 0
+
+    def estimate(self, job):
+        """ Estimate the cost to summarize a job """
+        nodecount = max(1, job.nodecount)
+        samples = nodecount * max(job.walltime, 60) / self.SAMPLE_INTERVAL
+
+        # Per-cpu metrics scale with the number of cores on each node
+        ncpus = job.acct.get("ncpus") or nodecount
+        corefactor = 1.0 + (float(ncpus) / nodecount) / 16.0
+
+        archivebytes = sum(archivesize(path) for _, paths in job.rawarchives() for path in paths)
+
+        basememory = samples * self.nplugins * corefactor * self.MEMORY_PER_SAMPLE + archivebytes * self.MEMORY_PER_ARCHIVE_BYTE
+        basecputime = samples * self.nplugins * corefactor * self.CPUTIME_PER_SAMPLE + archivebytes * self.CPUTIME_PER_ARCHIVE_BYTE
+
+        return JobCost(self.BASE_MEMORY + self.memoryscale * basememory, self.cputimescale * basecputime, basememory, basecputime)
+
+    def observe(self, cost, peakrss, cputime):
+        """ Update the calibration with the measured cost of a job """
+        if peakrss and cost.basememory > 0:
+            ratio = max(0.0, peakrss - self.BASE_MEMORY) / cost.basememory
+            self.memoryscale = self.calibrate(self.memoryscale, ratio)
+        if cputime and cost.basecputime > 0:
+            self.cputimescale = self.calibrate(self.cputimescale, cputime / cost.basecputime)
+
+        self.observations += 1
+        if self.observations % 100 == 0:
+            logging.info("Cost model calibration after %d jobs: memory x%.2f, cpu time x%.2f",
+                         self.observations, self.memoryscale, self.cputimescale)
+
+    def calibrate(self, scale, ratio):
+        ratio = min(max(ratio, 0.01), 100.0)
+        return (1.0 - self.ALPHA) * scale + self.ALPHA * ratio
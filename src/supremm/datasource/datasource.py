@@ -3,6 +3,7 @@ from abc import ABC, abstractmethod
 
 from supremm.errors import ProcessingError
 from supremm.proc_common import instantiatePlugins
+from supremm.pluginversions import classversions, select
 
 class Datasource(ABC):
     """ Definition of the Datasource API """
@@ -78,8 +79,30 @@ class Datasource(ABC):
         # All datasources instantiate plugins/preprocs
         preprocessors = instantiatePlugins(self.allpreprocs, job)
         analytics = instantiatePlugins(self.allplugins, job)
+
+        rerun = getattr(job, "rerun", None)
+        if rerun is None:
+            jobmeta.mdata['versions'] = classversions(self.allpreprocs + self.allplugins)
+        else:
+            # Only run the stale plugins with their dependencies and dependents
+            # The versions are recorded by rerunversions once the summary is processed
+            preprocessors, analytics = select(preprocessors, analytics, rerun)
+
         return preprocessors, analytics
 
+    def rerunversions(self, job, jobmeta, summary):
+        """ Record the versions of the re-run classes that produced a result, and of the
+            stale classes that do not apply to the job. The other stale classes keep their
+            stored versions so that they are run again
+        """
+        rerun = getattr(job, "rerun", None)
+        if rerun is None:
+            return
+
+        instantiated = set(type(x).__name__ for x in summary.preprocs + summary.alltimestamps + summary.firstlast)
+        notapplicable = [c for c in self.allpreprocs + self.allplugins if c.__name__ in rerun and c.__name__ not in instantiated]
+        jobmeta.mdata['versions'] = classversions(notapplicable + [type(x) for x in summary.produced()])
+
     @abstractmethod
     def cleanup(self, job, opts):
         pass
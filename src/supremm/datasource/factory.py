@@ -2,12 +2,14 @@ import logging
 
 from supremm.datasource.pcp.pcpdatasource import PCPDatasource
 from supremm.datasource.prometheus.promdatasource import PromDatasource
+from supremm.pluginversions import classversions
 
 
 class DatasourceFactory():
     """ Datasource class helper """
 
     def __init__(self, preprocs, plugins, resconf):
+        self._versions = classversions(preprocs + plugins)
 
         if resconf["datasource"] == "pcp":
             self._datasource = PCPDatasource(preprocs, plugins)
@@ -22,5 +24,9 @@ class DatasourceFactory():
     def summarizejob(self, job, jobmeta, config, opts):
         return self._datasource.summarizejob(job, jobmeta, config, opts)
 
+    def versions(self):
+        """ Versions of the preprocessors and plugins, keyed by class name """
+        return self._versions
+
     def cleanup(self, job, opts):
         return self._datasource.cleanup(job, opts)
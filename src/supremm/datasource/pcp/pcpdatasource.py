@@ -69,6 +69,8 @@ class PCPDatasource(Datasource):
             logging.info("Skipping %s, skipped_pmlogextract_error", job.job_id)
             jobmeta.error = ProcessingError.PMLOGEXTRACT_ERROR
 
+        self.rerunversions(job, jobmeta, s)
+
         if opts['tag'] != None:
             jobmeta.mdata['tag'] = opts['tag']
 
@@ -12,6 +12,7 @@ import traceback
 from supremm.plugin import NodeMetadata
 from supremm.rangechange import RangeChange, DataCache
 from supremm.summarize import Summarize
+from supremm import codec
 from supremm.datasource.pcp.pcpcinterface import pcpcinterface
 
 import numpy
@@ -112,6 +113,8 @@ class PCPSummarize(Summarize):
         if len(timeseries) > 0:
             timeseries['hosts'] = dict((str(idx), name) for name, idx, _ in self.job.nodearchives())
             timeseries['version'] = self.timeseries_version
+            if self.compact_timeseries:
+                codec.encode_timeseries(timeseries)
             output['timeseries'] = timeseries
 
         for preproc in self.preprocs:
@@ -123,10 +126,9 @@ class PCPSummarize(Summarize):
             if 'errors' in data:
                 self.adderror(source, str(data['errors']))
 
-        if len(self.errors) > 0:
-            output['errors'] = {}
-            for k, v in self.errors.items():
-                output['errors'][k] = list(v)
+        errors = self.summaryerrors()
+        if len(errors) > 0:
+            output['errors'] = errors
 
         return output
 
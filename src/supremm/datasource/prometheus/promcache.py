@@ -0,0 +1,186 @@
+""" On-disk cache of Prometheus query responses.
+
+    The data for a job does not change once the job has ended, so responses
+    for queries whose time window is old enough are cached. Reprocessing jobs
+    then reads the responses from local disk instead of the Prometheus server.
+    Entries are compressed JSON (numpy arrays are stored as lists and
+    converted back when read) and the least recently used entries are removed
+    when the cache grows larger than the configured size. The cache directory
+    can be shared by multiple processes and resources: the entries are keyed
+    by the Prometheus server and the transport as well as the query.
+"""
+import os
+import re
+import time
+import zlib
+import json
+import hashlib
+import logging
+import tempfile
+
+import numpy as np
+
+# Whitespace that is not inside a quoted label value
+UNQUOTED_SPACE_RE = re.compile(r"\s+(?=(?:[^'\"]*['\"][^'\"]*['\"])*[^'\"]*$)")
+
+
+def _jsondefault(value):
+    if isinstance(value, np.ndarray):
+        return {"__ndarray__": value.tolist(), "shape": value.shape}
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("Cannot store {0} in the Prometheus cache".format(type(value).__name__))
+
+
+def _jsonobject(obj):
+    if "__ndarray__" in obj:
+        return np.array(obj["__ndarray__"], dtype=np.float64).reshape(obj["shape"])
+    return obj
+
+
+def encode(result):
+    """ Serialize a response for the cache """
+    return zlib.compress(json.dumps(result, default=_jsondefault, separators=(",", ":")).encode("utf-8"), 1)
+
+
+def decode(data):
+    """ Deserialize a cached response """
+    return json.loads(zlib.decompress(data).decode("utf-8"), object_hook=_jsonobject)
+
+
+class PromCache():
+    """ Size-limited LRU cache of query responses keyed by server, query and time window """
+
+    # Number of stores between rescans of the cache directory
+    RESCAN_INTERVAL = 1000
+
+    def __init__(self, cachedir, maxsize, minage, namespace=""):
+        self._cachedir = cachedir
+        self._maxsize = maxsize
+        self._minage = minage
+        self._namespace = namespace
+        self._stores = 0
+
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir, exist_ok=True)
+
+        self._size = sum(size for _, size, _ in self.entries())
+
+    @staticmethod
+    def fromconfig(resconf, namespace=""):
+        """ Create the cache configured for a resource or return None if caching is disabled.
+            The settings are "prom_cache_dir", "prom_cache_size" (MB, default 1024)
+            and "prom_cache_min_age" (seconds, default 3600). namespace identifies the
+            server and the transport that the responses come from.
+        """
+        if not resconf.get("prom_cache_dir"):
+            return None
+
+        maxsize = int(resconf.get("prom_cache_size", 1024)) * 1024 * 1024
+        minage = int(resconf.get("prom_cache_min_age", 3600))
+
+        return PromCache(resconf["prom_cache_dir"], maxsize, minage, namespace)
+
+    @staticmethod
+    def normalize(query):
+        """ Remove insignificant whitespace from a query """
+        return UNQUOTED_SPACE_RE.sub("", query.strip())
+
+    def path(self, query, start, end):
+        """ Location of the cache entry for a query """
+        key = "{0}\0{1}\0{2:.3f}\0{3:.3f}".format(self._namespace, self.normalize(query), float(start), float(end))
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self._cachedir, digest[:2], digest)
+
+    def cacheable(self, end):
+        """ Only cache data that is old enough that it will not change """
+        return end < time.time() - self._minage
+
+    def get(self, query, start, end):
+        """ Return the cached response or None """
+        if not self.cacheable(end):
+            return None
+
+        path = self.path(query, start, end)
+        try:
+            with open(path, "rb") as fp:
+                data = fp.read()
+            result = decode(data)
+        except FileNotFoundError:
+            return None
+        except (OSError, zlib.error, ValueError) as exc:
+            logging.warning("Ignoring unreadable cache entry %s: %s", path, exc)
+            return None
+
+        # The modification time records the last use for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return result
+
+    def put(self, query, start, end, result):
+        """ Store a response """
+        if result is None or not self.cacheable(end):
+            return
+
+        path = self.path(query, start, end)
+        try:
+            data = encode(result)
+        except (TypeError, ValueError) as exc:
+            logging.warning("Unable to cache the response of %s: %s", query, exc)
+            return
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp")
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(data)
+            os.replace(tmppath, path)
+        except OSError as exc:
+            logging.warning("Unable to write cache entry %s: %s", path, exc)
+            return
+
+        self._size += len(data)
+        self._stores += 1
+
+        if self._stores % self.RESCAN_INTERVAL == 0:
+            # Pick up the entries added by other processes
+            self._size = sum(size for _, size, _ in self.entries())
+
+        if self._size > self._maxsize:
+            self.evict()
+
+    def entries(self):
+        """ Generator that yields (path, size, last use) for all cache entries """
+        for dirpath, _, filenames in os.walk(self._cachedir):
+            for filename in filenames:
+                if filename.startswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache is below 90% of the size limit """
+        entries = sorted(self.entries(), key=lambda x: x[2])
+        total = sum(size for _, size, _ in entries)
+        target = 0.9 * self._maxsize
+
+        removed = 0
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+            removed += 1
+
+        logging.debug("Removed %s entries from the Prometheus cache", removed)
+        self._size = total
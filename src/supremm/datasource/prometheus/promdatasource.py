@@ -5,6 +5,7 @@ import re
 from supremm.datasource.datasource import Datasource
 from supremm.datasource.prometheus.prommapping import MappingManager
 from supremm.datasource.prometheus.prominterface import PromClient
+from supremm.datasource.prometheus import promremoteread
 from supremm.datasource.prometheus.promsummarize import PromSummarize
 from supremm.errors import ProcessingError
 
@@ -15,9 +16,24 @@ class PromDatasource(Datasource):
     def __init__(self, preprocs, plugins, resconf):
         super().__init__(preprocs, plugins)
 
-        self._client = PromClient(resconf)
+        self._client = PromDatasource.createclient(resconf)
         self._mapping = MappingManager(self.client)
 
+    @staticmethod
+    def createclient(resconf):
+        """ Create the client for the transport set by the "prom_transport"
+            resource setting ("query" (default) or "remote_read")
+        """
+        transport = resconf.get("prom_transport", "query")
+        if transport == "remote_read":
+            if promremoteread.available():
+                return promremoteread.PromRemoteReadClient(resconf)
+            logging.warning("The python-snappy module is required for the Prometheus remote read transport. Using the query API.")
+        elif transport != "query":
+            logging.warning("Invalid prom_transport setting: %s. Using the query API.", transport)
+
+        return PromClient(resconf)
+
     @property
     def client(self):
         return self._client
@@ -39,7 +55,7 @@ class PromDatasource(Datasource):
 
         # Initialize client and test connection
         if not self.client and not self.mapping:
-            self.client = PromClient(resconf)
+            self.client = PromDatasource.createclient(resconf)
             if not self.client.connection:
                 jobmeta.result = 1
                 jobmeta.mdata["skipped_no_prom_connection"] = True
@@ -71,6 +87,8 @@ class PromDatasource(Datasource):
             logging.info("Skipping %s, skipped_prom_error", job.job_id)
             jobmeta.error = ProcessingError.PROMETHEUS_CONNECTION
 
+        self.rerunversions(job, jobmeta, s)
+
         if opts['tag'] != None:
             jobmeta.mdata['tag'] = opts['tag']
 
@@ -7,6 +7,9 @@ import numpy as np
 import requests
 
 from supremm.config import Config
+from supremm.datasource.prometheus.promcache import PromCache
+from supremm.datasource.prometheus.prommapping import MappingManager, MergedQuery
+from supremm.datasource.prometheus.promstream import decode_response
 
 CHUNK_SIZE = 4 # HOURS
 
@@ -14,6 +17,9 @@ CHUNK_SIZE = 4 # HOURS
 class PromClient():
     """ Client class to interface with Prometheus """
 
+    # Name of the transport, part of the cache key
+    TRANSPORT = "query"
+
     def __init__(self, resconf):
         self._url = "http://{}".format(resconf['prom_host'])
 
@@ -29,6 +35,8 @@ class PromClient():
 
         self.connection = PromClient.build_info(self._client, self._url)
 
+        self._cache = PromCache.fromconfig(resconf, "{0} {1}".format(self._url, self.TRANSPORT))
+
     def __str__(self):
         return self._url
 
@@ -54,6 +62,30 @@ class PromClient():
     def query(self, query, time):
         """ Query an instantaneous value """
 
+        if self._cache is not None:
+            result = self._cache.get(query, time, time)
+            if result is None:
+                result = self.fetch_instant(query, time)
+                self._cache.put(query, time, time, result)
+            return result
+
+        return self.fetch_instant(query, time)
+
+    def query_raw(self, query, start, end):
+        """ Query the raw samples for a series selector between start and end """
+
+        if self._cache is not None:
+            result = self._cache.get(query, start, end)
+            if result is None:
+                result = self.fetch_raw(query, start, end)
+                self._cache.put(query, start, end, result)
+            return result
+
+        return self.fetch_raw(query, start, end)
+
+    def fetch_instant(self, query, time):
+        """ Instant query request to the Prometheus server """
+
         params = {
             'query': query,
             'time': time,
@@ -62,12 +94,20 @@ class PromClient():
         endpoint = "/api/v1/query"
         url = urlparse.urljoin(self._url, endpoint)
 
-        r = self._client.get(url, params=params)
+        # The response is decoded as it arrives so that the
+        # complete body is never held in memory
+        r = self._client.get(url, params=params, stream=True)
         if r.status_code != 200:
             print(str(r.content))
             return None
 
-        return r.json()
+        return decode_response(r)
+
+    def fetch_raw(self, query, start, end):
+        """ Raw data request to the Prometheus server.
+            A range is appended to the selector in an instant query at end.
+        """
+        return self.fetch_instant("{0}[{1}s]".format(query, int(end - start)), end)
 
     def query_range(self, query, start, end):
         """ Query a time range with a specified granularity """
@@ -169,10 +209,11 @@ class Context():
         while iterating through a Prometheus response
     """
 
-    def __init__(self, start, end, client):
+    def __init__(self, start, end, client, merge=True):
         self.start = start
         self.end = end
         self.client = client
+        self.merge = merge
 
         self.reqMetrics = None
         self.timestamp = start
@@ -235,16 +276,53 @@ class Context():
         self.reqMetrics = required_metrics
         self.init_internal_state()
         if self.mode == "all" or self.mode == "timeseries":
+            queries = self.mergedqueries(required_metrics)
             for start, end in self.chunk_timerange():
-                # Append a time range to an instant query to get raw data
-                yield [self.client.query(m.apply_range(start, end), end) for m in required_metrics]
+                yield self.runqueries(queries, lambda q: self.client.query_raw(q.query, start, end))
                 self.reset_internal_state()
 
         elif self.mode == "firstlast":
+            if all(m.firstlast != "raw" for m in required_metrics):
+                # The job-delta is computed by Prometheus. Plugins still expect
+                # a first and last value so the first value is all zeros.
+                queries = self.mergedqueries(required_metrics, pushdown=True)
+                result = self.runqueries(queries, lambda q: self.client.query(q.apply_firstlast(self.start, self.end), self.end))
+                yield [self.baselinevector(datum, self.start) for datum in result]
+                self.reset_internal_state()
+                yield result
+                self.reset_internal_state()
+                return
+
+            queries = self.mergedqueries(required_metrics)
             for ts in (self.start, self.end):
-                yield [self.client.query(m.query, ts) for m in required_metrics]
+                yield self.runqueries(queries, lambda q: self.client.query(q.query, ts))
                 self.reset_internal_state()
 
+    def mergedqueries(self, required_metrics, pushdown=False):
+        """ Group the required metrics into as few queries as possible """
+        if self.merge:
+            return MappingManager.mergequeries(required_metrics, pushdown)
+        return [MergedQuery([idx], [m]) for idx, m in enumerate(required_metrics)]
+
+    def runqueries(self, queries, fetchfn):
+        """ Run each query and return the responses in the order of the required metrics """
+        result = [None] * len(self.reqMetrics)
+        for q in queries:
+            for idx, datum in zip(q.indices, q.split(fetchfn(q))):
+                result[idx] = datum
+        return result
+
+    @staticmethod
+    def baselinevector(datum, ts):
+        """ Build a vector response that has the same instances as the
+            provided response with all values set to zero
+        """
+        if datum is None:
+            return None
+
+        result = [{"metric": inst["metric"], "value": [ts, "0"]} for inst in datum["data"]["result"]]
+        return {"status": datum.get("status"), "data": {"resultType": "vector", "result": result}}
+
     def chunk_timerange(self):
         """ Generator function that yields chunked time ranges for a job of arbitrary length
             Prometheus returns a maximum of 11,000 data points per query.
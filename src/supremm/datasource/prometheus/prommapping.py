@@ -1,10 +1,57 @@
 import os
+import re
 import logging
 import copy
 import json
 
 from supremm.config import Config
 
+# Label matcher types from the prompb LabelMatcher message
+MATCHER_TYPES = {"=": 0, "!=": 1, "=~": 2, "!~": 3}
+
+SELECTOR_RE = re.compile(r"^\s*([a-zA-Z_:][a-zA-Z0-9_:]*)?\s*(?:\{(.*)\})?\s*$")
+MATCHER_RE = re.compile(r"\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*(=~|!~|!=|=)\s*(['\"])((?:\\.|(?!\3).)*)\3\s*,?")
+
+
+def parse_selector(selector):
+    """ Convert a series selector such as name{label='value'} to a list of
+        (type, name, value) label matchers
+    """
+    m = SELECTOR_RE.match(selector)
+    if not m:
+        raise ValueError("Unsupported series selector: {}".format(selector))
+
+    matchers = []
+    if m.group(1):
+        matchers.append((MATCHER_TYPES["="], "__name__", m.group(1)))
+
+    labels = m.group(2) or ""
+    pos = 0
+    while pos < len(labels.rstrip()):
+        lm = MATCHER_RE.match(labels, pos)
+        if not lm:
+            raise ValueError("Unsupported label matcher in selector: {}".format(selector))
+        value = re.sub(r"\\(.)", r"\1", lm.group(4))
+        matchers.append((MATCHER_TYPES[lm.group(2)], lm.group(1), value))
+        pos = lm.end()
+
+    return matchers
+
+
+def quote(value):
+    """ Quote a label value for use in a selector """
+    return "'{}'".format(value.replace("\\", "\\\\").replace("'", "\\'"))
+
+
+def firstlast_query(query, mode, start, end):
+    """ Wrap a query so that Prometheus computes the change in the
+        metric between start and end. Evaluate the query at end.
+    """
+    window = int(end - start)
+    if mode == "increase":
+        return "increase({0}[{1}s])".format(query, window)
+    return "{0} - {0} offset {1}s".format(query, window)
+
 
 class MappingManager():
     """ Helper class to manage the mappings between PCP metrics and Prometheus metrics """
@@ -36,16 +83,17 @@ class MappingManager():
         # Populate common query params, defaults
         params = mapping["common"]["params"]
         defaults = mapping["common"]["defaults"]
+        firstlast = mapping["common"].get("firstlast", "raw")
 
         for pcp, prom in mapping["metrics"].items():
-            mmap = MappingManager.query_builder(params, defaults, prom)
+            mmap = MappingManager.query_builder(params, defaults, prom, firstlast)
             mapping["metrics"][pcp] = mmap
 
         logging.debug("Loaded metric mapping from {}".format(fpath))
         return mapping
 
     @staticmethod
-    def query_builder(params, defaults, prom_metric):
+    def query_builder(params, defaults, prom_metric, firstlast="raw"):
         """ Build base queries from mapping configuration """
 
         # Metric, params, defaults
@@ -83,13 +131,82 @@ class MappingManager():
         except KeyError:
             out_fmt = groupby
 
-        return MetricMapping(name, in_fmt, out_fmt, groupby, scaling, p[1:])
+        # Per-metric setting takes precedence over the common setting
+        firstlast = prom_metric.get("firstlast", firstlast)
+        if firstlast not in MetricMapping.FIRSTLAST_MODES:
+            logging.warning("Invalid firstlast mode '%s' for metric %s. Using raw queries.", firstlast, name)
+            firstlast = "raw"
+
+        return MetricMapping(name, in_fmt, out_fmt, groupby, scaling, p[1:], firstlast)
+
+    @staticmethod
+    def mergequeries(metrics, pushdown=False):
+        """ Combine metrics whose selectors differ only in the value of one
+            label into a single query with a regex matcher on that label.
+            Metrics are merged on the metric name unless Prometheus computes the
+            job-delta (pushdown), since arithmetic drops the metric name from the result.
+
+            return: list of MergedQuery that covers every metric once
+        """
+        selectors = []
+        for m in metrics:
+            try:
+                matchers = parse_selector(m.query)
+            except ValueError:
+                matchers = None
+            if matchers is not None and any(mtype != MATCHER_TYPES["="] for mtype, _, _ in matchers):
+                matchers = None
+            selectors.append(None if matchers is None else {name: value for _, name, value in matchers})
+
+        def mergekey(idx, label):
+            """ Key that is identical for metrics that can be merged on label """
+            if selectors[idx] is None or label not in selectors[idx]:
+                return None
+            if pushdown and label == "__name__":
+                return None
+            rest = tuple(sorted((k, v) for k, v in selectors[idx].items() if k != label))
+            return (metrics[idx].firstlast, rest)
+
+        groups = []
+        remaining = list(range(len(metrics)))
+        while remaining:
+            first = remaining[0]
+            best, bestlabel = [first], None
+            for label in (selectors[first] or {}):
+                key = mergekey(first, label)
+                if key is None:
+                    continue
+                members = [idx for idx in remaining if mergekey(idx, label) == key]
+                if len(members) > len(best):
+                    best, bestlabel = members, label
+
+            remaining = [idx for idx in remaining if idx not in best]
+
+            if bestlabel is None:
+                groups.append(MergedQuery(best, [metrics[first]]))
+                continue
+
+            values = [selectors[idx][bestlabel] for idx in best]
+            regex = "|".join(re.escape(v) for v in dict.fromkeys(values))
+            matchers = ["{}={}".format(k, quote(v)) for k, v in selectors[first].items() if k not in (bestlabel, "__name__")]
+            matchers.insert(0, "{}=~{}".format(bestlabel, quote(regex)))
+            name = "" if bestlabel == "__name__" else selectors[first].get("__name__", "")
+            query = "{0}{{{1}}}".format(name, ",".join(matchers))
+
+            groups.append(MergedQuery(best, [metrics[idx] for idx in best], bestlabel, values, query))
+
+        return groups
 
     @property
     def mapping(self):
         """ Dictionary of mappings between a PCP metric and a MetricMapping """
         return self._mapping["metrics"]
 
+    @property
+    def mergequeriesenabled(self):
+        """ Whether compatible metrics are fetched with a single query """
+        return self._mapping["common"].get("merge_queries", True)
+
     @property
     def client(self):
         """ Client used to query metadata """
@@ -192,13 +309,20 @@ class MetricMapping():
     Container class for mapping between PCP metrics and Prometheus metrics.
     """
 
-    def __init__(self, name, in_format, out_format, groupby, scaling, params):
+    # Supported ways to query data for "firstlast" plugins:
+    #   raw      - query the raw value at the start and end of the job
+    #   offset   - Prometheus computes the difference of the raw values (value - value offset <range>)
+    #   increase - Prometheus computes the counter increase over the job (handles counter resets)
+    FIRSTLAST_MODES = ("raw", "offset", "increase")
+
+    def __init__(self, name, in_format, out_format, groupby, scaling, params, firstlast="raw"):
         self._name = name
         self._queryformat = in_format
         self._outformat = out_format
         self._groupby = groupby
         self._scaling = scaling
         self._params = params
+        self._firstlast = firstlast
 
         self._query = None
 
@@ -234,6 +358,11 @@ class MetricMapping():
         """ Operation that should be appended to query """
         return self._scaling
 
+    @property
+    def firstlast(self):
+        """ How the job-delta is computed for "firstlast" plugins """
+        return self._firstlast
+
     @property
     def query(self):
         """ Query populated with necessary parameters """
@@ -243,10 +372,68 @@ class MetricMapping():
     def query(self, query):
         self._query = query
 
-    def apply_range(self, start, end):
-        """ Append range modifier for instant queries.
-            This queries raw data from Prometheus.
+    def apply_firstlast(self, start, end):
+        """ Wrap the query so that Prometheus computes the change in
+            the metric between start and end. Evaluate the query at end.
         """
-        range = end - start
-        query = self.query + "[{}s]".format(int(range))
-        return query
+        return firstlast_query(self.query, self.firstlast, start, end)
+
+
+class MergedQuery():
+    """
+    A single selector that fetches the data for several metrics. The selectors
+    of the metrics differ only in the value of one label, which is replaced
+    by a regex matcher. The response is split back into one response per metric
+    using that label.
+    """
+
+    def __init__(self, indices, metrics, label=None, values=None, query=None):
+        self._indices = indices
+        self._metrics = metrics
+        self._label = label
+        self._values = values
+        self._query = query if query is not None else metrics[0].query
+
+    def __str__(self):
+        return self.query
+
+    @property
+    def indices(self):
+        """ Positions of the metrics in the required metrics list """
+        return self._indices
+
+    @property
+    def metrics(self):
+        """ The MetricMappings fetched by this query """
+        return self._metrics
+
+    @property
+    def label(self):
+        """ Label used to split the response (None if the query is not merged) """
+        return self._label
+
+    @property
+    def query(self):
+        return self._query
+
+    @property
+    def firstlast(self):
+        return self._metrics[0].firstlast
+
+    def apply_firstlast(self, start, end):
+        return firstlast_query(self.query, self.firstlast, start, end)
+
+    def split(self, response):
+        """ Split a response into a list with one response per metric """
+        if self._label is None:
+            return [response]
+        if response is None:
+            return [None] * len(self._metrics)
+
+        byvalue = {}
+        for inst in response["data"]["result"]:
+            byvalue.setdefault(inst["metric"].get(self._label), []).append(inst)
+
+        resulttype = response["data"].get("resultType")
+        return [{"status": response.get("status"), "data": {"resultType": resulttype, "result": byvalue.get(value, [])}}
+                for value in self._values]
@@ -0,0 +1,252 @@
+""" Prometheus client that fetches raw samples with the remote read API.
+
+    The remote read API returns snappy-compressed protocol buffer messages
+    instead of JSON. The messages are decoded directly into numpy arrays,
+    which avoids the cost of generating and parsing the JSON text.
+    Instant queries (and the metadata queries) still use the HTTP API.
+
+    Requires the python-snappy module.
+"""
+import struct
+import logging
+import urllib.parse as urlparse
+
+import numpy as np
+
+from supremm.datasource.prometheus.prominterface import PromClient
+from supremm.datasource.prometheus.prommapping import parse_selector
+
+try:
+    import snappy
+    _HAS_SNAPPY = True
+except ImportError:
+    _HAS_SNAPPY = False
+
+# Prometheus marks the end of a series with a NaN that has this bit pattern
+STALE_NAN = 0x7ff0000000000002
+
+# Encoded length of a sample with a non-zero value and a millisecond
+# timestamp between 2^35 and 2^42 (1971 - 2109):
+# field tag, length, value tag, 8 byte double, timestamp tag, 6 byte varint
+SAMPLE_RECORD_SIZE = 18
+
+
+def available():
+    """ Whether the modules needed for remote read are installed """
+    return _HAS_SNAPPY
+
+
+def encode_varint(value):
+    """ protobuf base 128 varint encoding """
+    out = bytearray()
+    while True:
+        towrite = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(towrite | 0x80)
+        else:
+            out.append(towrite)
+            return bytes(out)
+
+
+def decode_varint(buf, pos):
+    """ Decode a varint at pos. Returns the value and the position after it """
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode_field(fieldnum, payload):
+    """ Length-delimited field """
+    return encode_varint((fieldnum << 3) | 2) + encode_varint(len(payload)) + payload
+
+
+def encode_int_field(fieldnum, value):
+    """ Varint field """
+    return encode_varint(fieldnum << 3) + encode_varint(value)
+
+
+def encode_readrequest(matchers, start_ms, end_ms):
+    """ Build a ReadRequest message with a single query that requests
+        the SAMPLES response type
+    """
+    query = encode_int_field(1, start_ms) + encode_int_field(2, end_ms)
+    for mtype, name, value in matchers:
+        matcher = encode_int_field(1, mtype) + encode_field(2, name.encode()) + encode_field(3, value.encode())
+        query += encode_field(3, matcher)
+
+    return encode_field(1, query) + encode_int_field(2, 0)
+
+
+def readfield(buf, pos):
+    """ Read the field at pos. Returns (fieldnum, wiretype, value, newpos). The value
+        of a varint field is the integer, of a length-delimited field it is the
+        start position of the payload and of a fixed size field it is the bytes.
+    """
+    key, pos = decode_varint(buf, pos)
+    fieldnum = key >> 3
+    wiretype = key & 0x7
+    if wiretype == 0:
+        value, pos = decode_varint(buf, pos)
+        return fieldnum, wiretype, value, pos
+    if wiretype == 1:
+        return fieldnum, wiretype, buf[pos:pos + 8], pos + 8
+    if wiretype == 2:
+        length, pos = decode_varint(buf, pos)
+        return fieldnum, wiretype, pos, pos + length
+    if wiretype == 5:
+        return fieldnum, wiretype, buf[pos:pos + 4], pos + 4
+
+    raise ValueError("Unsupported protobuf wire type {}".format(wiretype))
+
+
+def iterfields(buf, pos, end):
+    """ Generator that yields (fieldnum, wiretype, value, fieldend) for each field in a message """
+    while pos < end:
+        fieldnum, wiretype, value, pos = readfield(buf, pos)
+        yield fieldnum, wiretype, value, pos
+
+
+def decode_sample(buf, pos, end):
+    """ Decode a single Sample message """
+    value = 0.0
+    timestamp = 0
+    for fieldnum, wiretype, fieldval, _ in iterfields(buf, pos, end):
+        if fieldnum == 1 and wiretype == 1:
+            value = struct.unpack("<d", fieldval)[0]
+        elif fieldnum == 2 and wiretype == 0:
+            # int64 is two's complement
+            timestamp = fieldval - (1 << 64) if fieldval >= (1 << 63) else fieldval
+    return value, timestamp
+
+
+def decode_samplerun(buf, pos, end):
+    """ Vectorized decode of consecutive samples that all have the common
+        fixed-size encoding. Returns (values, timestamps, newpos).
+    """
+    nrecords = (end - pos) // SAMPLE_RECORD_SIZE
+    if nrecords == 0:
+        return None, None, pos
+
+    records = np.frombuffer(buf, np.uint8, nrecords * SAMPLE_RECORD_SIZE, pos).reshape(nrecords, SAMPLE_RECORD_SIZE)
+
+    good = (records[:, 0] == 0x12) & (records[:, 1] == 16) & (records[:, 2] == 0x09) & (records[:, 11] == 0x10)
+    good &= np.all(records[:, 12:17] & 0x80, axis=1) & ((records[:, 17] & 0x80) == 0)
+
+    nrun = nrecords if np.all(good) else int(np.argmin(good))
+    if nrun == 0:
+        return None, None, pos
+
+    run = records[:nrun]
+    values = np.ascontiguousarray(run[:, 3:11]).view("<f8").ravel()
+    timestamps = np.zeros(nrun, dtype=np.int64)
+    for i in range(6):
+        timestamps |= (run[:, 12 + i].astype(np.int64) & 0x7f) << (7 * i)
+
+    return values, timestamps, pos + nrun * SAMPLE_RECORD_SIZE
+
+
+def decode_timeseries(buf, pos, end):
+    """ Decode a TimeSeries message to a label dict and an (n, 2) array
+        of [timestamp in seconds, value]
+    """
+    labels = {}
+    values = []
+    timestamps = []
+
+    while pos < end:
+        if buf[pos] == 0x12:
+            runvals, runts, pos = decode_samplerun(buf, pos, end)
+            if runvals is not None:
+                values.append(runvals)
+                timestamps.append(runts)
+                continue
+
+        fieldnum, wiretype, fieldstart, pos = readfield(buf, pos)
+        if fieldnum == 1 and wiretype == 2:
+            name = value = ""
+            for lfield, _, lstart, lend in iterfields(buf, fieldstart, pos):
+                if lfield == 1:
+                    name = buf[lstart:lend].decode()
+                elif lfield == 2:
+                    value = buf[lstart:lend].decode()
+            labels[name] = value
+        elif fieldnum == 2 and wiretype == 2:
+            val, ts = decode_sample(buf, fieldstart, pos)
+            values.append(np.array([val]))
+            timestamps.append(np.array([ts], dtype=np.int64))
+
+    if values:
+        vals = np.concatenate(values)
+        ts = np.concatenate(timestamps)
+    else:
+        vals = np.empty(0)
+        ts = np.empty(0, dtype=np.int64)
+
+    notstale = vals.view(np.int64) != STALE_NAN
+    samples = np.empty((np.count_nonzero(notstale), 2))
+    samples[:, 0] = ts[notstale] / 1000.0
+    samples[:, 1] = vals[notstale]
+
+    return labels, samples
+
+
+def decode_readresponse(buf):
+    """ Decode a ReadResponse message to a list (one entry per query) of
+        lists of (labels, samples)
+    """
+    results = []
+    for fieldnum, _, resstart, resend in iterfields(buf, 0, len(buf)):
+        if fieldnum != 1:
+            continue
+        series = []
+        for tsfield, _, tsstart, tsend in iterfields(buf, resstart, resend):
+            if tsfield == 1:
+                series.append(decode_timeseries(buf, tsstart, tsend))
+        results.append(series)
+
+    return results
+
+
+class PromRemoteReadClient(PromClient):
+    """ Client that fetches raw samples using the Prometheus remote read API """
+
+    TRANSPORT = "remote_read"
+
+    def __init__(self, resconf):
+        super(PromRemoteReadClient, self).__init__(resconf)
+        self._readheaders = {
+            'Content-Encoding': 'snappy',
+            'Content-Type': 'application/x-protobuf',
+            'Accept-Encoding': 'snappy',
+            'X-Prometheus-Remote-Read-Version': '0.1.0'
+        }
+
+    def fetch_raw(self, query, start, end):
+        """ Remote read request for the raw samples of a series selector between start and end """
+
+        request = encode_readrequest(parse_selector(query), int(start * 1000), int(end * 1000))
+
+        endpoint = "/api/v1/read"
+        url = urlparse.urljoin(self._url, endpoint)
+        logging.debug('Prometheus REMOTE READ, start=%s end=%s', start, end)
+
+        r = self._client.post(url, data=snappy.compress(request), headers=self._readheaders)
+        if r.status_code != 200:
+            logging.error("Remote read error: %s", r.content)
+            return None
+
+        results = decode_readresponse(snappy.uncompress(r.content))
+
+        matrix = []
+        for labels, samples in (results[0] if results else []):
+            if len(samples) > 0:
+                matrix.append({"metric": labels, "values": samples})
+
+        return {"status": "success", "data": {"resultType": "matrix", "result": matrix}}
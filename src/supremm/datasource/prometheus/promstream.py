@@ -0,0 +1,124 @@
+""" Streaming decoder for Prometheus query API responses.
+
+    The series in the "result" list are decoded one at a time as the
+    response body arrives. The samples of each matrix series are converted
+    to an (n, 2) numpy array of [timestamp, value] and the JSON text is
+    discarded, so the memory used is bounded by the size of the largest
+    series rather than the size of the whole response.
+"""
+import re
+import json
+import codecs
+
+import numpy as np
+
+RESULT_RE = re.compile(r'"result"\s*:\s*\[')
+STATUS_RE = re.compile(r'"status"\s*:\s*"(\w+)"')
+RESULTTYPE_RE = re.compile(r'"resultType"\s*:\s*"(\w+)"')
+SEPARATOR_RE = re.compile(r'[\s,]*')
+
+# Size of the blocks read from the response body
+READ_SIZE = 256 * 1024
+
+
+class StreamDecoder():
+    """ Incrementally decodes the series from a query API response """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def read(self):
+        """ Append the next chunk of the body to the buffer. Returns False at the end of the body """
+        if self._eof:
+            return False
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._eof = True
+            self._buf += self._decoder.decode(b"", final=True)
+            return False
+
+        # Drop text that has already been decoded
+        if self._pos > len(self._buf) // 2:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+
+        self._buf += self._decoder.decode(chunk)
+        return True
+
+    def readall(self):
+        """ Read the rest of the body """
+        while self.read():
+            pass
+
+    def decode(self):
+        """ Decode the response. Returns the same structure as the query API
+            with the matrix samples converted to numpy arrays.
+        """
+        match = RESULT_RE.search(self._buf)
+        while match is None and self.read():
+            match = RESULT_RE.search(self._buf)
+
+        if match is None:
+            # Error responses do not have a result list
+            return json.loads(self._buf) if self._buf.strip() else None
+
+        header = self._buf[:match.start()]
+        status = STATUS_RE.search(header)
+        resulttype = RESULTTYPE_RE.search(header)
+        resulttype = resulttype.group(1) if resulttype else "matrix"
+
+        self._pos = match.end()
+        result = [self.compact(series, resulttype) for series in self.iterseries()]
+
+        # Any trailing content (such as warnings) is ignored
+        self.readall()
+
+        return {"status": status.group(1) if status else "success", "data": {"resultType": resulttype, "result": result}}
+
+    def iterseries(self):
+        """ Generator that yields each decoded entry in the result list """
+        while True:
+            self._pos = SEPARATOR_RE.match(self._buf, self._pos).end()
+            while self._pos >= len(self._buf):
+                if not self.read():
+                    raise ValueError("Truncated Prometheus response")
+                self._pos = SEPARATOR_RE.match(self._buf, self._pos).end()
+
+            if self._buf[self._pos] == "]":
+                self._pos += 1
+                return
+
+            # Read more until the entry is complete. The amount of text read
+            # doubles on each retry so that large entries are not decoded
+            # many times.
+            while True:
+                try:
+                    series, self._pos = self._json.raw_decode(self._buf, self._pos)
+                    break
+                except json.JSONDecodeError:
+                    target = 2 * (len(self._buf) - self._pos)
+                    if not self.read():
+                        raise
+                    while len(self._buf) - self._pos < target and self.read():
+                        pass
+
+            yield series
+
+    @staticmethod
+    def compact(series, resulttype):
+        """ Convert the sample values of a matrix series to a numpy array """
+        if resulttype == "matrix":
+            values = series.get("values", [])
+            series["values"] = np.array(values, dtype=np.float64) if values else np.empty((0, 2))
+        return series
+
+
+def decode_response(response):
+    """ Decode the body of a streamed requests response """
+    return StreamDecoder(response.iter_content(chunk_size=READ_SIZE)).decode()
@@ -9,6 +9,7 @@ import numpy as np
 from supremm.datasource.prometheus.prominterface import PromClient, Context
 from supremm.plugin import NodeMetadata
 from supremm.summarize import Summarize
+from supremm import codec
 
 
 class NodeMeta(NodeMetadata):
@@ -67,6 +68,8 @@ class PromSummarize(Summarize):
         if len(timeseries) > 0:
             timeseries['hosts'] = dict((str(idx), name) for idx, name in enumerate(self.job.nodenames()))
             timeseries['version'] = self.timeseries_version
+            if self.compact_timeseries:
+                codec.encode_timeseries(timeseries)
             output['timeseries'] = timeseries
 
         for preproc in self.preprocs:
@@ -78,10 +81,9 @@ class PromSummarize(Summarize):
             if 'errors' in data:
                 self.adderror(source, str(data['errors']))
 
-        if len(self.errors) > 0:
-            output['errors'] = {}
-            for k, v in self.errors.items():
-                output['errors'][k] = list(v)
+        errors = self.summaryerrors()
+        if len(errors) > 0:
+            output['errors'] = errors
 
         return output
 
@@ -138,7 +140,7 @@ class PromSummarize(Summarize):
         """ Process a single node from a job """
 
         start, end = self.job.start_datetime.timestamp(), self.job.end_datetime.timestamp()
-        ctx = Context(start, end, self.mapping.client)
+        ctx = Context(start, end, self.mapping.client, self.mapping.mergequeriesenabled)
 
         for preproc in self.preprocs:
             ctx.mode = preproc.mode
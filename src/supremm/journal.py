@@ -0,0 +1,128 @@
+""" Append-only journal of summarization progress.
+
+    Each line records an event for a job: dispatched (D), completed (C) or
+    failed (F). When a run is resumed the journal is read back so that jobs
+    that were completed are skipped and jobs that were in flight when the
+    previous run stopped are processed again.
+"""
+import os
+import time
+import logging
+import threading
+
+
+class Journal(object):
+    """ Records the progress of each job in an append-only file """
+
+    DISPATCHED = "D"
+    COMPLETED = "C"
+    FAILED = "F"
+
+    # Maximum time (seconds) between syncs of the journal to disk
+    FSYNC_INTERVAL = 5.0
+
+    def __init__(self, path, resume=False):
+        self._path = path
+        self._state = {}
+        self._partial = False
+        self._lock = threading.Lock()
+
+        if resume:
+            self.load()
+        elif os.path.exists(path):
+            logging.info("Starting new journal %s", path)
+
+        self._fp = open(path, "a" if resume else "w", buffering=1)
+        if self._partial:
+            self._fp.write("\n")
+        self._lastsync = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def key(resource_id, job):
+        """ Journal identifier of a job """
+        return "{0}/{1}".format(resource_id, job.job_pk_id)
+
+    def load(self):
+        """ Read the state of each job from an existing journal """
+        if not os.path.exists(self._path):
+            logging.warning("Journal %s not found. Processing all jobs.", self._path)
+            return
+
+        with open(self._path, "r") as fp:
+            for line in fp:
+                fields = line.split()
+                self._partial = not line.endswith("\n")
+                if self._partial or len(fields) != 2 or fields[0] not in (self.DISPATCHED, self.COMPLETED, self.FAILED):
+                    # Partial record written when the previous run stopped
+                    continue
+                self._state[fields[1]] = fields[0]
+
+        logging.info("Resuming from journal %s: %d jobs completed, %d jobs in flight, %d jobs failed",
+                     self._path, len(self.completedjobs()), len(self.inflightjobs()), len(self.failedjobs()))
+
+    def _jobs(self, event):
+        return set(key for key, state in self._state.items() if state == event)
+
+    def completedjobs(self):
+        """ Jobs that were completed """
+        return self._jobs(self.COMPLETED)
+
+    def inflightjobs(self):
+        """ Jobs that were dispatched but did not complete or fail """
+        return self._jobs(self.DISPATCHED)
+
+    def failedjobs(self):
+        """ Jobs that failed """
+        return self._jobs(self.FAILED)
+
+    def iscompleted(self, resource_id, job):
+        return self._state.get(self.key(resource_id, job)) == self.COMPLETED
+
+    def record(self, event, resource_id, job):
+        """ Append an event to the journal """
+        key = self.key(resource_id, job)
+        with self._lock:
+            self._state[key] = event
+            self._fp.write("{0} {1}\n".format(event, key))
+
+            now = time.time()
+            if now - self._lastsync > self.FSYNC_INTERVAL:
+                os.fsync(self._fp.fileno())
+                self._lastsync = now
+
+    def dispatched(self, resource_id, job):
+        self.record(self.DISPATCHED, resource_id, job)
+
+    def completed(self, resource_id, job):
+        self.record(self.COMPLETED, resource_id, job)
+
+    def failed(self, resource_id, job):
+        self.record(self.FAILED, resource_id, job)
+
+    def filter(self, resource_id, jobs):
+        """ Generator that skips the completed jobs and records the
+            dispatch of the others
+        """
+        skipped = 0
+        for job in jobs:
+            if self.iscompleted(resource_id, job):
+                skipped += 1
+                continue
+            self.dispatched(resource_id, job)
+            yield job
+
+        if skipped:
+            logging.info("Skipped %d jobs that were completed in a previous run", skipped)
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.flush()
+            os.fsync(self._fp.fileno())
+            self._fp.close()
+            self._fp = None
@@ -1,13 +1,35 @@
 
 import sys
 import os
-from pymongo import MongoClient
-from pymongo.errors import InvalidDocument
-import json
+import time
+import gzip
+import zlib
+import logging
+import datetime
+from pymongo import MongoClient, ReplaceOne, UpdateOne
+from pymongo.errors import InvalidDocument, BulkWriteError, PyMongoError
+
+from supremm.spool import Spool, Replayer
+from supremm.columnar import flatten, tocolumns, partition
+from supremm.serialize import dumps, CODEC_OPTIONS
+from supremm import codec
+
+try:
+    import zstandard
+    _HAS_ZSTD = True
+except ImportError:
+    _HAS_ZSTD = False
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    _HAS_PYARROW = True
+except ImportError:
+    _HAS_PYARROW = False
 
 class factory(object):
     """ output class generator helper """
-    def __init__(self, config, resconf, dry_run=False):
+    def __init__(self, config, resconf, dry_run=False, partial=False):
         outconf = config.getsection("outputdatabase")
 
         if 'db_engine' not in outconf and 'type' in outconf:
@@ -16,14 +38,24 @@ class factory(object):
             outconf['db_engine'] = outconf['type']
 
         if outconf['db_engine'].lower() == "mongodb":
-            self._impl = MongoOutput(outconf, resconf) if not dry_run else NullOutput()
+            if dry_run:
+                self._impl = NullOutput()
+            elif outconf.get('spool_dir'):
+                self._impl = SpoolOutput(outconf, resconf, MongoOutput(outconf, resconf, partial))
+            else:
+                self._impl = MongoOutput(outconf, resconf, partial)
         elif outconf['db_engine'].lower() == "stdout":
             self._impl = StdoutOutput(outconf, resconf)
         elif outconf['db_engine'] == 'file':
             self._impl = FileOutput(outconf, resconf)
+        elif outconf['db_engine'] == 'parquet':
+            self._impl = ParquetOutput(outconf, resconf)
         else:
             raise Exception("Unsupported output mechanism {0}".format(outconf['db_engine']))
 
+        if partial and outconf['db_engine'].lower() != "mongodb":
+            logging.warning("Partial updates are not supported by the %s output. The complete summaries are written.", outconf['db_engine'])
+
     def __enter__(self):
         return self._impl.__enter__()
 
@@ -31,14 +63,65 @@ class factory(object):
         return self._impl.__exit__(exception_type, exception_val, trace)
 
 
+class StreamFile(object):
+    """
+    Text file that is written incrementally, optionally with gzip or zstd
+    compression. The data written so far is flushed through the compressor
+    and synced to disk at most every fsync_interval seconds.
+    """
+    def __init__(self, path, compression=None, fsync_interval=30.0):
+        self._raw = open(path, 'wb')
+        self._fsync_interval = fsync_interval
+        self._lastsync = time.time()
+
+        if compression in (None, "none"):
+            self._stream = self._raw
+        elif compression == "gzip":
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode='wb')
+        elif compression == "zstd":
+            if not _HAS_ZSTD:
+                raise Exception("zstd compression requires the zstandard module")
+            self._stream = zstandard.ZstdCompressor().stream_writer(self._raw, closefd=False)
+        else:
+            raise Exception("Unsupported compression {0}".format(compression))
+
+    def write(self, text):
+        self._stream.write(text.encode("utf-8"))
+        if time.time() - self._lastsync >= self._fsync_interval:
+            self.sync()
+
+    def sync(self):
+        """ Flush the data written so far to disk """
+        if isinstance(self._stream, gzip.GzipFile):
+            self._stream.flush(zlib.Z_SYNC_FLUSH)
+        else:
+            self._stream.flush()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._lastsync = time.time()
+
+    def close(self):
+        if self._stream is not self._raw:
+            self._stream.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+
+
 class FileOutput(object):
     """
-    Dumps output into a file in one of two fashions
+    Dumps output into a file in one of three fashions
     1. Fragment - dumps snippets of json (currently one json object per job) into
                   a file as the process runs. This file will NOT be valid json, however
                   useful for pseudo interactive debugging purposes.
-    2. Complete - dumps entire result as one large json array at end of process.
-                  File will be empty during runtime, but will be valid json.
+    2. Complete - writes one json array with the summary and mdata of each job. The
+                  array is written as the process runs and is valid json once the
+                  process has finished.
+    3. Jsonl - writes the same elements as the complete array, one per line. Every
+               line that has been written is valid json.
+    The complete and jsonl files can be compressed ('compression' set to gzip or zstd)
+    and are synced to disk every 'fsync_interval' seconds. The json is compact unless
+    'json_indent' is set (this does not apply to jsonl).
     """
     def __init__(self, outconf, resconf):
         self._resid = resconf['resource_id']
@@ -50,12 +133,15 @@ class FileOutput(object):
         elif jsonoption == 'fragment':
             self._fragjson = True
             self._completejson = False
-        elif jsonoption == 'complete':
+        elif jsonoption in ('complete', 'jsonl'):
             self._fragjson = False
             self._completejson = True
         else:
             raise Exception("Not a valid json option {0}".format(jsonoption))
 
+        self._jsonlines = jsonoption == 'jsonl'
+        self._indent = outconf.get('json_indent')
+
         if self._fragjson:
             self._fragpath = outconf['frag_file']
         if self._completejson:
@@ -64,43 +150,231 @@ class FileOutput(object):
         if self._fragjson:
             self._fragfile = open(self._fragpath, 'w')
         if self._completejson:
-            self._jsonarray = []
+            self._compfile = StreamFile(self._comppath, outconf.get('compression'), float(outconf.get('fsync_interval', 30.0)))
+            self._elements = 0
+            if not self._jsonlines:
+                self._compfile.write("[")
 
     def __enter__(self):
         return self
 
+    def _writeelement(self, element):
+        if self._jsonlines:
+            self._compfile.write(dumps(element) + "\n")
+        else:
+            separator = ",\n" if self._elements > 0 else "\n"
+            self._compfile.write(separator + dumps(element, self._indent))
+        self._elements += 1
+
     def process(self, summary, mdata):
         """
         json print
         """
         if self._fragjson:
-            print(self._resid, json.dumps(summary, indent=4, default=str), file=self._fragfile)
-            print("MDATA: ", json.dumps(mdata, indent=4, default=str), file=self._fragfile)
+            print(self._resid, dumps(summary, self._indent), file=self._fragfile)
+            print("MDATA: ", dumps(mdata, self._indent), file=self._fragfile)
         if self._completejson:
-            self._jsonarray.append(summary)
-            self._jsonarray.append(mdata)
+            self._writeelement(summary)
+            self._writeelement(mdata)
 
     def __exit__(self, exception_type, exception_val, trace):
         if self._fragjson:
             self._fragfile.close()
         if self._completejson:
-            with open(self._comppath, 'w') as f:
-                json.dump(self._jsonarray, f, indent=4, default=str)
+            if not self._jsonlines:
+                self._compfile.write("\n]" if self._elements > 0 else "]")
+            self._compfile.close()
 
 
-class MongoOutput(object):
-    """ Support for mongodb output """
+class ParquetOutput(object):
+    """
+    Writes the scalar fields of the summaries (see supremm.columnar) to Parquet
+    files partitioned by resource and job end date:
+        <parquet_dir>/resource_id=<id>/end_date=<YYYY-MM-DD>/part-<time>-<pid>.parquet
+    The rows of each partition are buffered and written as one file once
+    row_group_size rows are buffered and at exit. If max_buffered_rows rows are
+    buffered in total the largest partition is written. process() returns the
+    id of the job and completed() returns the ids of the jobs whose rows were
+    written (and that could not be written) since the previous call.
+
+    The type of each column is fixed by the first rows that have it and kept
+    for the rest of the run. Numbers are always stored as float64 so that the
+    files share a schema. The files in a partition can have different
+    columns, readers should merge the schemas.
+    """
     def __init__(self, outconf, resconf):
+        if not _HAS_PYARROW:
+            raise Exception("Parquet output requires the pyarrow module")
+
+        self._directory = os.path.join(outconf['parquet_dir'], "resource_id={0}".format(resconf['resource_id']))
+        self._rowgroupsize = int(outconf.get('row_group_size', 10000))
+        self._compression = outconf.get('compression', 'zstd')
+        self._maxbuffered = int(outconf.get('max_buffered_rows', 5 * self._rowgroupsize))
+        self._buffers = {}
+        self._buffered = 0
+        self._files = 0
+        self._schema = {}
+        self._written = set()
+        self._failed = set()
+
+    def __enter__(self):
+        return self
+
+    def process(self, summary, mdata):
+        """ Buffer the summary record """
+        jobid = str(summary['acct']['id']) + '-' + str(summary['acct']['end_time'])
+        row = flatten(summary)
+        flatten(mdata, "summarization.", row)
+
+        key = partition(summary)
+        rows = self._buffers.setdefault(key, [])
+        rows.append((jobid, row))
+        self._buffered += 1
+        if len(rows) >= self._rowgroupsize:
+            self._write(key)
+        elif self._buffered >= self._maxbuffered:
+            # Jobs spread over many end dates. Write the largest partition
+            self._write(max(self._buffers, key=lambda k: len(self._buffers[k])))
+
+        return jobid
+
+    def _write(self, key):
+        buffered = self._buffers.pop(key, [])
+        if not buffered:
+            return
+        self._buffered -= len(buffered)
+        ids = [jobid for jobid, _ in buffered]
+
+        try:
+            columns, types = tocolumns([row for _, row in buffered], self._schema)
+            arrowtypes = {bool: pyarrow.bool_(), float: pyarrow.float64(), str: pyarrow.string(),
+                          datetime.datetime: pyarrow.timestamp("us")}
+            table = pyarrow.table(dict((name, pyarrow.array(values, type=arrowtypes[types[name]])) for name, values in columns.items()))
+
+            directory = os.path.join(self._directory, key)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self._files += 1
+            path = os.path.join(directory, "part-{0}-{1}-{2}.parquet".format(int(time.time()), os.getpid(), self._files))
+            pyarrow.parquet.write_table(table, path + ".tmp", compression=self._compression)
+            os.rename(path + ".tmp", path)
+        except Exception as exc:
+            logging.error("Failed to write %d jobs to %s: %s", len(buffered), key, exc)
+            self._failed.update(ids)
+            return
+
+        self._written.update(ids)
+        logging.debug("Wrote %d jobs to %s", len(buffered), path)
+
+    def completed(self):
+        """ Returns (written, failed): the ids of the jobs whose rows were written and
+            that could not be written since the previous call """
+        failed, self._failed = self._failed, set()
+        written, self._written = self._written - failed, set()
+        return written, failed
+
+    def flush(self):
+        """ Write the buffered rows. Returns the ids of the jobs that could not be written """
+        for key in list(self._buffers.keys()):
+            self._write(key)
+        return self.completed()[1]
+
+    def __exit__(self, exception_type, exception_val, trace):
+        failed = self.flush()
+        if failed:
+            logging.error("%d jobs were not written to the Parquet files", len(failed))
+
+
+# Summary fields that can be large on big jobs: the process lists of the Proc
+# preprocessor and the per-device outputs of the device based plugins
+COMPRESS_FIELDS = ("procDump", "block", "gpfs", "infiniband", "lustre", "network", "nfs")
+
+# Fields that a partial update merges into the stored field, and the depth of the merge
+MERGED_FIELDS = {"errors": 1, "summarization": 2}
+
+
+def setfields(fields, path, value, depth):
+    """ Add the $set fields for a value, one field per key of the nested dicts up to depth """
+    if depth > 0 and isinstance(value, dict):
+        for key, item in value.items():
+            setfields(fields, path + "." + str(key), item, depth - 1)
+    else:
+        fields[path] = value
+
+
+def partialupdate(document, insertonly=(), clearerrors=False):
+    """ Update operators that set the top level fields of a document on the stored
+        document. The fields in insertonly are only set when the document is created.
+        The errors and the summarization metadata (including the plugin versions) are
+        merged into the stored values. If clearerrors is set, the stored errors of the
+        categories that have an empty error list (the plugins and preprocessors that
+        were re-run without errors) are removed.
+    """
+    update = {"$set": {}}
+    for key, value in document.items():
+        if key == "_id":
+            continue
+        if key in insertonly:
+            update.setdefault("$setOnInsert", {})[key] = value
+        else:
+            setfields(update["$set"], key, value, MERGED_FIELDS.get(key, 0))
+
+    if clearerrors:
+        cleared = ["errors." + key for key, value in document.get("errors", {}).items() if not value]
+        for key in cleared:
+            del update["$set"][key]
+        if cleared:
+            update["$unset"] = dict((key, "") for key in cleared)
+
+    return update
+
+
+class MongoOutput(object):
+    """ Support for mongodb output.
+
+        The documents are buffered and written with unordered bulk writes once
+        bulk_size jobs are buffered or the oldest buffered job is bulk_interval
+        seconds old, and on flush(). process() returns the document id of the
+        job. completed() returns the ids of the jobs that were written and that
+        could not be written since the previous call, and flush() returns the
+        ids of the jobs that could not be written.
+
+        In partial mode the stored documents are updated rather than replaced:
+        only the fields in the summary (the results of the plugins that were
+        run and the summarization metadata) are set, so the results and the
+        versions of the other plugins are kept. The accounting data is only
+        set when the job has no stored summary.
+
+        If compress_threshold (KB) is set, the summary fields listed in
+        compress_fields (by default the process lists and the per-device
+        plugin outputs) that are larger than the threshold are stored
+        compressed. Use codec.decompress_summary() to read them.
+    """
+    def __init__(self, outconf, resconf, partial=False):
         self._uri = outconf['uri']
         self._dname = outconf.get('dbname', outconf.get('db', 'supremm'))
         self._collection = "resource_" + str(resconf['resource_id'])
         self._timeseries = "timeseries-" + self._collection
+        self._bulksize = int(outconf.get('bulk_size', 500))
+        self._bulkinterval = float(outconf.get('bulk_interval', 5.0))
         self._client = None
         self._outdb = None
+        self._pending = {self._timeseries: [], self._collection: []}
+        self._count = 0
+        self._oldest = None
+        self._written = set()
+        self._failed = set()
+        self._unavailable = False
+        self.unavailable = False
+        self._partial = partial
+        self._compressfields = outconf.get('compress_fields', COMPRESS_FIELDS)
+        self._compressthreshold = None
+        if outconf.get('compress_threshold') is not None:
+            self._compressthreshold = int(float(outconf['compress_threshold']) * 1024)
 
     def __enter__(self):
         self._client = MongoClient(host=self._uri)
-        self._outdb = self._client[self._dname]
+        self._outdb = self._client.get_database(self._dname, codec_options=CODEC_OPTIONS)
         return self
 
     def process(self, summary, mdata):
@@ -112,24 +386,137 @@ class MongoOutput(object):
 
         if 'timeseries' in summary:
             summary['timeseries']['_id'] = summary["_id"]
-            self._outdb[self._timeseries].update({"_id": summary["_id"]}, summary['timeseries'], upsert=True)
+            if self._partial:
+                op = UpdateOne({"_id": mongoid}, partialupdate(summary['timeseries']), upsert=True)
+            else:
+                op = ReplaceOne({"_id": mongoid}, summary['timeseries'], upsert=True)
+            self._pending[self._timeseries].append((mongoid, op))
             del summary['timeseries']
 
-        self._outdb[self._collection].update({"_id": summary["_id"]}, summary, upsert=True)
+        if self._compressthreshold is not None:
+            codec.compress_summary(summary, self._compressfields, self._compressthreshold)
+
+        if self._partial:
+            op = UpdateOne({"_id": mongoid}, partialupdate(summary, ("acct", "created"), clearerrors=True), upsert=True)
+        else:
+            op = ReplaceOne({"_id": mongoid}, summary, upsert=True)
+        self._pending[self._collection].append((mongoid, op))
+
+        self._count += 1
+        if self._oldest is None:
+            self._oldest = time.time()
+        self._writedue()
+
+        return mongoid
+
+    def _writedue(self):
+        """ Write the buffered documents if there are bulk_size of them or the oldest is bulk_interval seconds old """
+        if self._count >= self._bulksize or (self._oldest is not None and time.time() - self._oldest >= self._bulkinterval):
+            self._write()
+
+    def _write(self):
+        """ Write the buffered documents """
+        for collection, ops in self._pending.items():
+            if not ops:
+                continue
+            self._written.update(mongoid for mongoid, _ in ops)
+            try:
+                self._outdb[collection].bulk_write([op for _, op in ops], ordered=False)
+            except BulkWriteError as exc:
+                for error in exc.details.get('writeErrors', []):
+                    mongoid = ops[error['index']][0]
+                    logging.error("Failed to write job %s to %s: %s", mongoid, collection, error.get('errmsg'))
+                    self._failed.add(mongoid)
+            except PyMongoError as exc:
+                logging.error("Failed to write %d documents to %s: %s", len(ops), collection, exc)
+                self._failed.update(mongoid for mongoid, _ in ops)
+                self._unavailable = True
+            self._pending[collection] = []
+
+        self._count = 0
+        self._oldest = None
+
+    def completed(self):
+        """ Returns (written, failed): the ids of the jobs that were written and that could not
+            be written since the previous call. The buffered documents are only written if
+            they are due (see process()).
+        """
+        self._writedue()
+        failed, self._failed = self._failed, set()
+        written, self._written = self._written - failed, set()
+        self.unavailable, self._unavailable = self._unavailable, False
+        return written, failed
+
+    def flush(self):
+        """ Write the buffered documents. Returns the ids of the jobs that failed since the last flush.
+            The unavailable attribute is set if a write failed because of the database rather
+            than the document.
+        """
+        self._write()
+        return self.completed()[1]
 
     def __exit__(self, exception_type, exception_val, trace):
         if self._client != None:
+            failed = self.flush()
+            if failed:
+                logging.error("%d jobs were not written to the database", len(failed))
             self._outdb = None
             self._client.close()
             self._client = None
 
 
+class SpoolOutput(object):
+    """
+    Writes the summaries to a local spool (see supremm.spool) in the spool_dir directory.
+    A background thread replays the spool to the output database, so summarization
+    continues while the database is unavailable. flush() syncs the spool to disk so
+    jobs are marked as processed once their summary is stored locally.
+    """
+    def __init__(self, outconf, resconf, target):
+        directory = os.path.join(outconf['spool_dir'], str(resconf['resource_id']))
+        self._spool = Spool(directory, int(outconf.get('spool_segment_size', 64)) * 1024 * 1024, float(outconf.get('spool_max_age', 30.0)))
+        self._target = target
+        self._replayer = Replayer(self._spool, self._replay, float(outconf.get('spool_replay_interval', 10.0)))
+
+    def __enter__(self):
+        self._target.__enter__()
+        self._replayer.start()
+        return self
+
+    def process(self, summary, mdata):
+        """ Spool the summary record """
+        self._spool.append({"summary": summary, "mdata": mdata})
+
+    def flush(self):
+        """ Sync the spool to disk """
+        self._spool.sync()
+        return set()
+
+    def _replay(self, documents):
+        """ Write spooled documents to the output database. Returns the indices of the refused documents """
+        ids = []
+        for document in documents:
+            # The target modifies the top level of the summary, keep the spooled copy intact
+            ids.append(self._target.process(dict(document['summary']), document['mdata']))
+        failed = self._target.flush()
+        if self._target.unavailable:
+            raise Exception("Output database unavailable")
+        return [i for i, mongoid in enumerate(ids) if mongoid in failed]
+
+    def __exit__(self, exception_type, exception_val, trace):
+        self._spool.close()
+        self._replayer.stop()
+        self._target.__exit__(exception_type, exception_val, trace)
+
+
 class StdoutOutput(object):
     """
     Simple outputter that dumps the job summary to stdout. Intended for debug purposes.
+    Set 'json_indent' for readable output.
     """
-    def __init__(self, _, resconf):
+    def __init__(self, outconf, resconf):
         self._resid = resconf['resource_id']
+        self._indent = outconf.get('json_indent')
 
     def __enter__(self):
         return self
@@ -138,8 +525,8 @@ class StdoutOutput(object):
         """
         json print
         """
-        print(self._resid, json.dumps(summary, default=str, indent=4))
-        print("MDATA: ", json.dumps(mdata, default=str, indent=4))
+        print(self._resid, dumps(summary, self._indent))
+        print("MDATA: ", dumps(mdata, self._indent))
 
     def __exit__(self, exception_type, exception_val, trace):
         pass
@@ -0,0 +1,238 @@
+""" Background stage that writes the job summaries and marks the jobs as processed.
+
+    The results of the worker processes are queued to a writer thread so that
+    a slow output database does not hold up the collection of results. The
+    queue is bounded: when it is full the producer blocks until the writer
+    catches up. All of the queued results are written before close() returns.
+    The Committer marks the jobs as processed once their summaries are stored;
+    it is also used by the serial and MPI summarization loops.
+"""
+import time
+import queue
+import logging
+import threading
+import traceback
+import collections
+
+
+class Committer(object):
+    """ Marks jobs as processed once their summaries are written.
+
+        Outputters may buffer the summaries. An outputter with a completed()
+        method returns the keys (returned by process()) of the jobs that it
+        wrote and that it failed to write since the previous call, and writes
+        its buffer once it is large or old enough. flush() writes the whole
+        buffer and returns the keys of the jobs that could not be written.
+        Other outputters write each summary in process().
+
+        The jobs are marked as processed once their summary is written. The
+        accounting interfaces may buffer the process updates: they are flushed
+        once batchsize jobs are marked or the oldest was marked batchinterval
+        seconds ago (attributes of the interface), and finished(ctx, job,
+        success) is then called for the jobs.
+    """
+
+    def __init__(self, opts, finished):
+        self._opts = opts
+        self._finished = finished
+        # Jobs waiting for each outputter, in the order they were added
+        self._pending = collections.OrderedDict()
+        # Jobs waiting for each accounting interface: (dbif, time of the oldest, jobs)
+        self._marked = collections.OrderedDict()
+
+    def add(self, m, dbif, job, key, process_time, success, summarize_error, ctx=None):
+        """ Add a job whose summary was passed to the process() method of the outputter """
+        self._pending.setdefault(id(m), (m, []))[1].append((dbif, job, key, process_time, success, summarize_error, ctx))
+
+    def commit(self, force=False):
+        """ Mark the jobs whose summaries were written as processed. If force is
+            set the outputters and the accounting interfaces write all of their
+            buffered data """
+        for mid in list(self._pending):
+            m, pending = self._pending[mid]
+            written, failed = self._outcome(m, force)
+
+            remaining = []
+            for dbif, job, key, process_time, success, summarize_error, ctx in pending:
+                if failed is None or (key is not None and key in failed):
+                    self._finished(ctx, job, False)
+                elif written is None or key in written:
+                    if self._mark(dbif, job, process_time, success, summarize_error, ctx):
+                        self._marked.setdefault(id(dbif), (dbif, time.time(), []))[2].append((job, ctx))
+                else:
+                    remaining.append((dbif, job, key, process_time, success, summarize_error, ctx))
+
+            if remaining:
+                self._pending[mid] = (m, remaining)
+            else:
+                del self._pending[mid]
+
+        # The process updates are written before the jobs are recorded as finished
+        for did in list(self._marked):
+            dbif, oldest, jobs = self._marked[did]
+            if force or len(jobs) >= getattr(dbif, "batchsize", 1) or time.time() - oldest >= getattr(dbif, "batchinterval", 0):
+                del self._marked[did]
+                self._flushaccounting(dbif, jobs)
+
+    def _outcome(self, m, force):
+        """ Returns (written, failed) keys for an outputter. written is None if all of the
+            jobs that are not in failed were written and failed is None if the write failed """
+        try:
+            if not force and hasattr(m, "completed"):
+                return m.completed()
+            if hasattr(m, "flush"):
+                return None, m.flush() or ()
+            return None, ()
+        except Exception as e:
+            logging.error("Failure writing summaries. Error: %s %s", str(e), traceback.format_exc())
+            if self._opts["fail_fast"]:
+                raise
+            return None, None
+
+    def _mark(self, dbif, job, process_time, success, summarize_error, ctx):
+        """ Pass the process update of a job to the accounting interface. Returns whether
+            the job is waiting for the accounting interface to be flushed """
+        if self._opts['dry_run']:
+            self._finished(ctx, job, True)
+            return False
+        try:
+            dbif.markasdone(job, success, process_time, summarize_error)
+        except Exception as e:
+            logging.error("Failure marking job %s %s as processed. Error: %s %s", job.job_id, job.jobdir, str(e), traceback.format_exc())
+            if self._opts["fail_fast"]:
+                raise
+            self._finished(ctx, job, False)
+            return False
+        return True
+
+    def _flushaccounting(self, dbif, jobs):
+        try:
+            dbif.flush()
+            success = True
+        except Exception as e:
+            logging.error("Failure marking jobs as processed. Error: %s %s", str(e), traceback.format_exc())
+            if self._opts["fail_fast"]:
+                raise
+            success = False
+
+        for job, ctx in jobs:
+            self._finished(ctx, job, success)
+
+
+class OutputWriter(object):
+    """ Writes summaries in batches in a dedicated thread.
+
+        Each batch is passed to the outputters and the jobs are marked as
+        processed by a Committer once the outputters have stored them, so a
+        job is never marked as done before its summary is stored. The
+        outputters keep their own buffering: the remaining summaries are
+        written when the writer is closed.
+    """
+
+    def __init__(self, opts, progress, maxqueue=1000, batchsize=100):
+        self._opts = opts
+        self._progress = progress
+        self._batchsize = batchsize
+        self._committer = Committer(opts, self._finished)
+        self._queue = queue.Queue(maxqueue)
+        self._error = None
+        self._blocked = 0.0
+        self._written = 0
+        self._batches = 0
+        self._thread = threading.Thread(target=self._run, name="output-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(exc_type is None)
+
+    def submit(self, ctx, job, summarize_time, result):
+        """ Queue a result for writing. Blocks while the queue is full """
+        self._raise()
+        try:
+            self._queue.put_nowait((ctx, job, summarize_time, result))
+        except queue.Full:
+            start = time.time()
+            self._queue.put((ctx, job, summarize_time, result))
+            self._blocked += time.time() - start
+
+    def close(self, check=True):
+        """ Write the remaining results and stop the thread """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        logging.info("Output writer: %d jobs in %d batches, result collection blocked for %.1f seconds",
+                     self._written, self._batches, self._blocked)
+        if check:
+            self._raise()
+
+    def _raise(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        done = False
+        while not done:
+            batch = []
+            item = self._queue.get()
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self._batchsize:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            done = item is None
+
+            try:
+                if batch:
+                    self.write(batch)
+                if done:
+                    # Write the summaries that the outputters still buffer
+                    self._committer.commit(force=True)
+            except Exception as exc:
+                # Only raised in fail-fast mode. Later results are discarded.
+                self._error = exc
+                if not done:
+                    self._discard()
+                return
+
+    def _discard(self):
+        while self._queue.get() is not None:
+            pass
+
+    def write(self, batch):
+        """ Output the summaries in the batch and mark the jobs that were written as processed """
+        opts = self._opts
+
+        for ctx, job, summarize_time, result in batch:
+            if result is None:
+                self._finished(ctx, job, False)
+                continue
+            summary, mdata, success, summarize_error = result
+            try:
+                outputter_start = time.time()
+                key = ctx.m.process(summary, mdata)
+            except Exception as e:
+                logging.error("Failure processing summary for job %s %s. Error: %s %s", job.job_id, job.jobdir, str(e), traceback.format_exc())
+                if opts["fail_fast"]:
+                    raise
+                self._finished(ctx, job, False)
+                continue
+            self._committer.add(ctx.m, ctx.dbif, job, key, summarize_time + time.time() - outputter_start, success, summarize_error, ctx)
+
+        self._committer.commit()
+
+        self._written += len(batch)
+        self._batches += 1
+
+    def _finished(self, ctx, job, success):
+        self._progress.finished(ctx.resconf, job, success)
+        ctx.datasource.cleanup(self._opts, job)
@@ -62,6 +62,12 @@ class NodeMetadata(object, metaclass=ABCMeta):
 class Plugin(object, metaclass=ABCMeta):
     """ abstract base class describing the plugin interface """
 
+    # Increase the version when a change to the plugin changes its results
+    version = 1
+
+    # Names of the preprocessor data (see Job.getdata) that the plugin uses
+    requiredData = ()
+
     def __init__(self, job):
         self._job = job
         self._status = "uninitialized"
@@ -116,6 +122,9 @@ class PreProcessor(object, metaclass=ABCMeta):
     using the job.addata() function.
     """
 
+    # Increase the version when a change to the preprocessor changes its results
+    version = 1
+
     def __init__(self, job):
         self._job = job
         self._status = "uninitialized"
@@ -342,7 +351,7 @@ class RateConvertingTimeseriesPlugin(Plugin, metaclass=ABCMeta):
                 "min": self.collatedata(sortarr[:, 0], rates),
                 "max": self.collatedata(sortarr[:, -1], rates),
                 "med": self.collatedata(sortarr[:, sortarr.shape[1] // 2], rates),
-                "times": values[0, 1:, 0].tolist(),
+                "times": values[0, 1:, 0],
                 "hosts": {}
             }
 
@@ -353,7 +362,7 @@ class RateConvertingTimeseriesPlugin(Plugin, metaclass=ABCMeta):
         else:
             # Save data for all hosts
             retdata = {
-                "times": values[0, 1:, 0].tolist(),
+                "times": values[0, 1:, 0],
                 "hosts": {}
             }
             includelist = list(self._hostdata.keys())
@@ -361,7 +370,7 @@ class RateConvertingTimeseriesPlugin(Plugin, metaclass=ABCMeta):
 
         for hostidx in includelist:
             retdata['hosts'][str(hostidx)] = {}
-            retdata['hosts'][str(hostidx)]['all'] = rates[hostidx, :].tolist()
+            retdata['hosts'][str(hostidx)]['all'] = rates[hostidx, :]
 
         return retdata
 
@@ -13,6 +13,7 @@ class ArmPowerUsageTimeseries(Plugin):
 
     name = property(lambda x: "corepower")
     mode = property(lambda x: "timeseries")
+    requiredData = ("perf",)
     requiredMetrics = property(lambda x: ["perfevent.hwcounters.arm_a64fx__EA_CORE.value", "perfevent.hwcounters.arm_a64fx__EA_L2.value",
 "perfevent.hwcounters.arm_a64fx__EA_MEMORY.value"])
     optionalMetrics = property(lambda x: [])
@@ -84,7 +85,7 @@ class ArmPowerUsageTimeseries(Plugin):
                 "min": self.collatedata(sortarr[:, 0], rates),
                 "max": self.collatedata(sortarr[:, -1], rates),
                 "med": self.collatedata(sortarr[:, sortarr.shape[1] // 2], rates),
-                "times": values[0, 1:, 0].tolist(),
+                "times": values[0, 1:, 0],
                 "hosts": {}
             }
 
@@ -95,7 +96,7 @@ class ArmPowerUsageTimeseries(Plugin):
         else:
             # Save data for all hosts
             retdata = {
-                "times": values[0, 1:, 0].tolist(),
+                "times": values[0, 1:, 0],
                 "hosts": {}
             }
             includelist = self._hostdata.keys()
@@ -108,11 +109,11 @@ class ArmPowerUsageTimeseries(Plugin):
 
         for hostidx in includelist:
             retdata['hosts'][str(hostidx)] = {}
-            retdata['hosts'][str(hostidx)]['all'] = rates[hostidx, :].tolist()
+            retdata['hosts'][str(hostidx)]['all'] = rates[hostidx, :]
             retdata['hosts'][str(hostidx)]['dev'] = {}
             for devid in ['0', '1', '2']:
                 dpnts = len(values[hostidx, :, 0])
-                retdata['hosts'][str(hostidx)]['dev'][devid] = (scaling[devid] * numpy.diff(self._hostdata[hostidx][:dpnts, numpy.int(devid)]) / numpy.diff(values[hostidx, :, 0])).tolist()
+                retdata['hosts'][str(hostidx)]['dev'][devid] = (scaling[devid] * numpy.diff(self._hostdata[hostidx][:dpnts, numpy.int(devid)]) / numpy.diff(values[hostidx, :, 0]))
 
             retdata['hosts'][str(hostidx)]['names'] = {'0': 'cpu', '1': 'l2', '2': 'mem'}
 
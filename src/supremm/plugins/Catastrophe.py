@@ -10,6 +10,7 @@ class Catastrophe(Plugin):
 
     name = property(lambda x: "catastrophe")
     mode = property(lambda x: "all")
+    requiredData = ("perf",)
     requiredMetrics = property(lambda x: [["perfevent.hwcounters.MEM_LOAD_RETIRED_L1D_HIT.value"],
                                           ["perfevent.hwcounters.L1D_REPLACEMENT.value"],
                                           ["perfevent.hwcounters.L1D_REPL.value"],
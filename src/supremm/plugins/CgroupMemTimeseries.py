@@ -88,7 +88,7 @@ class CgroupMemTimeseries(Plugin):
                 "min": self.collatedata(sortarr[:, 0], memdata),
                 "max": self.collatedata(sortarr[:, -1], memdata),
                 "med": self.collatedata(sortarr[:, sortarr.shape[1] // 2], memdata),
-                "times": values[0, :, 0].tolist(),
+                "times": values[0, :, 0],
                 "hosts": {}
             }
 
@@ -99,7 +99,7 @@ class CgroupMemTimeseries(Plugin):
         else:
             # Save data for all hosts
             retdata = {
-                "times": values[0, :, 0].tolist(),
+                "times": values[0, :, 0],
                 "hosts": {}
             }
             includelist = list(self._hostdata.keys())
@@ -107,7 +107,7 @@ class CgroupMemTimeseries(Plugin):
 
         for hostidx in includelist:
             retdata['hosts'][str(hostidx)] = {}
-            retdata['hosts'][str(hostidx)]['all'] = values[hostidx, :, 1].tolist()
+            retdata['hosts'][str(hostidx)]['all'] = values[hostidx, :, 1]
 
         return retdata
 
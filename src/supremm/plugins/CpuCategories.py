@@ -12,6 +12,7 @@ class CpuCategories(Plugin):
 
     name = property(lambda x: "cpucategories")
     mode = property(lambda x: "all")
+    requiredData = ("proc",)
     requiredMetrics = property(lambda x: [[
         "kernel.percpu.cpu.user",
         "kernel.percpu.cpu.nice",
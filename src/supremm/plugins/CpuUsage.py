@@ -11,6 +11,7 @@ class CpuUsage(Plugin):
 
     name = property(lambda x: "cpu")
     mode = property(lambda x: "firstlast")
+    requiredData = ("proc",)
     requiredMetrics = property(lambda x: [[
             "kernel.percpu.cpu.user", 
             "kernel.percpu.cpu.idle", 
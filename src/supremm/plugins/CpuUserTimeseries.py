@@ -12,6 +12,7 @@ class CpuUserTimeseries(Plugin):
 
     name = property(lambda x: "cpuuser")
     mode = property(lambda x: "timeseries")
+    requiredData = ("proc",)
     requiredMetrics = property(lambda x: ["kernel.percpu.cpu.user"])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
@@ -80,7 +81,7 @@ class CpuUserTimeseries(Plugin):
                 "min": self.collatedata(sortarr[:, 0], rates),
                 "max": self.collatedata(sortarr[:, -1], rates),
                 "med": self.collatedata(sortarr[:, sortarr.shape[1] // 2], rates),
-                "times": values[0, 1:, 0].tolist(),
+                "times": values[0, 1:, 0],
                 "hosts": {}
             }
 
@@ -91,7 +92,7 @@ class CpuUserTimeseries(Plugin):
         else:
             # Save data for all hosts
             retdata = {
-                "times": values[0, 1:, 0].tolist(),
+                "times": values[0, 1:, 0],
                 "hosts": {}
             }
             includelist = list(self._hostdata.keys())
@@ -99,12 +100,12 @@ class CpuUserTimeseries(Plugin):
 
         for hostidx in includelist:
             retdata['hosts'][str(hostidx)] = {}
-            retdata['hosts'][str(hostidx)]['all'] = rates[hostidx, :].tolist()
+            retdata['hosts'][str(hostidx)]['all'] = rates[hostidx, :]
             retdata['hosts'][str(hostidx)]['dev'] = {}
 
             for devid in self._hostdevnames[hostidx].keys():
                 dpnts = len(values[hostidx, :, 0])
-                retdata['hosts'][str(hostidx)]['dev'][devid] = (numpy.diff(self._hostdata[hostidx][:dpnts, numpy.int(devid)]) / numpy.diff(values[hostidx, :, 0])).tolist()
+                retdata['hosts'][str(hostidx)]['dev'][devid] = (numpy.diff(self._hostdata[hostidx][:dpnts, numpy.int(devid)]) / numpy.diff(values[hostidx, :, 0]))
 
             retdata['hosts'][str(hostidx)]['names'] = self._hostdevnames[hostidx]
 
@@ -56,7 +56,7 @@ class GpuUsageTimeseries(Plugin):
                 "min": self.collatedata(sortarr[:, 0], memdata),
                 "max": self.collatedata(sortarr[:, -1], memdata),
                 "med": self.collatedata(sortarr[:, sortarr.shape[1] // 2], memdata),
-                "times": values[0, :, 0].tolist(),
+                "times": values[0, :, 0],
                 "hosts": {}
             }
 
@@ -67,7 +67,7 @@ class GpuUsageTimeseries(Plugin):
         else:
             # Save data for all hosts
             retdata = {
-                "times": values[0, :, 0].tolist(),
+                "times": values[0, :, 0],
                 "hosts": {}
             }
             includelist = list(self._hostdata.keys())
@@ -75,12 +75,12 @@ class GpuUsageTimeseries(Plugin):
 
         for hostidx in includelist:
             retdata['hosts'][str(hostidx)] = {}
-            retdata['hosts'][str(hostidx)]['all'] = values[hostidx, :, 1].tolist()
+            retdata['hosts'][str(hostidx)]['all'] = values[hostidx, :, 1]
             retdata['hosts'][str(hostidx)]['dev'] = {}
 
             for devid in self._hostdevnames[hostidx].keys():
                 dpnts = len(values[hostidx, :, 0])
-                retdata['hosts'][str(hostidx)]['dev'][devid] = self._hostdata[hostidx][:dpnts, int(devid)].tolist()
+                retdata['hosts'][str(hostidx)]['dev'][devid] = self._hostdata[hostidx][:dpnts, int(devid)]
 
             retdata['hosts'][str(hostidx)]['names'] = self._hostdevnames[hostidx]
 
@@ -10,6 +10,7 @@ class LoadAvg(Plugin):
 
     name = property(lambda x: "load1")
     mode = property(lambda x: "all")
+    requiredData = ("hinv",)
     requiredMetrics = property(lambda x: ["kernel.all.load"])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
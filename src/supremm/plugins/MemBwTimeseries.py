@@ -33,6 +33,7 @@ class MemBwTimeseries(Plugin):
 
     name = property(lambda x: "membw")
     mode = property(lambda x: "timeseries")
+    requiredData = ("perf",)
     requiredMetrics = property(lambda x: [SNB_METRICS, IVB_METRICS, NHM_METRICS])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
@@ -92,7 +93,7 @@ class MemBwTimeseries(Plugin):
                 "min": self.collatedata(sortarr[:, 0], rates),
                 "max": self.collatedata(sortarr[:, -1], rates),
                 "med": self.collatedata(sortarr[:, sortarr.shape[1] // 2], rates),
-                "times": values[0, 1:, 0].tolist(),
+                "times": values[0, 1:, 0],
                 "hosts": {}
             }
 
@@ -103,7 +104,7 @@ class MemBwTimeseries(Plugin):
         else:
             # Save data for all hosts
             retdata = {
-                "times": values[0, 1:, 0].tolist(),
+                "times": values[0, 1:, 0],
                 "hosts": {}
             }
             includelist = list(self._hostdata.keys())
@@ -111,12 +112,12 @@ class MemBwTimeseries(Plugin):
 
         for hostidx in includelist:
             retdata['hosts'][str(hostidx)] = {}
-            retdata['hosts'][str(hostidx)]['all'] = rates[hostidx, :].tolist()
+            retdata['hosts'][str(hostidx)]['all'] = rates[hostidx, :]
             retdata['hosts'][str(hostidx)]['dev'] = {}
 
             for devid in self._hostdevnames[hostidx].keys():
                 dpnts = len(values[hostidx, :, 0])
-                retdata['hosts'][str(hostidx)]['dev'][devid] = (numpy.diff(self._hostdata[hostidx][:dpnts, numpy.int(devid)]) / numpy.diff(values[hostidx, :, 0])).tolist()
+                retdata['hosts'][str(hostidx)]['dev'][devid] = (numpy.diff(self._hostdata[hostidx][:dpnts, numpy.int(devid)]) / numpy.diff(values[hostidx, :, 0]))
 
             retdata['hosts'][str(hostidx)]['names'] = self._hostdevnames[hostidx]
 
@@ -68,7 +68,7 @@ class PowerUsageTimeseries(Plugin):
                 "min": self.collatedata(sortarr[:, 0], power),
                 "max": self.collatedata(sortarr[:, -1], power),
                 "med": self.collatedata(sortarr[:, sortarr.shape[1] // 2], power),
-                "times": values[0, :, 0].tolist(),
+                "times": values[0, :, 0],
                 "hosts": {}
             }
 
@@ -79,7 +79,7 @@ class PowerUsageTimeseries(Plugin):
         else:
             # Save data for all hosts
             retdata = {
-                "times": values[0, :, 0].tolist(),
+                "times": values[0, :, 0],
                 "hosts": {}
             }
             includelist = list(self._hostdata.keys())
@@ -87,7 +87,7 @@ class PowerUsageTimeseries(Plugin):
 
         for hostidx in includelist:
             retdata['hosts'][str(hostidx)] = {}
-            retdata['hosts'][str(hostidx)]['all'] = power[hostidx, :].tolist()
+            retdata['hosts'][str(hostidx)]['all'] = power[hostidx, :]
 
         return retdata
 
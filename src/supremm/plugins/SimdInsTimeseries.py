@@ -22,6 +22,7 @@ class SimdInsTimeseries(Plugin):
 
     name = property(lambda x: "simdins")
     mode = property(lambda x: "timeseries")
+    requiredData = ("perf",)
     requiredMetrics = property(lambda x: [SNB_METRICS, NHM_METRICS, INTERLAGOS_METRICS])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
@@ -88,7 +89,7 @@ class SimdInsTimeseries(Plugin):
                 "min": self.collatedata(sortarr[:, 0], rates),
                 "max": self.collatedata(sortarr[:, -1], rates),
                 "med": self.collatedata(sortarr[:, sortarr.shape[1] // 2], rates),
-                "times": values[0, 1:, 0].tolist(),
+                "times": values[0, 1:, 0],
                 "hosts": {}
             }
 
@@ -99,7 +100,7 @@ class SimdInsTimeseries(Plugin):
         else:
             # Save data for all hosts
             retdata = {
-                "times": values[0, 1:, 0].tolist(),
+                "times": values[0, 1:, 0],
                 "hosts": {}
             }
             includelist = list(self._hostdata.keys())
@@ -107,12 +108,12 @@ class SimdInsTimeseries(Plugin):
 
         for hostidx in includelist:
             retdata['hosts'][str(hostidx)] = {}
-            retdata['hosts'][str(hostidx)]['all'] = rates[hostidx, :].tolist()
+            retdata['hosts'][str(hostidx)]['all'] = rates[hostidx, :]
             retdata['hosts'][str(hostidx)]['dev'] = {}
 
             for devid in self._hostdevnames[hostidx].keys():
                 dpnts = len(values[hostidx, :, 0])
-                retdata['hosts'][str(hostidx)]['dev'][devid] = (numpy.diff(self._hostdata[hostidx][:dpnts, numpy.int(devid)]) / numpy.diff(values[hostidx, :, 0])).tolist()
+                retdata['hosts'][str(hostidx)]['dev'][devid] = (numpy.diff(self._hostdata[hostidx][:dpnts, numpy.int(devid)]) / numpy.diff(values[hostidx, :, 0]))
 
             retdata['hosts'][str(hostidx)]['names'] = self._hostdevnames[hostidx]
 
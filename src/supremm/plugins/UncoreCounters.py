@@ -34,6 +34,7 @@ class UncoreCounters(Plugin):
 
     name = property(lambda x: "uncperf")
     mode = property(lambda x: "firstlast")
+    requiredData = ("perf",)
     requiredMetrics = property(lambda x: [SNB_METRICS, IVB_METRICS, NHM_METRICS, INTERLAGOS_METRICS])
     optionalMetrics = property(lambda x: [])
     derivedMetrics = property(lambda x: [])
@@ -0,0 +1,108 @@
+""" Per-plugin versions and selection of the jobs whose summaries are stale.
+
+    Each plugin and preprocessor class declares a version (the version class
+    attribute, default 1) that is increased when its results change. The
+    versions of the classes that produced a summary are stored in the
+    summarization.versions field. In stale mode the stored versions of each
+    job are compared with the current versions and only the out of date
+    plugins and preprocessors are run again, together with the plugins that
+    use the data of an out of date preprocessor and the preprocessors that
+    the selected plugins depend on. The results are merged into the stored
+    summary with a partial update.
+"""
+import logging
+
+from pymongo import MongoClient
+
+
+def classversions(classes):
+    """ Returns a dict of the version of each plugin or preprocessor class, keyed by class name """
+    return dict((c.__name__, getattr(c, "version", 1)) for c in classes)
+
+
+def stalenames(stored, current):
+    """ Names of the classes whose stored version is missing or older than the current version """
+    return set(name for name, version in current.items() if stored.get(name, 0) < version)
+
+
+def select(preprocessors, analytics, rerun):
+    """ Filter the plugin and preprocessor instances of a job to the ones in rerun, the
+        plugins that use the data of a preprocessor in rerun and the preprocessors that
+        the selected plugins depend on (the requiredData of the plugins) """
+    stale = set(p.name for p in preprocessors if type(p).__name__ in rerun)
+    analytics = [a for a in analytics if type(a).__name__ in rerun or stale.intersection(getattr(a, "requiredData", ()))]
+    required = set(name for a in analytics for name in getattr(a, "requiredData", ()))
+    preprocessors = [p for p in preprocessors if p.name in stale or p.name in required]
+    return preprocessors, analytics
+
+
+def summaryid(job):
+    """ Document id of the summary of a job in the output database """
+    return str(job.job_id) + '-' + str(job.acct['end_time'])
+
+
+class StoredVersions(object):
+    """ Reads the plugin versions of the summaries stored in the mongodb output database """
+
+    def __init__(self, outconf, resconf):
+        if outconf.get('db_engine', outconf.get('type', '')).lower() != "mongodb":
+            raise Exception("Selecting the jobs with stale plugin versions requires the mongodb output database")
+        self._uri = outconf['uri']
+        self._dname = outconf.get('dbname', outconf.get('db', 'supremm'))
+        self._collection = "resource_" + str(resconf['resource_id'])
+        self._client = None
+
+    def __enter__(self):
+        self._client = MongoClient(host=self._uri)
+        return self
+
+    def lookup(self, ids):
+        """ Returns a dict of the stored versions for each of the document ids that has a summary """
+        cursor = self._client[self._dname][self._collection].find({"_id": {"$in": list(ids)}}, {"summarization.versions": 1})
+        return dict((doc['_id'], doc.get('summarization', {}).get('versions', {})) for doc in cursor)
+
+    def __exit__(self, exception_type, exception_val, trace):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+
+def select_stale(jobs, stored, current, batchsize=500):
+    """
+    Generator that yields the jobs whose stored summary was produced by older versions of
+    the plugins. The rerun attribute of each job is set to the names of the plugins and
+    preprocessors to run. Jobs without a stored summary are skipped since there is nothing
+    to merge the results into.
+    """
+    total = 0
+    selected = 0
+
+    def flush(batch):
+        if not batch:
+            return
+        versions = stored.lookup(summaryid(job) for job in batch)
+        for job in batch:
+            jobversions = versions.get(summaryid(job))
+            if jobversions is None:
+                logging.debug("Skipping %s, no stored summary", job.job_id)
+                continue
+            rerun = stalenames(jobversions, current)
+            if rerun:
+                job.rerun = rerun
+                yield job
+
+    batch = []
+    for job in jobs:
+        total += 1
+        batch.append(job)
+        if len(batch) >= batchsize:
+            for stale in flush(batch):
+                selected += 1
+                yield stale
+            batch = []
+
+    for stale in flush(batch):
+        selected += 1
+        yield stale
+
+    logging.info("%d of %d jobs have stale plugin versions", selected, total)
@@ -5,6 +5,7 @@
 import sys
 from getopt import getopt
 import os
+import math
 import time
 import datetime
 import logging
@@ -20,6 +21,13 @@ def usage(has_mpi):
     print("  -r --resource RES     process only jobs on the specified resource")
     if not has_mpi:
         print("  -t --threads THEADS   number of concurrent processes to create")
+        print("     --min-threads N    adapt the number of concurrent jobs between N and THREADS")
+        print("                        based on the available memory and I/O wait")
+        print("     --memory-budget MB  only start a job if the estimated memory of the jobs in")
+        print("                        flight fits in MB. Larger jobs are deferred")
+        print("     --max-jobs-per-worker N  replace each worker process after N jobs")
+        print("     --max-worker-rss MB  replace a worker process after a job when it uses")
+        print("                        more than MB of memory")
     print("  -d --debug            set log level to debug")
     print("  -q --quiet            only log errors")
     print("  -s --start TIME       process all jobs that ended after the provided start")
@@ -33,6 +41,8 @@ def usage(has_mpi):
     print("  -C --process-current  when using a timerange, look for jobs with the current process version")
     print("  -b --process-big      when using a timerange, look for jobs that were previously marked as being too big")
     print("  -P --process-error N  when using a timerange, look for jobs that were previously marked with error N")
+    print("     --process-stale    when using a timerange, look for processed jobs whose stored summary was produced")
+    print("                        by older plugin versions and re-run only those plugins (mongodb output)")
     print("  -T --timeout SECONDS  amount of elapsed time from a job ending to when it")
     print("                        is marked as process even if the source data is not available")
     print("  -M --max-nodes NODES  only process jobs with fewer than this many nodes")
@@ -54,6 +64,21 @@ def usage(has_mpi):
     print("                        This directory will be emptied before used and no")
     print("                        subdirectories will be created. This option is ignored ")
     print("                        if multiple jobs are to be processed.")
+    if not has_mpi:
+        print("     --daemon           run continuously and summarize jobs as they finish")
+        print("     --poll-interval SECONDS   time between polls for finished jobs in daemon mode")
+        print("                               (default 300)")
+        print("     --daemon-lag SECONDS      only summarize jobs that ended more than SECONDS ago in")
+        print("                               daemon mode, to allow time for the job data to be indexed")
+        print("                               (default 600)")
+        print("     --queue NAME       share the jobs with other processes that use the same work queue")
+        print("                        name. Jobs are leased through the modw_supremm.process_lease table")
+        print("     --lease-time SECONDS   duration of the work queue leases (default 600)")
+        print("     --journal FILE     record the progress of each job in FILE")
+        print("     --resume           skip the jobs that the journal records as completed and")
+        print("                        reprocess the jobs that were in progress (requires --journal)")
+    print("     --partial-update   only update the fields of the stored summaries that are")
+    print("                        produced by the plugins that are run (mongodb output)")
     print("     --fail-fast        Don't suppress and log unknown exceptions during processing. Mainly used for testing.")
     print("  -n --dry-run          process jobs but do not write to database.")
     print("  -h --help             display this help message and exit.")
@@ -92,7 +117,20 @@ def getoptions(has_mpi):
         "force_timeout": 2 * 24 * 3600,
         "resource": None,
         "dry_run": False,
-        "fail_fast": False
+        "fail_fast": False,
+        "journal": None,
+        "resume": False,
+        "daemon": False,
+        "poll_interval": 300,
+        "daemon_lag": 600,
+        "queue": None,
+        "lease_time": 600,
+        "min_threads": None,
+        "memory_budget": None,
+        "max_jobs_per_worker": None,
+        "max_worker_rss": None,
+        "partial_update": False,
+        "process_stale": False
     }
 
     opts, _ = getopt(sys.argv[1:], "ABONCbP:M:j:r:t:dqs:e:LT:t:D:Eo:hn",
@@ -124,7 +162,20 @@ def getoptions(has_mpi):
                       "output=",
                       "help",
                       "dry-run",
-                      "fail-fast"])
+                      "fail-fast",
+                      "journal=",
+                      "resume",
+                      "daemon",
+                      "poll-interval=",
+                      "daemon-lag=",
+                      "queue=",
+                      "lease-time=",
+                      "min-threads=",
+                      "memory-budget=",
+                      "max-jobs-per-worker=",
+                      "max-worker-rss=",
+                      "partial-update",
+                      "process-stale"])
 
     for opt in opts:
         if opt[0] in ("-j", "--localjobid"):
@@ -183,10 +234,49 @@ def getoptions(has_mpi):
             retdata["dry_run"] = True
         if opt[0] == "--fail-fast":
             retdata["fail_fast"] = True
+        if opt[0] == "--journal":
+            retdata["journal"] = opt[1]
+        if opt[0] == "--resume":
+            retdata["resume"] = True
+        if opt[0] == "--daemon":
+            retdata["daemon"] = True
+        if opt[0] == "--poll-interval":
+            retdata["poll_interval"] = int(opt[1])
+        if opt[0] == "--daemon-lag":
+            retdata["daemon_lag"] = int(opt[1])
+        if opt[0] == "--queue":
+            retdata["queue"] = opt[1]
+        if opt[0] == "--lease-time":
+            retdata["lease_time"] = int(opt[1])
+        if opt[0] == "--min-threads":
+            retdata["min_threads"] = int(opt[1])
+        if opt[0] == "--memory-budget":
+            retdata["memory_budget"] = int(opt[1])
+        if opt[0] == "--max-jobs-per-worker":
+            retdata["max_jobs_per_worker"] = int(opt[1])
+        if opt[0] == "--max-worker-rss":
+            retdata["max_worker_rss"] = int(opt[1])
+        if opt[0] == "--partial-update":
+            retdata["partial_update"] = True
+        if opt[0] == "--process-stale":
+            retdata["process_stale"] = True
         if opt[0] in ("-h", "--help"):
             usage(has_mpi)
             sys.exit(0)
 
+    if retdata['resume'] and retdata['journal'] is None:
+        usage(has_mpi)
+        sys.exit(1)
+
+    if retdata['process_stale']:
+        if starttime == None or endtime == None:
+            usage(has_mpi)
+            sys.exit(1)
+        # The stale jobs are selected from the processed jobs and the results of
+        # the plugins that are run again are merged into the stored summaries
+        retdata['process_current'] = True
+        retdata['partial_update'] = True
+
     if retdata['extractonly']:
         # extract-only supresses archive delete
         retdata['dodelete'] = False
@@ -264,3 +354,73 @@ def filter_plugins(resconf, preprocs, plugins):
         filtered_plugins = [x for x in plugins if x.__name__ not in resconf['plugin_blacklist']]
 
     return filtered_preprocs, filtered_plugins
+
+def resource_share(resconf):
+    """ Fair-share weight of a resource when jobs from several resources are
+        processed together (the "share" setting, default 1) """
+    return max(1, int(resconf.get('share', 1)))
+
+def interleave(streams):
+    """ Smooth weighted round-robin over several iterators. streams is a list of
+        (weight, iterable). Yields the items of all of the iterators so that each
+        receives a share of the output in proportion to its weight. An iterator
+        is dropped when it is exhausted and the others continue.
+    """
+    active = [[weight, 0, iter(items)] for weight, items in streams]
+
+    while active:
+        total = sum(s[0] for s in active)
+        for s in active:
+            s[1] += s[0]
+        selected = max(active, key=lambda s: s[1])
+        selected[1] -= total
+
+        try:
+            yield next(selected[2])
+        except StopIteration:
+            active.remove(selected)
+
+
+# Jobs are sent to the MPI workers in batches that take about this many seconds to process
+TARGET_BATCH_TIME = 10.0
+MAX_BATCH_SIZE = 50
+
+# Minimum and maximum number of batches queued for each MPI worker. The depth is
+# raised so that the queued work lasts longer than the jobs that rank 0 runs
+# itself, during which it does not send batches to the workers
+PREFETCH_BATCHES = 2
+MAX_PREFETCH_BATCHES = 20
+
+class BatchSizer(object):
+    """ Chooses the number of jobs to send to an MPI worker at once so that each
+        batch takes about TARGET_BATCH_TIME seconds to process, and the number
+        of batches to queue for each worker.
+    """
+
+    def __init__(self):
+        self.jobs = 0
+        self.elapsed = 0.0
+        self.longestjob = 0.0
+
+    def update(self, njobs, elapsed, longest):
+        """ Record that njobs jobs took elapsed seconds, the longest of them longest seconds """
+        self.jobs += njobs
+        self.elapsed += elapsed
+        self.longestjob = max(self.longestjob, longest)
+
+    def size(self):
+        """ Number of jobs in a batch """
+        if self.jobs == 0 or self.elapsed <= 0:
+            return 1
+        avg = self.elapsed / self.jobs
+        return max(1, min(MAX_BATCH_SIZE, int(TARGET_BATCH_TIME / avg)))
+
+    def depth(self):
+        """ Number of batches to queue for each worker. One batch is being processed
+            and the rest must last for the longest job seen so far, which is how
+            long rank 0 may be busy before it can send more batches """
+        if self.jobs == 0 or self.elapsed <= 0:
+            return PREFETCH_BATCHES
+        batchtime = self.size() * self.elapsed / self.jobs
+        needed = 1 + int(math.ceil(self.longestjob / batchtime))
+        return max(PREFETCH_BATCHES, min(MAX_PREFETCH_BATCHES, needed))
@@ -0,0 +1,45 @@
+""" Serialization of job summaries.
+
+    Plugins can return numpy arrays and numpy scalars in their results. They
+    are converted when the summary is written: by the JSON encoder in dumps()
+    and by the BSON fallback encoder in CODEC_OPTIONS for MongoDB and the
+    spool. Numpy arrays are also much cheaper than lists of floats to pickle
+    when results are sent back from the worker processes.
+"""
+import json
+import datetime
+
+import numpy
+from bson.codec_options import CodecOptions, TypeRegistry
+
+
+def tonative(value):
+    """ Convert a numpy array or scalar to the equivalent python type.
+        Other values are returned unchanged. """
+    if isinstance(value, numpy.ndarray):
+        return value.tolist()
+    if isinstance(value, numpy.generic):
+        return value.item()
+    return value
+
+
+def _jsondefault(value):
+    converted = tonative(value)
+    if converted is not value:
+        return converted
+    if isinstance(value, datetime.datetime):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+
+def dumps(document, indent=None):
+    """ JSON encoding of a document. Compact unless an indent is given """
+    if indent is None:
+        return json.dumps(document, default=_jsondefault, separators=(",", ":"))
+    return json.dumps(document, default=_jsondefault, indent=indent)
+
+
+# BSON encoding options that convert numpy values
+CODEC_OPTIONS = CodecOptions(type_registry=TypeRegistry(fallback_encoder=tonative))
@@ -0,0 +1,219 @@
+""" Durable local spool of job summaries.
+
+    Summaries are appended to segment files in a local directory as BSON
+    documents written back to back (each document starts with its own length).
+    A segment is sealed when it reaches the size limit or the age limit, and
+    sealed segments are replayed to the output database by a background thread.
+    A segment is deleted once all of its documents have been written, so a
+    segment that is only partially replayed when the process stops is replayed
+    again in full; the writes must therefore be idempotent.
+
+    File names:
+        <seq>-<pid>.open           segment that is being written
+        <seq>-<pid>.seg            sealed segment waiting to be replayed
+        <seq>-<pid>.seg.<pid>      segment claimed by the replayer of a process
+        rejected-<seq>-<pid>.seg   documents that the database refused
+"""
+import os
+import glob
+import time
+import errno
+import struct
+import logging
+import threading
+
+import bson
+
+from supremm.serialize import CODEC_OPTIONS
+
+LENGTH = struct.Struct("<i")
+
+
+def pidrunning(pid):
+    """ Whether a process with the pid exists """
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno == errno.EPERM
+    return True
+
+
+def read_segment(path):
+    """ Generator that yields the documents in a segment. A truncated document
+        at the end of the file (from a crash during a write) is ignored.
+    """
+    with open(path, "rb") as fp:
+        data = fp.read()
+
+    offset = 0
+    while offset + LENGTH.size <= len(data):
+        length, = LENGTH.unpack_from(data, offset)
+        if length < 5 or offset + length > len(data):
+            logging.warning("Ignoring truncated document at offset %d in %s", offset, path)
+            break
+        yield bson.decode(data[offset:offset + length])
+        offset += length
+
+
+class Spool(object):
+    """ Appends documents to segment files """
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, max_age=30.0):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._fp = None
+        self._path = None
+        self._opened = None
+        self._seq = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.recover()
+
+    def recover(self):
+        """ Seal the segments left open and release the segments claimed by
+            processes that have exited """
+        for path in glob.glob(os.path.join(self.directory, "*.open")):
+            pid = int(os.path.basename(path).split(".")[0].split("-")[-1])
+            if pid != os.getpid() and not pidrunning(pid):
+                logging.info("Recovering spool segment %s", path)
+                os.rename(path, path[:-len(".open")] + ".seg")
+
+        for path in glob.glob(os.path.join(self.directory, "*.seg.*")):
+            pid = int(path.rsplit(".", 1)[1])
+            if pid != os.getpid() and not pidrunning(pid):
+                os.rename(path, path.rsplit(".", 1)[0])
+
+    def append(self, document):
+        """ Add a document to the current segment """
+        data = bson.encode(document, codec_options=CODEC_OPTIONS)
+        with self._lock:
+            if self._fp is None:
+                self._seq += 1
+                self._path = os.path.join(self.directory, "{0:019d}{1:04d}-{2}.open".format(time.time_ns(), self._seq % 10000, os.getpid()))
+                self._fp = open(self._path, "ab")
+                self._opened = time.time()
+            self._fp.write(data)
+            if self._fp.tell() >= self.segment_size:
+                self._seal()
+
+    def sync(self):
+        """ Write the current segment to disk """
+        with self._lock:
+            if self._fp is not None:
+                self._fp.flush()
+                os.fsync(self._fp.fileno())
+
+    def seal(self, force=False):
+        """ Seal the current segment if it is older than max_age """
+        with self._lock:
+            if self._fp is not None and (force or time.time() - self._opened >= self.max_age):
+                self._seal()
+
+    def _seal(self):
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._fp.close()
+        os.rename(self._path, self._path[:-len(".open")] + ".seg")
+        self._fp = None
+
+    def close(self):
+        self.seal(force=True)
+
+    def claim(self):
+        """ Claim the oldest sealed segment. Returns its path or None """
+        for path in sorted(glob.glob(os.path.join(self.directory, "[0-9]*.seg"))):
+            claimed = "{0}.{1}".format(path, os.getpid())
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                # Claimed by another process
+                continue
+            return claimed
+        return None
+
+    def release(self, path):
+        """ Return a claimed segment to the spool """
+        os.rename(path, path.rsplit(".", 1)[0])
+
+    def reject(self, documents):
+        """ Keep documents that cannot be written for inspection """
+        path = os.path.join(self.directory, "rejected-{0:019d}-{1}.seg".format(time.time_ns(), os.getpid()))
+        with open(path, "wb") as fp:
+            for document in documents:
+                fp.write(bson.encode(document))
+        return path
+
+    def pending(self):
+        """ Number of segments that have not been replayed """
+        return len(glob.glob(os.path.join(self.directory, "[0-9]*.seg*")))
+
+
+class Replayer(object):
+    """ Background thread that writes the sealed segments of a spool to a target.
+
+        write(documents) must store the documents idempotently and return the
+        indices of the documents that were refused. It raises if the target
+        is unavailable, in which case the segment is retried after interval
+        seconds.
+    """
+
+    def __init__(self, spool, write, interval=10.0):
+        self.spool = spool
+        self.write = write
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="spool-replay")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, drain=True):
+        """ Stop the thread. Optionally replay the remaining sealed segments first """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if drain:
+            try:
+                self.replay()
+            except Exception as exc:
+                logging.warning("Unable to replay the spool: %s. %d segments remain in %s",
+                                exc, self.spool.pending(), self.spool.directory)
+
+    def _run(self):
+        while True:
+            self.spool.seal()
+            try:
+                self.replay()
+            except Exception as exc:
+                logging.warning("Unable to replay the spool: %s", exc)
+            if self._stop.wait(self.interval):
+                return
+
+    def replay(self):
+        """ Replay all of the sealed segments. Returns the number of documents written """
+        written = 0
+        while True:
+            path = self.spool.claim()
+            if path is None:
+                return written
+            try:
+                documents = list(read_segment(path))
+                refused = self.write(documents) if documents else ()
+            except Exception:
+                self.spool.release(path)
+                raise
+
+            if refused:
+                rejected = self.spool.reject([documents[i] for i in refused])
+                logging.error("%d spooled documents were refused by the database. They were saved in %s", len(refused), rejected)
+
+            os.unlink(path)
+            written += len(documents) - len(refused)
+            logging.debug("Replayed %d documents from %s", len(documents), path)
@@ -4,6 +4,17 @@ from abc import ABC, abstractmethod
 VERSION = "1.0.6"
 TIMESERIES_VERSION = 4
 
+# Timeseries schema with the arrays stored as binary blobs (see supremm.codec)
+COMPACT_TIMESERIES_VERSION = 5
+
+
+def usecompacttimeseries(config):
+    """ Whether the output database is configured to store the timeseries in the compact binary schema """
+    try:
+        return config.getsection("outputdatabase").get("timeseries_format") == "binary"
+    except (KeyError, AttributeError):
+        return False
+
 
 class Summarize(ABC):
     """ Abstract base class describing the job summarization interface.
@@ -19,6 +30,7 @@ class Summarize(ABC):
 
         self.version = VERSION
         self.timeseries_version = TIMESERIES_VERSION
+        self.compact_timeseries = usecompacttimeseries(config)
 
     @abstractmethod
     def get(self):
@@ -34,6 +46,25 @@ class Summarize(ABC):
         else:
             self.errors[category].add(errormsg)
 
+    def produced(self):
+        """ The preprocessors and analytics that produced a result for the summary """
+        produced = []
+        if self.job.nodecount > 0:
+            produced.extend(x for x in self.alltimestamps + self.firstlast if x.status != "uninitialized")
+        produced.extend(x for x in self.preprocs if x.status != "uninitialized" and x.results() is not None)
+        return produced
+
+    def summaryerrors(self):
+        """ The errors of the summary by category. The summary of a re-run also has an
+            empty list for each category that produced a result without errors, so that
+            the stored errors of the category are cleared
+        """
+        errors = dict((k, list(v)) for k, v in self.errors.items())
+        if getattr(self.job, "rerun", None) is not None:
+            for x in self.produced():
+                errors.setdefault(x.name, [])
+        return errors
+
     @abstractmethod
     def process(self):
         """ Main entry point. All of a job's nodes are processed """
@@ -5,17 +5,28 @@
 
 import logging
 import os
+import sys
 import time
+import signal
+import threading
+import contextlib
+import collections
 import traceback
-import multiprocessing as mp
+from resource import getrusage, RUSAGE_SELF, RUSAGE_CHILDREN
 from supremm.config import Config
 from supremm.account import DbAcct
 from supremm.xdmodaccount import XDMoDAcct
 from supremm import outputter
 from supremm.plugin import loadplugins, loadpreprocessors
-from supremm.proc_common import getoptions, override_defaults, filter_plugins
+from supremm.proc_common import getoptions, override_defaults, filter_plugins, interleave, resource_share
 from supremm.scripthelpers import setuplogger
 from supremm.datasource.factory import DatasourceFactory
+from supremm.journal import Journal
+from supremm.workqueue import WorkQueue
+from supremm.concurrency import ConcurrencyController, Dispatcher, WorkerPool, resetpeakrss, peakrss
+from supremm.costmodel import CostModel
+from supremm.outputwriter import OutputWriter, Committer
+from supremm.pluginversions import StoredVersions, select_stale
 
 
 def get_jobs(opts, account):
@@ -31,27 +42,73 @@ def get_jobs(opts, account):
         return account.get(None, None)
 
 
-def process_summary(m, dbif, opts, job, summarize_time, result):
+def process_summary(m, dbif, opts, job, summarize_time, result, committer):
+    """ Output the summary. The job is marked as processed by the committer once
+        the outputter has written it. Returns whether this was successful """
     summary, mdata, success, summarize_error = result
     try:
-        # TODO: change behavior so markasdone only happens if this is successful
         outputter_start = time.time()
-        m.process(summary, mdata)
+        key = m.process(summary, mdata)
         outputter_time = time.time() - outputter_start
-
-        if not opts['dry_run']:
-            # TODO: this attempts to emulate the old timing behavior. Keep it?
-            process_time = summarize_time + outputter_time
-            dbif.markasdone(job, success, process_time, summarize_error)
     except Exception as e:
         logging.error("Failure processing summary for job %s %s. Error: %s %s", job.job_id, job.jobdir, str(e), traceback.format_exc())
         if opts["fail_fast"]:
             raise
+        return False
 
+    # TODO: this attempts to emulate the old timing behavior. Keep it?
+    committer.add(m, dbif, job, key, summarize_time + outputter_time, success, summarize_error)
+    return True
 
-def processjobs(config, opts, process_pool=None):
-    """ main function that does the work. One run of this function per process """
 
+class Progress(object):
+    """
+    Tracks the progress of the jobs in the journal and the work queue (both optional)
+    """
+    def __init__(self, journal=None, workqueue=None):
+        self.journal = journal
+        self.workqueue = workqueue
+
+    def select(self, resconf, jobs):
+        """ Filter the jobs to the ones that this process should summarize """
+        if self.journal is not None:
+            jobs = self.journal.filter(resconf['resource_id'], jobs)
+        if self.workqueue is not None:
+            jobs = self.workqueue.claimed(jobs)
+        return jobs
+
+    def finished(self, resconf, job, success):
+        """ Record the outcome of a job """
+        if self.journal is not None:
+            if success:
+                self.journal.completed(resconf['resource_id'], job)
+            else:
+                self.journal.failed(resconf['resource_id'], job)
+        if self.workqueue is not None:
+            if success:
+                self.workqueue.complete(job)
+            else:
+                self.workqueue.release(job)
+
+NOPROGRESS = Progress()
+
+
+def select_jobs(config, opts, resconf, datasource, account, stack):
+    """
+    Returns an iterable of the Jobs of a resource to process. In stale mode only the
+    jobs whose stored summary was produced by older plugin versions are selected.
+    """
+    jobs = get_jobs(opts, account)
+    if opts['process_stale']:
+        stored = stack.enter_context(StoredVersions(config.getsection("outputdatabase"), resconf))
+        jobs = select_stale(jobs, stored, datasource.versions())
+    return jobs
+
+
+def iter_resources(config, opts):
+    """
+    Generator that yields the name, settings, datasource and cost model of each resource to process
+    """
     allpreprocs = loadpreprocessors()
     logging.debug("Loaded %s preprocessors", len(allpreprocs))
 
@@ -71,21 +128,76 @@ def processjobs(config, opts, process_pool=None):
 
         logging.debug("Using %s preprocessors", len(preprocs))
         logging.debug("Using %s plugins", len(plugins))
-        if process_pool is not None:
-            process_resource_multiprocessing(resconf, preprocs, plugins, config, opts, datasource, process_pool)
-        else:
-            process_resource(resconf, config, opts, datasource)
 
+        yield r, resconf, datasource, CostModel(len(plugins))
 
-def process_resource(resconf, config, opts, datasource):
-    with outputter.factory(config, resconf, dry_run=opts["dry_run"]) as m:
 
-        if resconf['batch_system'] == "XDMoD":
-            dbif = XDMoDAcct(resconf['resource_id'], resconf['hostname_mode'], config)
-        else:
-            dbif = DbAcct(resconf['resource_id'], config)
+def getdbif(config, resconf):
+    """ Accounting interface for a resource """
+    if resconf['batch_system'] == "XDMoD":
+        return XDMoDAcct(resconf['resource_id'], resconf['hostname_mode'], config)
+    return DbAcct(resconf['resource_id'], config)
+
+
+class ResourceContext(object):
+    """
+    State of a resource whose jobs are summarized in the shared worker pool:
+    settings, datasource, cost model, outputter and accounting interface
+    """
+    def __init__(self, name, resconf, datasource, costmodel, m):
+        self.name = name
+        self.resconf = resconf
+        self.datasource = datasource
+        self.costmodel = costmodel
+        self.m = m
+        self.dbif = None
+
+    def accounting(self, config):
+        """ Accounting interface (connects on first use) """
+        if self.dbif is None:
+            self.dbif = getdbif(config, self.resconf)
+        return self.dbif
+
+
+def open_resources(config, opts, stack):
+    """ Set up a ResourceContext for each resource. The outputters are closed by the ExitStack """
+    resources = []
+    for r, resconf, datasource, costmodel in iter_resources(config, opts):
+        m = stack.enter_context(outputter.factory(config, resconf, dry_run=opts['dry_run'], partial=opts['partial_update']))
+        resources.append(ResourceContext(r, resconf, datasource, costmodel, m))
+    return resources
+
+
+def processjobs(config, opts, dispatcher=None, progress=NOPROGRESS):
+    """ main function that does the work. One run of this function per process """
+
+    if dispatcher is None:
+        for _, resconf, datasource, _ in iter_resources(config, opts):
+            process_resource(resconf, config, opts, datasource, progress)
+        return
+
+    # The jobs of all of the resources share the worker pool
+    with contextlib.ExitStack() as stack:
+        resources = open_resources(config, opts, stack)
+        streams = [(ctx, select_jobs(config, opts, ctx.resconf, ctx.datasource, ctx.accounting(config), stack)) for ctx in resources]
+        summarize_pool(streams, opts, dispatcher, progress)
 
-        for job in get_jobs(opts, dbif):
+
+def process_resource(resconf, config, opts, datasource, progress=NOPROGRESS):
+    with contextlib.ExitStack() as stack:
+        m = stack.enter_context(outputter.factory(config, resconf, dry_run=opts["dry_run"], partial=opts["partial_update"]))
+        dbif = getdbif(config, resconf)
+        jobs = select_jobs(config, opts, resconf, datasource, dbif, stack)
+        summarize_serial(jobs, m, dbif, resconf, config, opts, datasource, progress)
+
+
+def summarize_serial(jobs, m, dbif, resconf, config, opts, datasource, progress=NOPROGRESS):
+    """ Summarize the jobs in this process """
+    jobs = progress.select(resconf, jobs)
+    committer = Committer(opts, lambda ctx, job, success: progress.finished(resconf, job, success))
+
+    try:
+        for job in jobs:
             try:
                 summarize_start = time.time()
                 jobmeta = datasource.presummarize(job, config, resconf, opts)
@@ -98,60 +210,192 @@ def process_resource(resconf, config, opts, datasource):
             except Exception as e:
                 logging.error("Failure for summarization of job %s %s. Error: %s %s", job.job_id, job.jobdir, str(e), traceback.format_exc())
                 datasource.cleanup(opts, job)
+                progress.finished(resconf, job, False)
                 if opts["fail_fast"]:
                     raise
                 else:
                     continue
 
-            process_summary(m, dbif, opts, job, summarize_time, (summary_dict, mdata, success, s_err))
+            if not process_summary(m, dbif, opts, job, summarize_time, (summary_dict, mdata, success, s_err), committer):
+                progress.finished(resconf, job, False)
             datasource.cleanup(opts, job)
 
+            # Mark the jobs that the outputter has written as processed
+            committer.commit()
+    finally:
+        # Write the buffered summaries and process updates
+        committer.commit(force=True)
 
-def process_resource_multiprocessing(resconf, preprocs, plugins, config, opts, datasource, pool):
-    with outputter.factory(config, resconf, dry_run=opts['dry_run']) as m:
-        if resconf['batch_system'] == "XDMoD":
-             dbif = XDMoDAcct(resconf['resource_id'], resconf['hostname_mode'], config)
-        else:
-            dbif = DbAcct(resconf['resource_id'], config)
 
-        jobs = get_jobs(opts, dbif)
+def summarize_pool(streams, opts, dispatcher, progress=NOPROGRESS):
+    """
+    Summarize the jobs with the worker processes in the pool. streams is a list of
+    (ResourceContext, jobs). The jobs of the resources are interleaved in proportion
+    to the share of each resource so that a resource with many large jobs does not
+    hold up the others.
+    """
+    contexts = dict((ctx.name, ctx) for ctx, _ in streams)
+    tasks = interleave([(resource_share(ctx.resconf), iter_jobs(progress.select(ctx.resconf, jobs), ctx.name)) for ctx, jobs in streams])
+
+    costs = {}
+    processed = collections.Counter()
 
-        it = iter_jobs(jobs, config, resconf, plugins, preprocs, opts, datasource)
-        pool_iter = pool.imap_unordered(do_summarize, it)
-        while True:
-            try:
-                job, result, summarize_time = pool_iter.next(timeout=600000)
-            except StopIteration:
-                break
+    def estimate(task):
+        cost = costs[id(task)] = contexts[task[0]].costmodel.estimate(task[1])
+        logging.debug("Job %s estimated cost %s", task[1].job_id, cost)
+        return cost.memory
 
-            if result is not None:
-                process_summary(m, dbif, opts, job, summarize_time, result)
-                datasource.cleanup(opts, job)
-            else:
-                datasource.cleanup(opts, job)
+    # The summaries are written in a separate thread so that result collection
+    # does not wait for the output database
+    with OutputWriter(opts, progress) as writer:
+        for task, (job, result, summarize_time, usage) in dispatcher.run(do_summarize, tasks, estimate):
+            ctx = contexts[task[0]]
+            ctx.costmodel.observe(costs.pop(id(task)), usage['peakrss'], usage['cputime'])
+            writer.submit(ctx, job, summarize_time, result)
+            processed[ctx.name] += 1
+
+    for name, count in sorted(processed.items()):
+        logging.info("Resource %s: %d jobs processed", name, count)
 
 
-def iter_jobs(jobs, config, resconf, plugins, preprocs, opts, datasource):
+def run_daemon(config, opts, dispatcher=None, progress=NOPROGRESS):
     """
-    Combines the db cursor job iterator with the other information needed to pass to summarizejob.
+    Summarize jobs as they finish until the process receives SIGINT or SIGTERM.
+    The worker pool, the outputters and the database connections are kept open
+    between polls. Jobs are picked up once they ended more than daemon_lag
+    seconds ago, which gives time for the job data to be ingested and indexed.
+    """
+    stop = threading.Event()
+
+    def handler(signum, frame):
+        logging.info("Received signal %s. Stopping after the current poll.", signum)
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
+
+    with contextlib.ExitStack() as stack:
+        resources = open_resources(config, opts, stack)
+
+        logging.info("Polling for finished jobs every %s seconds", opts['poll_interval'])
+
+        while not stop.is_set():
+            poll_start = time.time()
+
+            streams = []
+            for ctx in resources:
+                try:
+                    jobs = list(ctx.accounting(config).get(None, poll_start - opts['daemon_lag']))
+                    if jobs:
+                        latency = poll_start - min(job.end_datetime.timestamp() for job in jobs)
+                        logging.info("Resource %s: %d jobs queued, oldest ended %d seconds ago", ctx.name, len(jobs), latency)
+                    else:
+                        logging.info("Resource %s: 0 jobs queued", ctx.name)
+
+                    if dispatcher is not None:
+                        streams.append((ctx, jobs))
+                    else:
+                        summarize_serial(jobs, ctx.m, ctx.dbif, ctx.resconf, config, opts, ctx.datasource, progress)
+
+                except Exception as e:
+                    logging.error("Failure processing resource %s. Error: %s %s", ctx.name, str(e), traceback.format_exc())
+                    if opts["fail_fast"]:
+                        raise
+                    # Reconnect to the accounting database on the next poll
+                    ctx.dbif = None
+
+                if stop.is_set():
+                    break
+
+            if streams:
+                try:
+                    summarize_pool(streams, opts, dispatcher, progress)
+                except Exception as e:
+                    logging.error("Failure processing jobs. Error: %s %s", str(e), traceback.format_exc())
+                    if opts["fail_fast"]:
+                        raise
+                    for ctx, _ in streams:
+                        ctx.dbif = None
+
+            elapsed = time.time() - poll_start
+            logging.info("Poll completed in %d seconds", elapsed)
+            stop.wait(max(0, opts['poll_interval'] - elapsed))
+
+
+def iter_jobs(jobs, resname):
+    """
+    Generate the tasks for the worker processes. The config, plugins and datasource
+    are set up once per worker by init_worker so only the resource name and the job are sent.
     """
     for job in jobs:
-        yield job, config, resconf, plugins, preprocs, opts, datasource
+        yield resname, job
+
+
+# State of a worker process in the multiprocessing pool
+_worker = {}
+
+
+def init_worker(config, opts, preprocs=None, plugins=None):
+    """
+    Pool initializer. Loads the shared state once per worker process. The plugin
+    classes loaded by the parent can be passed in so that recycled workers start
+    without scanning the plugin directories again.
+    """
+    _worker['config'] = config
+    _worker['opts'] = opts
+    _worker['preprocs'] = preprocs if preprocs is not None else loadpreprocessors()
+    _worker['plugins'] = plugins if plugins is not None else loadplugins()
+    _worker['resources'] = {}
+
+
+def worker_resource(resname):
+    """
+    Returns the resource configuration and datasource for a resource in a worker process.
+    These are created when the first job for the resource is processed.
+    """
+    if resname not in _worker['resources']:
+        for r, resconf in _worker['config'].resourceconfigs():
+            if r == resname:
+                break
+        else:
+            raise Exception("Resource {} not found in the configuration".format(resname))
+
+        resconf = override_defaults(resconf, _worker['opts'])
+        preprocs, plugins = filter_plugins(resconf, _worker['preprocs'], _worker['plugins'])
+        _worker['resources'][resname] = (resconf, DatasourceFactory(preprocs, plugins, resconf))
+
+    return _worker['resources'][resname]
+
+
+def cputime():
+    """ Cpu time used by this process and its children in seconds """
+    selfusage = getrusage(RUSAGE_SELF)
+    childusage = getrusage(RUSAGE_CHILDREN)
+    return selfusage.ru_utime + selfusage.ru_stime + childusage.ru_utime + childusage.ru_stime
 
 
 def do_summarize(args):
     """
-    used in a separate process
+    used in a separate process. Returns the job, the summary, the summarization
+    time and the peak memory and cpu time used to summarize the job
     """
-    job, config, resconf, plugins, preprocs, opts, datasource = args
+    resname, job = args
+    config = _worker['config']
+    opts = _worker['opts']
+
+    resetpeakrss()
+    cpu_start = cputime()
+    usage = {'peakrss': None, 'cputime': None}
+
     try:
         summarize_start = time.time()
+        resconf, datasource = worker_resource(resname)
         jobmeta = datasource.presummarize(job, config, resconf, opts)
         if not jobmeta:
-            return job, None, None  # Extract-only mode for PCP datasource
+            return job, None, None, usage  # Extract-only mode for PCP datasource
         res = datasource.summarizejob(job, jobmeta, config, opts)
         if res is None:
-            return job, None, None  # Extract-only mode
+            return job, None, None, usage  # Extract-only mode
         s, mdata, success, s_err = res
         summarize_time = time.time() - summarize_start
         # Ensure Summarize.get() is called on worker process since it is cpu-intensive
@@ -160,9 +404,12 @@ def do_summarize(args):
         logging.error("Failure for summarization of job %s %s. Error: %s %s", job.job_id, job.jobdir, str(e), traceback.format_exc())
         if opts["fail_fast"]:
             raise
-        return job, None, None
+        return job, None, None, usage
 
-    return job, (summary_dict, mdata, success, s_err), summarize_time
+    usage['peakrss'] = peakrss()
+    usage['cputime'] = cputime() - cpu_start
+
+    return job, (summary_dict, mdata, success, s_err), summarize_time, usage
 
 
 def main():
@@ -173,17 +420,49 @@ def main():
 
     setuplogger(opts['log'])
 
+    if opts['daemon'] and opts['mode'] not in ("all", "resource"):
+        logging.error("Daemon mode cannot be used with a time range or a single job")
+        sys.exit(1)
+
     config = Config()
 
     threads = opts['threads']
 
-    process_pool = mp.Pool(threads) if threads > 1 else None
-    processjobs(config, opts, process_pool)
+    process_pool = None
+    dispatcher = None
+    if threads > 1:
+        maxrss = opts['max_worker_rss'] * 1024 * 1024 if opts['max_worker_rss'] is not None else None
+        process_pool = WorkerPool(threads, init_worker, (config, opts, loadpreprocessors(), loadplugins()),
+                                  opts['max_jobs_per_worker'], maxrss)
+        controller = None
+        if opts['min_threads'] is not None and opts['min_threads'] < threads:
+            controller = ConcurrencyController(max(1, opts['min_threads']), threads)
+            logging.info("Adapting the number of concurrent jobs between %d and %d", controller.minlimit, controller.maxlimit)
+        budget = None
+        if opts['memory_budget'] is not None:
+            budget = opts['memory_budget'] * 1024 * 1024
+            logging.info("Limiting the estimated memory of the jobs in flight to %d MB", opts['memory_budget'])
+        dispatcher = Dispatcher(process_pool, 2 * threads, controller, budget)
+
+    with contextlib.ExitStack() as stack:
+        progress = Progress()
+        if opts['journal']:
+            progress.journal = stack.enter_context(Journal(opts['journal'], opts['resume']))
+        if opts['queue']:
+            progress.workqueue = stack.enter_context(WorkQueue(config, opts['queue'], opts['lease_time']))
+            logging.info("Claiming jobs from work queue %s as %s", opts['queue'], progress.workqueue.owner)
+
+        if opts['daemon']:
+            run_daemon(config, opts, dispatcher, progress)
+        else:
+            processjobs(config, opts, dispatcher, progress)
 
     if process_pool is not None:
         # wait for all processes to finish
         process_pool.close()
         process_pool.join()
+        if process_pool.retired:
+            logging.info("%d workers were replaced for exceeding the RSS limit", process_pool.retired)
 
 
 if __name__ == "__main__":
@@ -15,15 +15,23 @@ from supremm.account import DbAcct
 from supremm.xdmodaccount import XDMoDAcct
 from supremm import outputter
 from supremm.plugin import loadplugins, loadpreprocessors
-from supremm.proc_common import getoptions, override_defaults, filter_plugins
+from supremm.proc_common import getoptions, override_defaults, filter_plugins, interleave, resource_share, BatchSizer
 from supremm.scripthelpers import setuplogger
 from supremm.datasource.factory import DatasourceFactory
+from supremm.pluginversions import StoredVersions, select_stale
+from supremm.outputwriter import Committer
 
 import sys
 import time
+import contextlib
+import collections
 import psutil
 import json
 
+# Polling interval (seconds) for idle ranks
+MIN_POLL_INTERVAL = 0.001
+MAX_POLL_INTERVAL = 0.1
+
 
 def processjobs(config, opts, procid, comm):
     """ main function that does the work. One run of this function per process """
@@ -34,159 +42,259 @@ def processjobs(config, opts, procid, comm):
     allplugins = loadplugins()
     logging.debug("Loaded %s plugins", len(allplugins))
 
-    for r, resconf in config.resourceconfigs():
-        if opts['resource'] == None or opts['resource'] == r or opts['resource'] == str(resconf['resource_id']):
-            logging.info("Processing resource %s", r)
-        else:
-            continue
+    # Every rank sets up all of the resources so that the jobs of the resources
+    # can be interleaved in the batches
+    with contextlib.ExitStack() as stack:
+        resources = collections.OrderedDict()
 
-        resconf = override_defaults(resconf, opts)
+        for r, resconf in config.resourceconfigs():
+            if opts['resource'] == None or opts['resource'] == r or opts['resource'] == str(resconf['resource_id']):
+                logging.info("Processing resource %s", r)
+            else:
+                continue
 
-        preprocs, plugins = filter_plugins(resconf, allpreprocs, allplugins)
-        datasource = DatasourceFactory(preprocs, plugins, resconf)
+            resconf = override_defaults(resconf, opts)
 
-        logging.debug("Using %s preprocessors", len(preprocs))
-        logging.debug("Using %s plugins", len(plugins))
+            preprocs, plugins = filter_plugins(resconf, allpreprocs, allplugins)
+            datasource = DatasourceFactory(preprocs, plugins, resconf)
 
-        with outputter.factory(config, resconf, dry_run=opts["dry_run"]) as m:
+            logging.debug("Using %s preprocessors", len(preprocs))
+            logging.debug("Using %s plugins", len(plugins))
 
             if resconf['batch_system'] == "XDMoD":
                 dbif = XDMoDAcct(resconf['resource_id'], resconf['hostname_mode'], config)
             else:
                 dbif = DbAcct(resconf['resource_id'], config)
 
-            list_procs = 0
+            # The buffered process updates are written after the outputter is closed
+            if not opts['dry_run']:
+                stack.callback(dbif.flush)
+
+            m = stack.enter_context(outputter.factory(config, resconf, dry_run=opts["dry_run"], partial=opts["partial_update"]))
 
-            # Master
+            resources[r] = (resconf, datasource, m, dbif)
+
+        # The jobs are marked as processed once the outputters have written them
+        committer = Committer(opts, lambda ctx, job, success: None)
+        try:
             if procid == 0:
-                getjobs = {}
-                if opts['mode'] == "single":
-                    getjobs['cmd'] = dbif.getbylocaljobid
-                    getjobs['opts'] = [opts['local_job_id'],]
-                elif opts['mode'] == "timerange":
-                    getjobs['cmd'] = dbif.getbytimerange
-                    getjobs['opts'] = [opts['start'], opts['end'], opts]
-                else:
-                    getjobs['cmd'] = dbif.get
-                    getjobs['opts'] = [None, None]
-
-                logging.debug("MASTER STARTING")
-                numworkers = opts['threads']-1
-                numsent = 0
-                numreceived = 0
-
-
-                for job in getjobs['cmd'](*(getjobs['opts'])):
-                    if numsent >= numworkers:
-                        list_procs += 1
-                        if opts['dump_proclist'] and (list_procs == 1 or list_procs == 1000):
-                            # Once all ranks are going, dump the process list for debugging
-                            logging.info("Dumping process list")
-                            allpinfo = {}
-                            for proc in psutil.process_iter():
-                                try:
-                                    pinfo = proc.as_dict()
-                                except psutil.NoSuchProcess:
-                                    pass
-                                else:
-                                    allpinfo[pinfo['pid']] = pinfo
-
-                            with open("rank-{}_{}.proclist".format(procid, list_procs), 'w') as outfile:
-                                json.dump(allpinfo, outfile, indent=2)
-
-                        # Wait for a worker to be done and then send more work
-                        process = comm.recv(source=MPI.ANY_SOURCE, tag=1)
-                        numreceived += 1
-                        comm.send(job, dest=process, tag=1)
-                        numsent += 1
-                        logging.debug("Sent new job: %d sent, %d received", numsent, numreceived)
-                    else:
-                        # Initial batch
-                        comm.send(job, dest=numsent+1, tag=1)
-                        numsent += 1
-                        logging.debug("Initial Batch: %d sent, %d received", numsent, numreceived)
-
-                logging.info("After all jobs sent: %d sent, %d received", numsent, numreceived)
-
-                # Get leftover results
-                while numsent > numreceived:
-                    comm.recv(source=MPI.ANY_SOURCE, tag=1)
-                    numreceived += 1
-                    logging.debug("Getting leftovers. %d sent, %d received", numsent, numreceived)
-
-                # Shut them down
-                for worker in range(numworkers):
-                    logging.debug("Shutting down: %d", worker+1)
-                    comm.send(None, dest=worker+1, tag=1)
-
-            # Worker
+                master(config, resources, opts, comm, stack, committer)
+            else:
+                worker(config, resources, opts, comm, procid, committer)
+        finally:
+            committer.commit(force=True)
+
+
+def get_jobs(opts, dbif):
+    """ Returns an iterable of the jobs to process as specified by the options """
+    if opts['mode'] == "single":
+        return dbif.getbylocaljobid(opts['local_job_id'])
+    elif opts['mode'] == "timerange":
+        return dbif.getbytimerange(opts['start'], opts['end'], opts)
+    return dbif.get(None, None)
+
+
+def resource_tasks(resname, jobs):
+    """ Generator that yields a (resource name, job) task for each job """
+    for job in jobs:
+        yield resname, job
+
+
+def get_tasks(config, opts, resources, stack):
+    """ Returns an iterator over the jobs of all of the resources, interleaved
+        in proportion to the share of each resource. In stale mode only the jobs
+        whose stored summary was produced by older plugin versions are selected. """
+    streams = []
+    for r, (resconf, datasource, _, dbif) in resources.items():
+        jobs = get_jobs(opts, dbif)
+        if opts['process_stale']:
+            stored = stack.enter_context(StoredVersions(config.getsection("outputdatabase"), resconf))
+            jobs = select_stale(jobs, stored, datasource.versions())
+        streams.append((resource_share(resconf), resource_tasks(r, jobs)))
+    return interleave(streams)
+
+
+def dump_proclist(procid, list_procs):
+    """ Dump the process list for debugging """
+    logging.info("Dumping process list")
+    allpinfo = {}
+    for proc in psutil.process_iter():
+        try:
+            pinfo = proc.as_dict()
+        except psutil.NoSuchProcess:
+            pass
+        else:
+            allpinfo[pinfo['pid']] = pinfo
+
+    with open("rank-{}_{}.proclist".format(procid, list_procs), 'w') as outfile:
+        json.dump(allpinfo, outfile, indent=2)
+
+
+def wait_for_message(comm, source, tag):
+    """ Wait until a message is available. The wait between polls increases
+        up to MAX_POLL_INTERVAL so idle ranks do not use CPU time. (Blocking
+        receives spin inside many MPI implementations.)
+    """
+    interval = MIN_POLL_INTERVAL
+    while not comm.Iprobe(source=source, tag=tag):
+        time.sleep(interval)
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+
+def master(config, resources, opts, comm, stack, committer):
+    """ Rank 0. Sends batches of jobs to the workers and processes jobs itself
+        while all of the workers have enough batches queued to stay busy until
+        rank 0 has finished the job (see BatchSizer.depth).
+    """
+    logging.debug("MASTER STARTING")
+    numworkers = comm.Get_size() - 1
+    sizer = BatchSizer()
+    jobs = get_tasks(config, opts, resources, stack)
+    exhausted = False
+    outstanding = [0] * (numworkers + 1)
+    numsent = 0
+    numreceived = 0
+    list_procs = 0
+    # Batches are sent without blocking: a large batch is only received once
+    # the worker has finished its current batch
+    sends = []
+
+    def sendbatch(rank):
+        """ Send the next batch to a worker. Returns False if there are no more jobs """
+        nonlocal exhausted, numsent
+        if exhausted:
+            return False
+        batch = []
+        batchsize = sizer.size()
+        for job in jobs:
+            batch.append(job)
+            if len(batch) >= batchsize:
+                break
+        else:
+            exhausted = True
+        if not batch:
+            return False
+        sends.append(comm.isend(batch, dest=rank, tag=1))
+        outstanding[rank] += 1
+        numsent += len(batch)
+        return True
+
+    def refill(rank):
+        while outstanding[rank] < sizer.depth() and sendbatch(rank):
+            pass
+
+    for rank in range(1, numworkers + 1):
+        refill(rank)
+    logging.debug("Initial batches: %d jobs sent", numsent)
+
+    while True:
+        sends[:] = [req for req in sends if not req.test()[0]]
+
+        while comm.Iprobe(source=MPI.ANY_SOURCE, tag=2):
+            rank, njobs, elapsed, longest = comm.recv(source=MPI.ANY_SOURCE, tag=2)
+            outstanding[rank] -= 1
+            numreceived += njobs
+            sizer.update(njobs, elapsed, longest)
+            refill(rank)
+            logging.debug("Rank %d finished %d jobs: %d sent, %d received, batch size %d, depth %d", rank, njobs, numsent, numreceived, sizer.size(), sizer.depth())
+
+        if not exhausted:
+            # The depth grows as long jobs are seen, top up the queues first
+            for rank in range(1, numworkers + 1):
+                refill(rank)
+            if exhausted:
+                continue
+
+            # All workers have work queued so summarize a job here
+            try:
+                task = next(jobs)
+            except StopIteration:
+                exhausted = True
+                continue
+            start = time.time()
+            process_task(config, resources, task, opts, committer)
+            elapsed = time.time() - start
+            sizer.update(1, elapsed, elapsed)
+
+            list_procs += 1
+            if opts['dump_proclist'] and (list_procs == 1 or list_procs == 1000):
+                dump_proclist(0, list_procs)
+        elif sum(outstanding) > 0:
+            wait_for_message(comm, MPI.ANY_SOURCE, 2)
+        else:
+            break
+
+    logging.info("All jobs finished: %d sent to workers, %d processed by rank 0", numsent, list_procs)
+
+    MPI.Request.waitall(sends)
+
+    for rank in range(1, numworkers + 1):
+        logging.debug("Shutting down: %d", rank)
+        comm.send(None, dest=rank, tag=1)
+
+
+def worker(config, resources, opts, comm, procid, committer):
+    """ Ranks other than 0. Processes the batches of jobs sent by rank 0.
+        Batches that arrive while a batch is being processed are queued.
+    """
+    logging.debug("WORKER %d STARTING", procid)
+    queue = collections.deque()
+    shutdown = False
+    list_procs = 0
+
+    while True:
+        while comm.Iprobe(source=0, tag=1):
+            batch = comm.recv(source=0, tag=1)
+            if batch is None:
+                shutdown = True
             else:
-                sendtime = time.time()
-                midtime = time.time()
-                recvtime = time.time()
-                logging.debug("WORKER %d STARTING", procid)
-                while True:
-                    recvtries = 0
-                    while not comm.Iprobe(source=0, tag=1):
-                        if recvtries < 1000:
-                            recvtries += 1
-                            continue
-                        # Sleep so we can instrument how efficient we are
-                        # Otherwise, workers spin on exit at the hidden mpi_finalize call.
-                        # If you care about maximum performance and don't care about wasted cycles, remove the Iprobe/sleep loop
-                        # Empirically, a tight loop with time.sleep(0.001) uses ~1% CPU
-                        time.sleep(0.001)
-                    job = comm.recv(source=0, tag=1)
-                    recvtime = time.time()
-                    mpisendtime = midtime-sendtime
-                    mpirecvtime = recvtime-midtime
-                    if (mpisendtime+mpirecvtime) > 2:
-                        logging.warning("MPI send/recv took %s/%s", mpisendtime, mpirecvtime)
-                    if job != None:
-                        logging.debug("Rank: %s, Starting: %s", procid, job.job_id)
-                        process_job(config, dbif, job, m, opts, plugins, preprocs, resconf, datasource)
-                        logging.debug("Rank: %s, Finished: %s", procid, job.job_id)
-                        sendtime = time.time()
-                        comm.send(procid, dest=0, tag=1)
-                        midtime = time.time()
-
-                        list_procs += 1
-                        if opts['dump_proclist'] and (list_procs == 1 or list_procs == 10):
-                            # Once all ranks are going, dump the process list for debugging
-                            logging.info("Dumping process list")
-                            allpinfo = {}
-                            for proc in psutil.process_iter():
-                                try:
-                                    pinfo = proc.as_dict()
-                                except psutil.NoSuchProcess:
-                                    pass
-                                else:
-                                    allpinfo[pinfo['pid']] = pinfo
-
-                            with open("rank-{}_{}.proclist".format(procid, list_procs), 'w') as outfile:
-                                json.dump(allpinfo, outfile, indent=2)
-                    else:
-                        # Got shutdown message
-                        break
-
-
-def process_job(config, dbif, job, m, opts, plugins, preprocs, resconf, datasource):
+                queue.append(batch)
+
+        if queue:
+            batch = queue.popleft()
+            start = time.time()
+            longest = 0.0
+            for task in batch:
+                logging.debug("Rank: %s, Starting: %s %s", procid, task[0], task[1].job_id)
+                jobstart = time.time()
+                process_task(config, resources, task, opts, committer)
+                longest = max(longest, time.time() - jobstart)
+                logging.debug("Rank: %s, Finished: %s %s", procid, task[0], task[1].job_id)
+
+                list_procs += 1
+                if opts['dump_proclist'] and (list_procs == 1 or list_procs == 10):
+                    dump_proclist(procid, list_procs)
+
+            comm.send((procid, len(batch), time.time() - start, longest), dest=0, tag=2)
+        elif shutdown:
+            break
+        else:
+            wait_for_message(comm, 0, 1)
+
+
+def process_task(config, resources, task, opts, committer):
+    """ Summarize a (resource name, job) task """
+    resname, job = task
+    resconf, datasource, m, dbif = resources[resname]
+    return process_job(config, dbif, job, m, opts, resconf, datasource, committer)
+
+
+def process_job(config, dbif, job, m, opts, resconf, datasource, committer):
     try:
         summarize_start = time.time()
         jobmeta = datasource.presummarize(job, config, resconf, opts)
         if not jobmeta:
             return job, None, None
-        res = datasource.summarizejob(job, config, resconf, opts)
+        res = datasource.summarizejob(job, jobmeta, config, opts)
         if res is None:
             return job, None, None
         summary, mdata, success, summarize_error = res
         summarize_time = time.time() - summarize_start
 
-        # TODO: change behavior so markasdone only happens if this is successful
-        m.process(summary.get(), mdata)
-
-        if not opts['dry_run']:
-            dbif.markasdone(job, success, summarize_time, summarize_error)
+        key = m.process(summary.get(), mdata)
+        # The outputter may buffer the write. The job is marked as done once it is stored
+        committer.add(m, dbif, job, key, summarize_time, success, summarize_error)
+        committer.commit()
 
     except Exception as e:
         logging.error("Failure for job %s %s. Error: %s %s", job.job_id, job.jobdir, str(e), traceback.format_exc())
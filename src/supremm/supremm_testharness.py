@@ -5,7 +5,6 @@
     preprocessors.
 """
 
-import json
 from getopt import getopt
 import sys
 import os
@@ -18,6 +17,7 @@ import cpmapi as c_pmapi
 
 from supremm.datasource.pcp.pcpsummarize import PCPSummarize
 from supremm.plugin import loadplugins, loadpreprocessors
+from supremm.serialize import dumps
 from supremm.config import Config
 from supremm.proc_common import filter_plugins
 
@@ -154,7 +154,7 @@ def main():
     s = PCPSummarize(preprocessors, analytics, job, config)
     s.process()
     result = s.get()
-    print(json.dumps(result, indent=4, default=str))
+    print(dumps(result, indent=4))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,156 @@
+""" Database-backed work queue that lets several independent summarization
+    processes (on any number of hosts) share the jobs to process.
+
+    Each process claims batches of jobs by taking a lease on them in the
+    modw_supremm.process_lease table. Leases are renewed while the jobs are
+    processed. Completed jobs are marked in the table. Jobs that fail are
+    released so that another process can retry them, and the leases of a
+    process that dies expire and are taken over by the other processes.
+
+    Processes coordinate through the queue name, so a reprocessing campaign
+    should use a new queue name. Requires MySQL 8.0 or MariaDB 10.6 (SKIP LOCKED).
+    The process_lease table is defined in assets/modw_supremm.sql.
+"""
+import os
+import uuid
+import socket
+import logging
+import threading
+
+from supremm.scripthelpers import getdbconnection
+
+
+class WorkQueue(object):
+    """ Claims, renews and releases job leases """
+
+    def __init__(self, config, queue, lease_time=600, batch_size=20):
+        self._dbsettings = config.getsection("datawarehouse")
+        self._queue = queue
+        self._lease_time = lease_time
+        self._batch_size = batch_size
+        self._owner = "{0}:{1}:{2}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self._lock = threading.Lock()
+        self._con = None
+        self._stop = threading.Event()
+        self._renewer = None
+
+    def __enter__(self):
+        self._renewer = threading.Thread(target=self._renewloop, name="lease-renewal")
+        self._renewer.daemon = True
+        self._renewer.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        if self._renewer is not None:
+            self._renewer.join()
+        self.releaseall()
+        if self._con is not None:
+            self._con.close()
+            self._con = None
+
+    @property
+    def owner(self):
+        """ Identifier of this process in the lease table """
+        return self._owner
+
+    def connection(self):
+        """ Database connection (the caller must hold the lock) """
+        if self._con is None:
+            self._con = getdbconnection(self._dbsettings, False, {'autocommit': True})
+        return self._con
+
+    def execute(self, query, data):
+        """ Run a statement and return the rows """
+        with self._lock:
+            cur = self.connection().cursor()
+            cur.execute(query, data)
+            rows = cur.fetchall()
+            cur.close()
+            return rows
+
+    def claim(self, jobs):
+        """ Try to lease the jobs. Returns the jobs that were claimed by this process """
+        if not jobs:
+            return []
+
+        jobids = [job.job_pk_id for job in jobs]
+        inlist = ",".join(["%s"] * len(jobids))
+
+        # New jobs
+        values = ",".join(["(%s, %s, %s, UNIX_TIMESTAMP() + %s)"] * len(jobids))
+        data = []
+        for jobid in jobids:
+            data.extend([self._queue, jobid, self._owner, self._lease_time])
+        self.execute("INSERT IGNORE INTO modw_supremm.`process_lease` (queue, jobid, owner, lease_expires) VALUES " + values, data)
+
+        # Jobs whose lease has expired. Rows locked by another process that is
+        # taking over the same leases are skipped.
+        with self._lock:
+            con = self.connection()
+            con.begin()
+            try:
+                cur = con.cursor()
+                cur.execute("""SELECT jobid FROM modw_supremm.`process_lease`
+                               WHERE queue = %s AND completed = 0 AND owner != %s AND lease_expires < UNIX_TIMESTAMP()
+                               AND jobid IN (""" + inlist + ") FOR UPDATE SKIP LOCKED",
+                            [self._queue, self._owner] + jobids)
+                expired = [row[0] for row in cur.fetchall()]
+                if expired:
+                    cur.execute("UPDATE modw_supremm.`process_lease` SET owner = %s, lease_expires = UNIX_TIMESTAMP() + %s WHERE queue = %s AND jobid IN (" + ",".join(["%s"] * len(expired)) + ")",
+                                [self._owner, self._lease_time, self._queue] + expired)
+                    logging.info("Took over %d expired leases", len(expired))
+                con.commit()
+                cur.close()
+            except Exception:
+                con.rollback()
+                raise
+
+        rows = self.execute("SELECT jobid FROM modw_supremm.`process_lease` WHERE queue = %s AND owner = %s AND completed = 0 AND jobid IN (" + inlist + ")",
+                            [self._queue, self._owner] + jobids)
+        claimed = set(row[0] for row in rows)
+
+        return [job for job in jobs if job.job_pk_id in claimed]
+
+    def claimed(self, jobs):
+        """ Generator that claims the jobs in batches and yields the ones claimed by this process """
+        batch = []
+        for job in jobs:
+            batch.append(job)
+            if len(batch) >= self._batch_size:
+                for claimedjob in self.claim(batch):
+                    yield claimedjob
+                batch = []
+
+        for claimedjob in self.claim(batch):
+            yield claimedjob
+
+    def renew(self):
+        """ Extend the leases held by this process """
+        self.execute("UPDATE modw_supremm.`process_lease` SET lease_expires = UNIX_TIMESTAMP() + %s WHERE queue = %s AND owner = %s AND completed = 0",
+                     (self._lease_time, self._queue, self._owner))
+
+    def _renewloop(self):
+        while not self._stop.wait(self._lease_time / 3.0):
+            try:
+                self.renew()
+            except Exception as exc:
+                logging.warning("Unable to renew job leases: %s", exc)
+
+    def complete(self, job):
+        """ Record that a job was processed """
+        self.execute("UPDATE modw_supremm.`process_lease` SET completed = 1 WHERE queue = %s AND jobid = %s AND owner = %s",
+                     (self._queue, job.job_pk_id, self._owner))
+
+    def release(self, job):
+        """ Give up the lease on a job so that another process can claim it """
+        self.execute("DELETE FROM modw_supremm.`process_lease` WHERE queue = %s AND jobid = %s AND owner = %s AND completed = 0",
+                     (self._queue, job.job_pk_id, self._owner))
+
+    def releaseall(self):
+        """ Give up all of the leases held by this process """
+        try:
+            self.execute("DELETE FROM modw_supremm.`process_lease` WHERE queue = %s AND owner = %s AND completed = 0",
+                         (self._queue, self._owner))
+        except Exception as exc:
+            logging.warning("Unable to release job leases: %s", exc)
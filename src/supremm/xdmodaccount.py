@@ -6,6 +6,7 @@ from supremm.scripthelpers import getdbconnection
 from supremm.Job import Job
 from supremm.errors import ProcessingError
 import logging
+import time
 
 class XDMoDAcct(Accounting):
     """ account reader that gets data from xdmod datawarehouse """
@@ -177,6 +178,13 @@ class XDMoDAcct(Accounting):
         self.madcon = None
         self.nodenamecon = None
 
+        # Process updates are written in batches of up to batchsize jobs, at least
+        # every batchinterval seconds
+        self.batchsize = max(1, int(self.dbsettings.get('process_batch_size', 100)))
+        self.batchinterval = float(self.dbsettings.get('process_batch_interval', 10))
+        self._pending = []
+        self._pendingsince = None
+
     def detectXdmodSchema(self):
         """ Query the XDMoD datawarehouse to determine which version of the data schema
             is in use """
@@ -325,35 +333,48 @@ class XDMoDAcct(Accounting):
             yield job
 
     def markasdone(self, job, success, elapsedtime, error=None):
-        """ log a job as being processed (either successfully or not) """
-        query = """
-            INSERT INTO modw_supremm.`process` 
-                (jobid, process_version, process_timestamp, process_time) VALUES (%s, %s, NOW(), %s)
-            ON DUPLICATE KEY UPDATE process_version = %s, process_timestamp = NOW(), process_time = %s
-            """
-
+        """ log a job as being processed (either successfully or not). The update
+            is buffered and written by flush() """
         if error != None:
             version = -1000 - error
         else:
             version = Accounting.PROCESS_VERSION if success else -1 * Accounting.PROCESS_VERSION
 
-        data = (job.job_pk_id, version, elapsedtime, version, elapsedtime)
+        if not self._pending:
+            self._pendingsince = time.time()
+        self._pending.append((job.job_pk_id, version, elapsedtime))
 
-        if self.madcon == None:
-            self.madcon = getdbconnection(self.dbsettings, False, {'autocommit': True})
+        if len(self._pending) >= self.batchsize or time.time() - self._pendingsince >= self.batchinterval:
+            self.flush()
 
-        cur = self.madcon.cursor()
+    def flush(self):
+        """ Write the buffered process updates to the database with multi-row inserts """
+        while self._pending:
+            batch = self._pending[:self.batchsize]
+            query = """
+                INSERT INTO modw_supremm.`process`
+                    (jobid, process_version, process_timestamp, process_time) VALUES {0}
+                ON DUPLICATE KEY UPDATE process_version = VALUES(process_version), process_timestamp = VALUES(process_timestamp), process_time = VALUES(process_time)
+                """.format(", ".join(["(%s, %s, NOW(), %s)"] * len(batch)))
+            data = [value for row in batch for value in row]
+
+            if self.madcon == None:
+                self.madcon = getdbconnection(self.dbsettings, False, {'autocommit': True})
 
-        try:
-            cur.execute(query, data)
-        except OperationalError as e:
-            logging.warning("Lost MySQL Connection. " + str(e))
-            cur.close()
-            self.madcon.close()
-            logging.warning("Attempting reconnect")
-            self.madcon = getdbconnection(self.dbsettings, False, {'autocommit': True})
             cur = self.madcon.cursor()
-            cur.execute(query, data)
+
+            try:
+                cur.execute(query, data)
+            except OperationalError as e:
+                logging.warning("Lost MySQL Connection. " + str(e))
+                cur.close()
+                self.madcon.close()
+                logging.warning("Attempting reconnect")
+                self.madcon = getdbconnection(self.dbsettings, False, {'autocommit': True})
+                cur = self.madcon.cursor()
+                cur.execute(query, data)
+
+            del self._pending[:len(batch)]
 
 class XDMoDArchiveCache(ArchiveCache):
     """ Helper class that adds job accounting records to the database """
@@ -0,0 +1,15 @@
+""" Stand-ins for the worker pools used by the tests of the dispatcher """
+
+
+class SerialPool(object):
+    """ Stand-in for multiprocessing.Pool that runs each task when it is submitted """
+
+    def __init__(self):
+        self.submitted = []
+
+    def apply_async(self, func, args, callback, error_callback):
+        self.submitted.append(args[0])
+        try:
+            callback(func(*args))
+        except Exception as exc:
+            error_callback(exc)
@@ -0,0 +1,51 @@
+import unittest
+
+from supremm.proc_common import BatchSizer, MAX_BATCH_SIZE, PREFETCH_BATCHES, MAX_PREFETCH_BATCHES
+
+
+class TestBatchSizer(unittest.TestCase):
+
+    def setUp(self):
+        self.sizer = BatchSizer()
+
+    def test_initial(self):
+        self.assertEqual(1, self.sizer.size())
+        self.assertEqual(PREFETCH_BATCHES, self.sizer.depth())
+
+    def test_size(self):
+        # One second per job gives batches of ten seconds
+        self.sizer.update(10, 10.0, 1.0)
+        self.assertEqual(10, self.sizer.size())
+
+        self.sizer.update(1000, 1.0, 0.01)
+        self.assertEqual(MAX_BATCH_SIZE, self.sizer.size())
+
+    def test_slow_jobs(self):
+        self.sizer.update(2, 60.0, 40.0)
+        self.assertEqual(1, self.sizer.size())
+
+    def test_depth(self):
+        self.sizer.update(10, 10.0, 1.0)
+        self.assertEqual(PREFETCH_BATCHES, self.sizer.depth())
+
+        # The mean job time is now 70 / 11 seconds, so batches are single jobs and a
+        # 60 second job needs ten of them queued next to the one in progress
+        self.sizer.update(1, 60.0, 60.0)
+        self.assertEqual(1, self.sizer.size())
+        self.assertEqual(11, self.sizer.depth())
+
+    def test_longest_job(self):
+        # The longest job of a batch is tracked rather than the batch average
+        self.sizer.update(10, 20.0, 11.0)
+        self.assertEqual(11.0, self.sizer.longestjob)
+        self.sizer.update(10, 10.0, 1.0)
+        self.assertEqual(11.0, self.sizer.longestjob)
+
+    def test_max_depth(self):
+        self.sizer.update(100, 100.0, 1.0)
+        self.sizer.update(1, 10000.0, 10000.0)
+        self.assertEqual(MAX_PREFETCH_BATCHES, self.sizer.depth())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import copy
+import unittest
+import numpy
+import bson
+
+from supremm import codec
+from supremm.summarize import TIMESERIES_VERSION, COMPACT_TIMESERIES_VERSION, usecompacttimeseries
+
+
+def timeseries():
+    times = (1700000000.0 + 30.0 * numpy.arange(100) + numpy.random.random(100)).tolist()
+    return {
+        "hosts": {"0": "node1", "1": "node2"},
+        "version": TIMESERIES_VERSION,
+        "cpuuser": {
+            "times": times,
+            "hosts": {
+                "0": {"all": numpy.random.random(100).tolist(), "dev": {"0": [1.5] * 100, "1": [0.25] * 100}, "names": {"0": "cpu0", "1": "cpu1"}},
+                "1": {"all": numpy.random.random(100).tolist(), "dev": {}, "names": {}}
+            }
+        },
+        "membw": {
+            "min": [[1.0, 0], [2.0, 1]],
+            "times": times[:2],
+            "hosts": {"0": {"all": [1e9, 2e9], "dev": {}, "names": {}}}
+        }
+    }
+
+
+class TestCodec(unittest.TestCase):
+
+    def test_floats(self):
+        values = [0.0, 1.5, -2.25, 1e12, float("nan")]
+        decoded = codec.decode(codec.encode_floats(values))
+        numpy.testing.assert_allclose(values, decoded, rtol=1e-6)
+        self.assertEqual(5 + 4 * len(values), len(codec.encode_floats(values)))
+
+    def test_times(self):
+        times = [1700000000.123, 1700000030.5, 1700000060.0, 1700000059.999]
+        numpy.testing.assert_allclose(times, codec.decode(codec.encode_times(times)), atol=5e-4, rtol=0)
+        self.assertEqual(0, len(codec.decode(codec.encode_times([]))))
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            codec.decode(b"X\x00\x00\x00\x00")
+
+    def test_roundtrip(self):
+        original = timeseries()
+        encoded = codec.encode_timeseries(copy.deepcopy(original))
+
+        self.assertEqual(COMPACT_TIMESERIES_VERSION, encoded["version"])
+        self.assertTrue(codec.isencoded(encoded["cpuuser"]["times"]))
+        self.assertTrue(codec.isencoded(encoded["cpuuser"]["hosts"]["0"]["dev"]["1"]))
+        self.assertEqual(original["membw"]["min"], encoded["membw"]["min"])
+        self.assertEqual(original["hosts"], encoded["hosts"])
+
+        decoded = codec.decode_timeseries(encoded)
+        self.assertEqual(TIMESERIES_VERSION, decoded["version"])
+        numpy.testing.assert_allclose(original["cpuuser"]["times"], decoded["cpuuser"]["times"], atol=5e-4, rtol=0)
+        for host in ("0", "1"):
+            numpy.testing.assert_allclose(original["cpuuser"]["hosts"][host]["all"], decoded["cpuuser"]["hosts"][host]["all"], rtol=1e-6)
+        self.assertEqual([1.5] * 100, decoded["cpuuser"]["hosts"]["0"]["dev"]["0"])
+        self.assertEqual({"0": "cpu0", "1": "cpu1"}, decoded["cpuuser"]["hosts"]["0"]["names"])
+
+    def test_decode_original_schema(self):
+        original = timeseries()
+        self.assertEqual(original, codec.decode_timeseries(copy.deepcopy(original)))
+
+    def test_config(self):
+        class Config(object):
+            def __init__(self, sections):
+                self.sections = sections
+
+            def getsection(self, name):
+                return self.sections[name]
+
+        self.assertTrue(usecompacttimeseries(Config({"outputdatabase": {"timeseries_format": "binary"}})))
+        self.assertFalse(usecompacttimeseries(Config({"outputdatabase": {}})))
+        self.assertFalse(usecompacttimeseries(Config({})))
+        self.assertFalse(usecompacttimeseries(None))
+
+
+    def test_compress_summary(self):
+        procs = ["process{0}".format(i) for i in range(1000)]
+        summary = {
+            "procDump": {"constrained": procs, "unconstrained": procs[:10]},
+            "lustre": {"scratch": {"read": numpy.float64(1.5)}},
+            "cpu": {"user": 0.5}
+        }
+        original = copy.deepcopy(summary)
+        original["lustre"]["scratch"]["read"] = 1.5
+
+        self.assertEqual(["procDump"], codec.compress_summary(summary, ["procDump", "lustre", "missing"], 1024))
+        self.assertTrue(codec.isencoded(summary["procDump"]))
+        self.assertLess(len(summary["procDump"]), len(bson.encode(original["procDump"])) / 2)
+        self.assertIsInstance(summary["lustre"], dict)
+
+        self.assertEqual(["lustre"], codec.compress_summary(summary, ["lustre"], 0))
+        self.assertEqual(original, codec.decompress_summary(summary))
+
+        # Documents without compressed fields are unchanged
+        self.assertEqual(original, codec.decompress_summary(copy.deepcopy(original)))
+
+
+if __name__ == '__main__':
+    unittest.main()
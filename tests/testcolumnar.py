@@ -0,0 +1,129 @@
+import os
+import glob
+import shutil
+import datetime
+import tempfile
+import unittest
+import numpy
+
+from supremm import outputter
+from supremm.columnar import flatten, tocolumns, partition
+
+
+def summary(jobid, end_time=1700000000, **extra):
+    doc = {
+        "_id": "x",
+        "acct": {"id": jobid, "end_time": end_time, "host_list": ["a", "b"]},
+        "cpu": {"jobcpus": {"user": {"avg": 0.5, "cnt": 4}}},
+        "timeseries": {"times": [1, 2]},
+        "created": datetime.datetime(2024, 1, 1)
+    }
+    doc.update(extra)
+    return doc
+
+
+class TestColumnar(unittest.TestCase):
+
+    def test_flatten(self):
+        row = flatten(summary(1, lnet={"drop": numpy.float64(2.5)}))
+        self.assertEqual({
+            "acct.id": 1,
+            "acct.end_time": 1700000000,
+            "cpu.jobcpus.user.avg": 0.5,
+            "cpu.jobcpus.user.cnt": 4,
+            "created": datetime.datetime(2024, 1, 1),
+            "lnet.drop": 2.5
+        }, row)
+
+    def test_columns(self):
+        rows = [{"a": 1, "b": 1, "c": True, "d": "x"}, {"a": 2, "b": 1.5, "c": False, "d": 3}, {"a": 3}]
+        columns, types = tocolumns(rows)
+        self.assertEqual({"a": float, "b": float, "c": bool, "d": str}, types)
+        self.assertEqual([1.0, 2.0, 3.0], columns["a"])
+        self.assertEqual([1.0, 1.5, None], columns["b"])
+        self.assertEqual(["x", "3", None], columns["d"])
+
+    def test_schema(self):
+        schema = {}
+        columns, types = tocolumns([{"a": 0, "b": "x"}], schema)
+        self.assertEqual({"a": float, "b": str}, schema)
+        self.assertEqual([0.0], columns["a"])
+
+        # The columns keep their type, values that do not fit are dropped
+        columns, types = tocolumns([{"a": 0.5, "b": 2, "c": True}, {"a": "y", "b": "z"}], schema)
+        self.assertEqual({"a": float, "b": str, "c": bool}, types)
+        self.assertEqual([0.5, None], columns["a"])
+        self.assertEqual(["2", "z"], columns["b"])
+        self.assertEqual({"a": float, "b": str, "c": bool}, schema)
+
+    def test_numpy_columns(self):
+        rows = [flatten(summary(1, cpu={"avg": numpy.float64(1.5), "cnt": numpy.int64(4), "ok": numpy.bool_(True)})),
+                flatten(summary(2, cpu={"avg": 2.0, "cnt": 5, "ok": False}))]
+        for value in rows[0].values():
+            self.assertNotIsInstance(value, numpy.generic)
+
+        columns, types = tocolumns(rows)
+        self.assertEqual(float, types["cpu.avg"])
+        self.assertEqual(float, types["cpu.cnt"])
+        self.assertEqual(bool, types["cpu.ok"])
+        self.assertEqual([1.5, 2.0], columns["cpu.avg"])
+
+    def test_partition(self):
+        self.assertEqual("end_date=2023-11-14", partition(summary(1)))
+        self.assertEqual("end_date=unknown", partition({"acct": {}}))
+
+
+@unittest.skipUnless(outputter._HAS_PYARROW, "requires pyarrow")
+class TestParquetOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_write(self):
+        import pyarrow.dataset
+
+        outconf = {"parquet_dir": self.tmpdir, "row_group_size": 2}
+        with outputter.ParquetOutput(outconf, {"resource_id": 3}) as out:
+            for i in range(5):
+                out.process(summary(i, end_time=1700000000 + 86400 * (i % 2)), {"version": "1.0"})
+
+        dataset = pyarrow.dataset.dataset(os.path.join(self.tmpdir, "resource_id=3"), format="parquet", partitioning="hive")
+        table = dataset.to_table()
+        self.assertEqual(5, table.num_rows)
+        self.assertEqual(list(range(5)), sorted(table.column("acct.id").to_pylist()))
+        self.assertIn("summarization.version", table.column_names)
+
+    def test_completed(self):
+        outconf = {"parquet_dir": self.tmpdir, "row_group_size": 2}
+        with outputter.ParquetOutput(outconf, {"resource_id": 3}) as out:
+            self.assertEqual("1-1700000000", out.process(summary(1), {}))
+            self.assertEqual((set(), set()), out.completed())
+            self.assertEqual([], glob.glob(os.path.join(self.tmpdir, "*", "*", "*.parquet")))
+
+            out.process(summary(2), {})
+            self.assertEqual(({"1-1700000000", "2-1700000000"}, set()), out.completed())
+            self.assertEqual(1, len(glob.glob(os.path.join(self.tmpdir, "*", "*", "*.parquet"))))
+
+            out.process(summary(3), {})
+            self.assertEqual(set(), out.flush())
+            self.assertEqual(2, len(glob.glob(os.path.join(self.tmpdir, "*", "*", "*.parquet"))))
+
+    def test_schema(self):
+        import pyarrow.dataset
+
+        outconf = {"parquet_dir": self.tmpdir, "row_group_size": 100}
+        with outputter.ParquetOutput(outconf, {"resource_id": 3}) as out:
+            out.process(summary(1, cpu={"user": 0}), {})
+            out.flush()
+            out.process(summary(2, cpu={"user": 0.5}), {})
+
+        dataset = pyarrow.dataset.dataset(os.path.join(self.tmpdir, "resource_id=3"), format="parquet", partitioning="hive")
+        table = dataset.to_table()
+        self.assertEqual([0.0, 0.5], sorted(table.column("cpu.user").to_pylist()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,255 @@
+import os
+import time
+import queue
+import unittest
+import threading
+import multiprocessing as mp
+from mock import patch
+
+from supremm.concurrency import ConcurrencyController, Dispatcher, WorkerPool, processrss
+from tests.pools import SerialPool
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+
+class ThreadPool(object):
+    """ Stand-in for multiprocessing.Pool that completes each task shortly after it is submitted.
+        Records the estimated memory of the tasks in flight.
+    """
+
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self.submitted = []
+        self.committed = 0
+        self.maxcommitted = 0
+        self.lock = threading.Lock()
+
+    def apply_async(self, func, args, callback, error_callback):
+        task = args[0]
+        with self.lock:
+            self.submitted.append(task)
+            self.committed += self.sizes[task]
+            self.maxcommitted = max(self.maxcommitted, self.committed)
+
+        def complete():
+            time.sleep(0.02)
+            with self.lock:
+                self.committed -= self.sizes[task]
+            callback(func(task))
+
+        threading.Thread(target=complete).start()
+
+
+class TestConcurrencyController(unittest.TestCase):
+
+    def setUp(self):
+        self.memory = [100 * GB, 128 * GB]
+        self.cpu = [0, 1000]
+
+        patchers = [
+            patch("supremm.concurrency.meminfo", side_effect=lambda: tuple(self.memory)),
+            patch("supremm.concurrency.cputimes", side_effect=lambda: tuple(self.cpu)),
+            patch("supremm.concurrency.workerrss", return_value={1: GB, 2: GB})
+        ]
+        for p in patchers:
+            p.start()
+            self.addCleanup(p.stop)
+
+        self.controller = ConcurrencyController(2, 8)
+
+    def advance(self, iowait, total=1000):
+        self.cpu = [self.cpu[0] + iowait, self.cpu[1] + total]
+
+    def test_increase(self):
+        for expected in range(3, 9):
+            self.advance(0)
+            self.assertEqual(expected, self.controller.update(force=True))
+        self.advance(0)
+        self.assertEqual(8, self.controller.update(force=True))
+
+    def test_memory_pressure(self):
+        self.controller.limit = 8
+        self.memory[0] = 5 * GB
+        self.advance(0)
+        self.assertEqual(6, self.controller.update(force=True))
+        self.assertTrue(self.controller.memorytight)
+        for _ in range(5):
+            self.advance(0)
+            self.controller.update(force=True)
+        self.assertEqual(2, self.controller.limit)
+
+    def test_iowait(self):
+        self.controller.limit = 4
+        self.advance(500)
+        self.assertEqual(3, self.controller.update(force=True))
+
+    def test_rate_limited(self):
+        self.advance(0)
+        self.assertEqual(3, self.controller.update())
+        self.advance(0)
+        self.assertEqual(3, self.controller.update())
+
+
+class TestDispatcher(unittest.TestCase):
+
+    def test_run(self):
+        pool = SerialPool()
+        dispatcher = Dispatcher(pool, 4)
+        results = list(dispatcher.run(lambda x: x * 2, range(10)))
+        self.assertEqual([(x, x * 2) for x in range(10)], sorted(results))
+
+    def test_error(self):
+        def fail(x):
+            raise ValueError(x)
+
+        dispatcher = Dispatcher(SerialPool(), 4)
+        with self.assertRaises(ValueError):
+            list(dispatcher.run(fail, range(3)))
+
+    def test_budget(self):
+        sizes = [2, 2, 1, 1, 2]
+        pool = ThreadPool(sizes)
+        dispatcher = Dispatcher(pool, 4, budget=3)
+
+        results = list(dispatcher.run(lambda x: x, range(5), lambda task: sizes[task]))
+
+        self.assertEqual(list(range(5)), sorted(task for task, _ in results))
+        # Task 1 does not fit next to task 0, so it is deferred and task 2 starts
+        self.assertEqual([0, 2], pool.submitted[:2])
+        self.assertLessEqual(pool.maxcommitted, 3)
+
+    def test_over_budget(self):
+        sizes = [1, 1, 10, 1, 1]
+        pool = ThreadPool(sizes)
+        dispatcher = Dispatcher(pool, 4, budget=3)
+
+        results = list(dispatcher.run(lambda x: x, range(5), lambda task: sizes[task]))
+
+        self.assertEqual(list(range(5)), sorted(task for task, _ in results))
+        # The large task runs on its own once the tasks in flight finish
+        self.assertEqual([0, 1, 2, 3, 4], pool.submitted)
+        self.assertEqual(10, pool.maxcommitted)
+
+    def test_starvation(self):
+        sizes = [2, 2, 1, 1, 1, 1]
+        pool = ThreadPool(sizes)
+        dispatcher = Dispatcher(pool, 4, budget=3)
+        dispatcher.MAX_DEFER = -1
+
+        results = list(dispatcher.run(lambda x: x, range(6), lambda task: sizes[task]))
+
+        self.assertEqual(list(range(6)), sorted(task for task, _ in results))
+        # No new tasks start while task 1 is waiting
+        self.assertEqual([0, 1], pool.submitted[:2])
+
+    def makecontroller(self, memorytight):
+        with patch("supremm.concurrency.cputimes", return_value=(0, 1000)):
+            controller = ConcurrencyController(4, 4)
+        controller.update = lambda force=False: controller.limit
+        controller.memorytight = memorytight
+        return controller
+
+    def test_holdback(self):
+        sizes = [1, 1, 1, 10, 1, 1]
+        pool = ThreadPool(sizes)
+        dispatcher = Dispatcher(pool, 4, controller=self.makecontroller(True))
+
+        results = list(dispatcher.run(lambda x: x, range(6), lambda task: sizes[task]))
+
+        self.assertEqual(list(range(6)), sorted(task for task, _ in results))
+        # The large task waits while memory is tight and then runs on its own
+        self.assertEqual([0, 1, 2, 4, 5, 3], pool.submitted)
+        self.assertEqual(10, pool.maxcommitted)
+
+    def test_no_holdback(self):
+        sizes = [1, 1, 1, 10, 1, 1]
+        pool = ThreadPool(sizes)
+        dispatcher = Dispatcher(pool, 4, controller=self.makecontroller(False))
+
+        list(dispatcher.run(lambda x: x, range(6), lambda task: sizes[task]))
+
+        self.assertEqual(list(range(6)), pool.submitted)
+
+
+def double(x):
+    return 2 * x
+
+
+_held = []
+
+
+def hold(size):
+    """ Keeps size bytes allocated in the worker process """
+    _held.append(b"x" * size)
+    return os.getpid()
+
+
+def getpid(_):
+    return os.getpid()
+
+
+def crash(_):
+    os._exit(1)
+
+
+def run(pool, func, arg):
+    """ Run a task in the pool and wait for its result """
+    results = queue.Queue()
+    pool.apply_async(func, (arg,), callback=results.put, error_callback=results.put)
+    return results.get(timeout=30)
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def test_replace_on_rss(self):
+        pool = WorkerPool(2, maxrss=processrss(os.getpid()) + 256 * MB)
+        try:
+            workers = set(p.pid for p in mp.active_children())
+            grown = run(pool, hold, 512 * MB)
+            self.assertEqual(1, pool.retired)
+            self.assertGreater(pool.peaks[grown], pool.maxrss)
+
+            # Only the worker that grew is replaced
+            self.assertIn((workers - {grown}).pop(), set(p.pid for p in mp.active_children()))
+            for _ in range(4):
+                self.assertNotEqual(grown, run(pool, getpid, None))
+            self.assertEqual(1, pool.retired)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual({}, pool.peaks)
+
+    def test_maxtasks(self):
+        pool = WorkerPool(1, maxtasks=2)
+        try:
+            pids = [run(pool, getpid, None) for _ in range(4)]
+            self.assertEqual(pids[0], pids[1])
+            self.assertEqual(pids[2], pids[3])
+            self.assertNotEqual(pids[0], pids[2])
+            self.assertEqual(0, pool.retired)
+        finally:
+            pool.close()
+            pool.join()
+
+    def test_worker_exit(self):
+        pool = WorkerPool(1)
+        try:
+            self.assertIsInstance(run(pool, crash, None), Exception)
+            self.assertEqual(4, run(pool, double, 2))
+        finally:
+            pool.close()
+            pool.join()
+
+    def test_run(self):
+        pool = WorkerPool(2, maxtasks=1)
+        try:
+            dispatcher = Dispatcher(pool, 4)
+            self.assertEqual([(x, 2 * x) for x in range(6)], sorted(dispatcher.run(double, range(6))))
+        finally:
+            pool.close()
+            pool.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import Mock
+
+from supremm.costmodel import CostModel, archivesize
+
+
+def makejob(nodecount=1, walltime=3600, ncpus=None, archives=None):
+    job = Mock()
+    job.nodecount = nodecount
+    job.walltime = walltime
+    job.acct = {"ncpus": ncpus}
+    job.rawarchives.return_value = archives or []
+    return job
+
+
+class TestCostModel(unittest.TestCase):
+
+    def setUp(self):
+        self.model = CostModel(10)
+
+    def test_scales_with_job_size(self):
+        small = self.model.estimate(makejob(nodecount=1))
+        large = self.model.estimate(makejob(nodecount=100))
+        self.assertGreater(large.memory, small.memory)
+        self.assertGreater(large.cputime, small.cputime)
+
+        wide = self.model.estimate(makejob(nodecount=1, ncpus=128))
+        self.assertGreater(wide.memory, small.memory)
+
+    def test_calibration(self):
+        job = makejob(nodecount=10)
+        cost = self.model.estimate(job)
+
+        # Jobs use twice the estimated memory above the base and half the cpu time
+        for _ in range(100):
+            self.model.observe(cost, CostModel.BASE_MEMORY + 2 * cost.basememory, 0.5 * cost.basecputime)
+
+        self.assertAlmostEqual(2.0, self.model.memoryscale, places=3)
+        self.assertAlmostEqual(0.5, self.model.cputimescale, places=3)
+
+        calibrated = self.model.estimate(job)
+        self.assertAlmostEqual(CostModel.BASE_MEMORY + 2 * cost.basememory, calibrated.memory, delta=1024)
+
+    def test_missing_measurement(self):
+        cost = self.model.estimate(makejob())
+        self.model.observe(cost, None, None)
+        self.assertEqual(1.0, self.model.memoryscale)
+        self.assertEqual(1.0, self.model.cputimescale)
+
+
+class TestArchiveSize(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_archivesize(self):
+        base = os.path.join(self.tmpdir, "20230101.00.10")
+        for suffix, size in ((".0", 1000), (".index", 10), (".meta.xz", 100)):
+            with open(base + suffix, "wb") as fp:
+                fp.write(b"x" * size)
+
+        self.assertEqual(1110, archivesize(base + ".index"))
+        self.assertEqual(1110, archivesize(base))
+        self.assertEqual(0, archivesize(os.path.join(self.tmpdir, "missing")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -33,7 +33,20 @@ class TestGetOptions(unittest.TestCase):
                 'resource': None,
                 'tag': None,
                 'dump_proclist': False,
-                'threads': 1
+                'threads': 1,
+                'journal': None,
+                'resume': False,
+                'daemon': False,
+                'poll_interval': 300,
+                'daemon_lag': 600,
+                'queue': None,
+                'lease_time': 600,
+                'min_threads': None,
+                'memory_budget': None,
+                'max_jobs_per_worker': None,
+                'max_worker_rss': None,
+                'partial_update': False,
+                'process_stale': False
         }
 
     def helper(self, args, expected):
@@ -164,6 +177,41 @@ class TestGetOptions(unittest.TestCase):
 
         self.helper(['-t', '4'], expected)
 
+    def testminthreads(self):
+        expected = self.defaults.copy()
+        expected['threads'] = 16
+        expected['min_threads'] = 4
+
+        self.helper(['-t', '16', '--min-threads', '4'], expected)
+
+    def testworkerrecycling(self):
+        expected = self.defaults.copy()
+        expected['threads'] = 8
+        expected['max_jobs_per_worker'] = 500
+        expected['max_worker_rss'] = 4096
+
+        self.helper(['-t', '8', '--max-jobs-per-worker', '500', '--max-worker-rss', '4096'], expected)
+
+    def testpartialupdate(self):
+        expected = self.defaults.copy()
+        expected['partial_update'] = True
+
+        self.helper(['--partial-update'], expected)
+
+    def testprocessstale(self):
+        expected = self.defaults.copy()
+        expected['mode'] = 'timerange'
+        expected['start'] = datetime.datetime(2024, 1, 1)
+        expected['end'] = datetime.datetime(2024, 2, 1)
+        expected['process_stale'] = True
+        expected['process_bad'] = False
+        expected['process_old'] = False
+        expected['process_notdone'] = False
+        expected['process_current'] = True
+        expected['partial_update'] = True
+
+        self.helper(['-s', '2024-01-01', '-e', '2024-02-01', '--process-stale'], expected)
+
     def testdumpprolist(self):
         expected = self.defaults.copy()
         expected['dump_proclist'] = True
@@ -176,5 +224,28 @@ class TestGetOptions(unittest.TestCase):
 
         self.helper(['--max-nodetime', "3455"], expected)
 
+    def testjournal(self):
+        expected = self.defaults.copy()
+        expected['journal'] = 'progress.journal'
+        expected['resume'] = True
+
+        self.helper(['--journal', 'progress.journal', '--resume'], expected)
+
+    def testdaemon(self):
+        expected = self.defaults.copy()
+        expected['daemon'] = True
+        expected['poll_interval'] = 60
+        expected['daemon_lag'] = 1800
+
+        self.helper(['--daemon', '--poll-interval', '60', '--daemon-lag', '1800'], expected)
+
+    def testresumewithoutjournal(self):
+
+        testargs = ['procname', '--resume']
+
+        with patch.object(sys, 'argv', testargs):
+            with self.assertRaises(SystemExit):
+                opt = getoptions(False)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+from supremm.proc_common import interleave, resource_share
+
+
+class TestInterleave(unittest.TestCase):
+
+    def test_equal_shares(self):
+        result = list(interleave([(1, "aaa"), (1, "bbb")]))
+        self.assertEqual(list("ababab"), result)
+
+    def test_weighted(self):
+        result = list(interleave([(3, "a" * 30), (1, "b" * 10)]))
+        self.assertEqual(40, len(result))
+        # Each window of four items has three from the heavier stream
+        for i in range(0, 40, 4):
+            self.assertEqual(3, result[i:i + 4].count("a"))
+
+    def test_exhausted(self):
+        result = list(interleave([(1, "a"), (1, "bbbb"), (1, "")]))
+        self.assertEqual(sorted("abbbb"), sorted(result))
+        self.assertEqual("b", result[-1])
+
+    def test_lazy(self):
+        def infinite():
+            while True:
+                yield "x"
+
+        it = interleave([(1, infinite()), (1, "yy")])
+        self.assertEqual(list("xyxyxx"), [next(it) for _ in range(6)])
+
+    def test_share(self):
+        self.assertEqual(1, resource_share({}))
+        self.assertEqual(4, resource_share({"share": 4}))
+        self.assertEqual(1, resource_share({"share": 0}))
+
+
+if __name__ == '__main__':
+    unittest.main()
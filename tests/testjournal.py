@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import Mock
+
+from supremm.journal import Journal
+
+
+def mkjob(pk):
+    job = Mock()
+    job.job_pk_id = pk
+    return job
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "progress.journal")
+        self.jobs = [mkjob(i) for i in range(4)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_first(self):
+        with Journal(self.path) as journal:
+            dispatched = list(journal.filter(1, self.jobs))
+            journal.completed(1, self.jobs[0])
+            journal.failed(1, self.jobs[1])
+        return dispatched
+
+    def test_resume(self):
+        self.assertEqual(self.jobs, self.run_first())
+
+        # Simulate a crash part way through writing a record
+        with open(self.path, "a") as fp:
+            fp.write("C 1/")
+
+        with Journal(self.path, resume=True) as journal:
+            self.assertEqual(set(["1/0"]), journal.completedjobs())
+            self.assertEqual(set(["1/1"]), journal.failedjobs())
+            self.assertEqual(set(["1/2", "1/3"]), journal.inflightjobs())
+
+            self.assertEqual(self.jobs[1:], list(journal.filter(1, self.jobs)))
+
+            # Jobs on other resources are not skipped
+            self.assertEqual(self.jobs, list(journal.filter(2, self.jobs)))
+
+        with Journal(self.path, resume=True) as journal:
+            self.assertEqual(set(["1/1", "1/2", "1/3", "2/0", "2/1", "2/2", "2/3"]), journal.inflightjobs())
+
+    def test_no_resume(self):
+        self.run_first()
+
+        with Journal(self.path) as journal:
+            self.assertEqual(set(), journal.completedjobs())
+            self.assertEqual(self.jobs, list(journal.filter(1, self.jobs)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,242 @@
+import os
+import glob
+import gzip
+import json
+import zlib
+import shutil
+import tempfile
+import unittest
+from mock import MagicMock, patch
+from pymongo.errors import BulkWriteError, AutoReconnect
+
+from supremm.outputter import MongoOutput, FileOutput, SpoolOutput
+from supremm import codec
+
+
+def summary(jobid, timeseries=True):
+    doc = {"acct": {"id": jobid, "end_time": 100}, "summarization": {}}
+    if timeseries:
+        doc["timeseries"] = {"data": [1, 2]}
+    return doc
+
+
+class TestMongoOutput(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch("supremm.outputter.MongoClient")
+        self.client = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.collections = {}
+        db = MagicMock()
+        db.__getitem__.side_effect = lambda name: self.collections.setdefault(name, MagicMock())
+        self.client.return_value.get_database.return_value = db
+
+        self.outconf = {"uri": "mongodb://localhost", "db": "supremm", "bulk_size": 3}
+        self.output = MongoOutput(self.outconf, {"resource_id": 5})
+        self.output.__enter__()
+
+    def ops(self, name):
+        return [op for c in self.collections[name].bulk_write.call_args_list for op in c[0][0]]
+
+    def test_buffered(self):
+        self.assertEqual("1-100", self.output.process(summary(1), {"version": 1}))
+        self.output.process(summary(2, False), {})
+        self.assertEqual({}, self.collections)
+
+        self.output.process(summary(3), {})
+        self.assertEqual(3, len(self.ops("resource_5")))
+        self.assertEqual(2, len(self.ops("timeseries-resource_5")))
+        for c in self.collections["resource_5"].bulk_write.call_args_list:
+            self.assertFalse(c[1]["ordered"])
+
+        doc = self.ops("resource_5")[0]._doc
+        self.assertNotIn("timeseries", doc)
+        self.assertEqual(1, doc["summarization"]["version"])
+
+    def test_flush(self):
+        self.output.process(summary(1), {})
+        self.assertEqual(set(), self.output.flush())
+        self.assertEqual(1, len(self.ops("resource_5")))
+        self.assertEqual(set(), self.output.flush())
+        self.assertEqual(1, len(self.ops("resource_5")))
+
+    def test_completed(self):
+        self.output.process(summary(1), {})
+        self.output.process(summary(2), {})
+        self.assertEqual((set(), set()), self.output.completed())
+        self.assertEqual({}, self.collections)
+
+        self.collections["resource_5"] = MagicMock()
+        self.collections["resource_5"].bulk_write.side_effect = BulkWriteError({"writeErrors": [{"index": 1, "errmsg": "too large"}]})
+        self.output.process(summary(3), {})
+        self.assertEqual(({"1-100", "3-100"}, {"2-100"}), self.output.completed())
+        self.assertEqual((set(), set()), self.output.completed())
+
+    def test_completed_interval(self):
+        with patch("supremm.outputter.time.time", return_value=1000.0):
+            self.output.process(summary(1), {})
+            self.assertEqual((set(), set()), self.output.completed())
+        # The buffered documents are written once the oldest is bulk_interval seconds old
+        with patch("supremm.outputter.time.time", return_value=1010.0):
+            self.assertEqual(({"1-100"}, set()), self.output.completed())
+
+    def test_write_errors(self):
+        self.output.process(summary(1), {})
+        self.output.process(summary(2), {})
+        self.output.flush()
+
+        self.collections["resource_5"].bulk_write.side_effect = BulkWriteError({"writeErrors": [{"index": 1, "errmsg": "too large"}]})
+        self.output.process(summary(3), {})
+        self.output.process(summary(4), {})
+        self.assertEqual({"4-100"}, self.output.flush())
+
+        self.collections["resource_5"].bulk_write.side_effect = None
+        self.collections["timeseries-resource_5"].bulk_write.side_effect = AutoReconnect("down")
+        self.output.process(summary(5), {})
+        self.assertEqual({"5-100"}, self.output.flush())
+
+    def test_exit(self):
+        self.output.process(summary(1), {})
+        self.output.__exit__(None, None, None)
+        self.assertEqual(1, len(self.ops("resource_5")))
+
+    def test_compress(self):
+        self.outconf["compress_threshold"] = 1
+        output = MongoOutput(self.outconf, {"resource_id": 5})
+        output.__enter__()
+        doc = summary(1, False)
+        doc["procDump"] = {"constrained": ["proc{0}".format(i) for i in range(500)]}
+        doc["nfs"] = {"home": {"read": 1.0}}
+        output.process(doc, {})
+        output.flush()
+
+        stored = self.ops("resource_5")[0]._doc
+        self.assertIsInstance(stored["procDump"], bytes)
+        self.assertEqual({"home": {"read": 1.0}}, stored["nfs"])
+        self.assertEqual(500, len(codec.decompress_summary(stored)["procDump"]["constrained"]))
+
+    def test_partial(self):
+        output = MongoOutput(self.outconf, {"resource_id": 5}, partial=True)
+        output.__enter__()
+        doc = summary(1)
+        doc["cpu"] = {"user": 0.5}
+        doc["gpu"] = {"error": 2}
+        doc["errors"] = {"gpu": ["no data"], "proc": []}
+        doc["created"] = "now"
+        output.process(doc, {"version": 2, "versions": {"CpuUsage": 3}})
+        output.flush()
+
+        update = self.ops("resource_5")[0]._doc
+        self.assertEqual({"cpu", "gpu", "summarization.version", "summarization.versions.CpuUsage", "errors.gpu"}, set(update["$set"]))
+        self.assertEqual(2, update["$set"]["summarization.version"])
+        self.assertEqual({"acct", "created"}, set(update["$setOnInsert"]))
+        self.assertEqual({"errors.proc": ""}, update["$unset"])
+        self.assertTrue(self.ops("resource_5")[0]._upsert)
+
+        update = self.ops("timeseries-resource_5")[0]._doc
+        self.assertEqual({"$set": {"data": [1, 2]}}, update)
+
+
+class TestSpoolOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.target = MagicMock()
+        self.target.process.side_effect = lambda summary, mdata: str(summary["acct"]["id"]) + "-100"
+        self.target.flush.return_value = set()
+        self.target.unavailable = False
+        self.outconf = {"spool_dir": self.tmpdir, "spool_replay_interval": 3600}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_spooled(self):
+        with SpoolOutput(self.outconf, {"resource_id": 2}, self.target) as out:
+            out.process(summary(1), {"version": 1})
+            out.process(summary(2), {})
+            self.assertEqual(set(), out.flush())
+            self.target.process.assert_not_called()
+
+        # The spool is replayed on exit
+        self.assertEqual(2, self.target.process.call_count)
+        self.assertEqual({"version": 1}, self.target.process.call_args_list[0][0][1])
+        self.assertEqual([], os.listdir(os.path.join(self.tmpdir, "2")))
+
+    def test_unavailable(self):
+        self.target.flush.return_value = {"1-100"}
+        self.target.unavailable = True
+        with SpoolOutput(self.outconf, {"resource_id": 2}, self.target) as out:
+            out.process(summary(1), {})
+
+        # The summary stays in the spool for the next run
+        self.assertEqual(1, len(glob.glob(os.path.join(self.tmpdir, "2", "*.seg"))))
+
+        self.target.flush.return_value = set()
+        self.target.unavailable = False
+        with SpoolOutput(self.outconf, {"resource_id": 2}, self.target):
+            pass
+        self.assertEqual([], os.listdir(os.path.join(self.tmpdir, "2")))
+
+
+class TestFileOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "out-%r.json")
+        self.resconf = {"resource_id": 1, "name": "cluster"}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def output(self, **outconf):
+        outconf.setdefault("comp_file", self.path)
+        return FileOutput(outconf, self.resconf)
+
+    def outpath(self):
+        return self.path.replace("%r", "cluster")
+
+    def test_complete(self):
+        with self.output(json_format="complete") as out:
+            out.process({"job": 1}, {"m": 1})
+            out.process({"job": 2}, {"m": 2})
+
+        with open(self.outpath()) as fp:
+            self.assertEqual([{"job": 1}, {"m": 1}, {"job": 2}, {"m": 2}], json.load(fp))
+
+    def test_complete_empty(self):
+        with self.output(json_format="complete"):
+            pass
+
+        with open(self.outpath()) as fp:
+            self.assertEqual([], json.load(fp))
+
+    def test_jsonl(self):
+        with self.output(json_format="jsonl", fsync_interval=0) as out:
+            out.process({"job": 1}, {"m": 1})
+            # Written lines are on disk while the output is open
+            with open(self.outpath()) as fp:
+                self.assertEqual([{"job": 1}, {"m": 1}], [json.loads(line) for line in fp])
+            out.process({"job": 2}, {"m": 2})
+
+        with open(self.outpath()) as fp:
+            self.assertEqual(4, len(fp.readlines()))
+
+    def test_gzip(self):
+        with self.output(json_format="jsonl", compression="gzip", fsync_interval=0) as out:
+            out.process({"job": 1}, {"m": 1})
+            with open(self.outpath(), "rb") as fp:
+                partial = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(fp.read())
+            self.assertEqual(2, len(partial.splitlines()))
+            out.process({"job": 2}, {"m": 2})
+
+        with gzip.open(self.outpath(), "rt") as fp:
+            self.assertEqual({"m": 2}, json.loads(fp.readlines()[-1]))
+
+    def test_invalid(self):
+        with self.assertRaises(Exception):
+            self.output(json_format="complete", compression="lz4")
+
+
+if __name__ == '__main__':
+    unittest.main()
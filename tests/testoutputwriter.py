@@ -0,0 +1,217 @@
+import time
+import unittest
+from mock import Mock, patch
+
+from supremm.outputwriter import OutputWriter, Committer
+
+
+class Context(object):
+    def __init__(self, calls):
+        self.resconf = {"resource_id": 1}
+        self.datasource = Mock()
+        self.dbif = Mock(batchsize=100, batchinterval=10)
+        self.dbif.markasdone.side_effect = lambda job, *args: calls.append(("markasdone", job))
+        self.m = Mock(spec=["process", "flush"])
+        self.m.process.side_effect = lambda summary, mdata: calls.append(("process", summary["job"]))
+        self.m.flush.side_effect = lambda: calls.append(("flush", None))
+
+
+class TestOutputWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.ctx = Context(self.calls)
+        self.progress = Mock()
+        self.opts = {"dry_run": False, "fail_fast": False}
+
+    def jobs(self, n):
+        return [Mock(job_id=i, jobdir=None) for i in range(n)]
+
+    def result(self, job):
+        return ({"job": job}, {}, True, None)
+
+    def test_write(self):
+        jobs = self.jobs(10)
+        with OutputWriter(self.opts, self.progress) as writer:
+            for job in jobs:
+                writer.submit(self.ctx, job, 1.0, self.result(job))
+
+        self.assertEqual(10, self.ctx.m.process.call_count)
+        self.assertEqual(10, self.ctx.dbif.markasdone.call_count)
+        self.assertEqual(10, self.ctx.datasource.cleanup.call_count)
+        self.assertEqual(10, self.progress.finished.call_count)
+
+        # Each job is marked as done after the outputter is flushed
+        for job in jobs:
+            process = self.calls.index(("process", job))
+            done = self.calls.index(("markasdone", job))
+            self.assertIn(("flush", None), self.calls[process:done])
+
+    def test_failures(self):
+        self.ctx.m.process.side_effect = Exception("write failed")
+        jobs = self.jobs(2)
+        with OutputWriter(self.opts, self.progress) as writer:
+            writer.submit(self.ctx, jobs[0], 1.0, self.result(jobs[0]))
+            writer.submit(self.ctx, jobs[1], 1.0, None)
+
+        self.ctx.dbif.markasdone.assert_not_called()
+        self.assertEqual([False, False], [c[0][2] for c in self.progress.finished.call_args_list])
+
+    def test_not_written(self):
+        jobs = self.jobs(3)
+        self.ctx.m.process.side_effect = lambda summary, mdata: summary["job"].job_id
+        self.ctx.m.flush.side_effect = lambda: {1}
+        with OutputWriter(self.opts, self.progress, batchsize=3) as writer:
+            for job in jobs:
+                writer.submit(self.ctx, job, 1.0, self.result(job))
+
+        self.assertEqual([jobs[0], jobs[2]], [c[0][0] for c in self.ctx.dbif.markasdone.call_args_list])
+        outcome = dict((c[0][1].job_id, c[0][2]) for c in self.progress.finished.call_args_list)
+        self.assertEqual({0: True, 1: False, 2: True}, outcome)
+
+    def test_accounting_flush(self):
+        jobs = self.jobs(4)
+        self.ctx.dbif.flush.side_effect = lambda: self.calls.append(("dbflush", None))
+        self.progress.finished.side_effect = lambda resconf, job, success: self.calls.append(("finished", job))
+        with OutputWriter(self.opts, self.progress, batchsize=4) as writer:
+            for job in jobs:
+                writer.submit(self.ctx, job, 1.0, self.result(job))
+
+        # The process updates are written before the jobs are recorded as finished
+        self.assertLess(self.calls.index(("markasdone", jobs[-1])), self.calls.index(("dbflush", None)))
+        self.assertLess(self.calls.index(("dbflush", None)), self.calls.index(("finished", jobs[0])))
+
+        self.ctx.dbif.flush.side_effect = Exception("database unavailable")
+        self.progress.reset_mock()
+        with OutputWriter(self.opts, self.progress) as writer:
+            writer.submit(self.ctx, jobs[0], 1.0, self.result(jobs[0]))
+
+        self.assertEqual([False], [c[0][2] for c in self.progress.finished.call_args_list])
+
+    def test_buffered_outputter(self):
+        self.ctx.m = BufferedOutput()
+        jobs = self.jobs(5)
+        with OutputWriter(self.opts, self.progress, batchsize=1) as writer:
+            for job in jobs:
+                writer.submit(self.ctx, job, 1.0, self.result(job))
+
+        # The outputter is only flushed when the writer is closed
+        self.assertEqual(1, self.ctx.m.flushes)
+        self.assertEqual(jobs, [c[0][0] for c in self.ctx.dbif.markasdone.call_args_list])
+        self.assertEqual([True] * 5, [c[0][2] for c in self.progress.finished.call_args_list])
+
+    def test_backpressure(self):
+        def slow(summary, mdata):
+            time.sleep(0.005)
+
+        self.ctx.m.process.side_effect = slow
+        with OutputWriter(self.opts, self.progress, maxqueue=2, batchsize=2) as writer:
+            for job in self.jobs(20):
+                writer.submit(self.ctx, job, 1.0, self.result(job))
+                self.assertLessEqual(writer._queue.qsize(), 2)
+
+        self.assertEqual(20, self.ctx.dbif.markasdone.call_count)
+
+    def test_fail_fast(self):
+        self.opts["fail_fast"] = True
+        self.ctx.m.process.side_effect = ValueError("write failed")
+        job = self.jobs(1)[0]
+        writer = OutputWriter(self.opts, self.progress)
+        writer.submit(self.ctx, job, 1.0, self.result(job))
+        with self.assertRaises(ValueError):
+            writer.close()
+
+
+class BufferedOutput(object):
+    """ Outputter that writes the summaries in pairs """
+
+    def __init__(self):
+        self.buffered = []
+        self.written = set()
+        self.flushes = 0
+
+    def process(self, summary, mdata):
+        self.buffered.append(summary["job"].job_id)
+        if len(self.buffered) == 2:
+            self.written.update(self.buffered)
+            self.buffered = []
+        return summary["job"].job_id
+
+    def completed(self):
+        written, self.written = self.written, set()
+        return written, set()
+
+    def flush(self):
+        self.flushes += 1
+        self.buffered = []
+        return set()
+
+
+class TestCommitter(unittest.TestCase):
+
+    def setUp(self):
+        self.finished = []
+        self.dbif = Mock(batchsize=1, batchinterval=0)
+        self.opts = {"dry_run": False, "fail_fast": False}
+        self.committer = Committer(self.opts, lambda ctx, job, success: self.finished.append((job.job_id, success)))
+
+    def add(self, m, jobid):
+        job = Mock(job_id=jobid)
+        self.committer.add(m, self.dbif, job, m.process({"job": job}, {}), 1.0, True, None)
+        self.committer.commit()
+
+    def test_buffered(self):
+        m = BufferedOutput()
+        self.add(m, 1)
+        self.assertEqual([], self.finished)
+        self.add(m, 2)
+        self.assertEqual([(1, True), (2, True)], self.finished)
+        self.add(m, 3)
+        self.assertEqual(2, self.dbif.markasdone.call_count)
+        self.assertEqual(0, m.flushes)
+
+        # The remaining jobs are written when the commit is forced
+        self.committer.commit(force=True)
+        self.assertEqual(1, m.flushes)
+        self.assertEqual([(1, True), (2, True), (3, True)], self.finished)
+        self.assertEqual(3, self.dbif.markasdone.call_count)
+
+    def test_failed(self):
+        m = Mock(spec=["process", "flush"])
+        m.process.side_effect = lambda summary, mdata: summary["job"].job_id
+        m.flush.side_effect = [{1}, Exception("database unavailable")]
+        self.add(m, 1)
+        self.add(m, 2)
+        self.assertEqual([(1, False), (2, False)], self.finished)
+        self.dbif.markasdone.assert_not_called()
+
+    def test_accounting_batch(self):
+        self.dbif.batchsize = 2
+        self.dbif.batchinterval = 10
+        m = Mock(spec=["process"])
+        self.add(m, 1)
+        self.assertEqual([], self.finished)
+        self.dbif.flush.assert_not_called()
+
+        self.add(m, 2)
+        self.assertEqual(1, self.dbif.flush.call_count)
+        self.assertEqual([(1, True), (2, True)], self.finished)
+
+        # The updates are also written once the oldest is batchinterval seconds old
+        with patch("supremm.outputwriter.time.time", return_value=0):
+            self.add(m, 3)
+        self.assertEqual(1, self.dbif.flush.call_count)
+        self.committer.commit()
+        self.assertEqual(2, self.dbif.flush.call_count)
+        self.assertEqual((3, True), self.finished[-1])
+
+    def test_dry_run(self):
+        self.opts["dry_run"] = True
+        self.add(Mock(spec=["process"]), 1)
+        self.assertEqual([(1, True)], self.finished)
+        self.dbif.markasdone.assert_not_called()
+        self.dbif.flush.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import unittest
+from mock import Mock
+
+from supremm.pluginversions import classversions, stalenames, select, select_stale, summaryid
+from supremm.datasource.datasource import Datasource, JobMeta
+from supremm.summarize import Summarize
+
+
+class Proc(object):
+    version = 1
+    name = "proc"
+
+
+class Hinv(object):
+    version = 1
+    name = "hinv"
+
+
+class CpuUsage(object):
+    version = 2
+    name = "cpu"
+    requiredData = ("proc",)
+
+
+class Memory(object):
+    version = 1
+
+
+class Partial(Summarize):
+    """ Summary of the plugins and preprocessors of a job that is not processed """
+
+    def get(self):
+        return {}
+
+    def process(self):
+        return True
+
+    def complete(self):
+        return True
+
+    def good_enough(self):
+        return True
+
+
+class Source(Datasource):
+
+    def presummarize(self, job, config, resconf, opts):
+        return super().presummarize(job, config, resconf, opts)
+
+    def summarizejob(self, job, jobmeta, config, opts):
+        return super().summarizejob(job, jobmeta, config, opts)
+
+    def cleanup(self, job, opts):
+        pass
+
+
+def instance(cls, status="complete", result=None, mode="all"):
+    obj = cls()
+    obj.status = status
+    obj.mode = mode
+    obj.results = lambda: result
+    return obj
+
+
+class Stored(object):
+    def __init__(self, versions):
+        self.versions = versions
+        self.lookups = 0
+
+    def lookup(self, ids):
+        self.lookups += 1
+        return dict((i, self.versions[i]) for i in ids if i in self.versions)
+
+
+def job(jobid):
+    return Mock(job_id=jobid, acct={"end_time": 100}, rerun=None)
+
+
+class TestPluginVersions(unittest.TestCase):
+
+    def setUp(self):
+        self.current = classversions([Proc, Hinv, CpuUsage, Memory])
+
+    def test_classversions(self):
+        self.assertEqual({"Proc": 1, "Hinv": 1, "CpuUsage": 2, "Memory": 1}, self.current)
+
+    def test_stalenames(self):
+        self.assertEqual(set(), stalenames({"Proc": 1, "Hinv": 1, "CpuUsage": 2, "Memory": 1}, self.current))
+        self.assertEqual({"CpuUsage"}, stalenames({"Proc": 1, "Hinv": 1, "CpuUsage": 1, "Memory": 1}, self.current))
+        self.assertEqual({"Memory"}, stalenames({"Proc": 1, "Hinv": 1, "CpuUsage": 3}, self.current))
+
+    def test_select(self):
+        preprocs = [Proc(), Hinv()]
+        analytics = [CpuUsage(), Memory()]
+
+        p, a = select(preprocs, analytics, {"CpuUsage"})
+        self.assertEqual([Proc], [type(x) for x in p])
+        self.assertEqual([CpuUsage], [type(x) for x in a])
+
+        p, a = select(preprocs, analytics, {"Memory", "Hinv"})
+        self.assertEqual([Hinv], [type(x) for x in p])
+        self.assertEqual([Memory], [type(x) for x in a])
+
+        # The plugins that use the data of a stale preprocessor are run again
+        p, a = select(preprocs, analytics, {"Proc"})
+        self.assertEqual([Proc], [type(x) for x in p])
+        self.assertEqual([CpuUsage], [type(x) for x in a])
+
+    def test_select_stale(self):
+        jobs = [job(i) for i in range(5)]
+        stored = Stored({
+            "0-100": {"Proc": 1, "Hinv": 1, "CpuUsage": 2, "Memory": 1},
+            "1-100": {"Proc": 1, "Hinv": 1, "CpuUsage": 1, "Memory": 1},
+            "3-100": {}
+        })
+
+        selected = list(select_stale(jobs, stored, self.current, batchsize=2))
+
+        self.assertEqual([1, 3], [j.job_id for j in selected])
+        self.assertEqual({"CpuUsage"}, selected[0].rerun)
+        self.assertEqual(set(self.current), selected[1].rerun)
+        self.assertIsNone(jobs[0].rerun)
+        self.assertEqual(3, stored.lookups)
+        self.assertEqual("3-100", summaryid(jobs[3]))
+
+
+class TestRerun(unittest.TestCase):
+
+    def setUp(self):
+        self.job = Mock(nodecount=2, rerun={"Proc", "CpuUsage", "Memory"})
+        self.source = Source([Proc, Hinv], [CpuUsage, Memory])
+
+    def test_versions(self):
+        # Memory does not apply to the job, Proc has no result
+        summary = Partial([instance(Proc)], [instance(CpuUsage)], self.job, None)
+        jobmeta = JobMeta()
+        self.source.rerunversions(self.job, jobmeta, summary)
+        self.assertEqual({"CpuUsage": 2, "Memory": 1}, jobmeta.mdata["versions"])
+
+        summary = Partial([instance(Proc, result={"procDump": {}})], [instance(CpuUsage, status="uninitialized")], self.job, None)
+        jobmeta = JobMeta()
+        self.source.rerunversions(self.job, jobmeta, summary)
+        self.assertEqual({"Proc": 1, "Memory": 1}, jobmeta.mdata["versions"])
+
+    def test_full_run(self):
+        self.job.rerun = None
+        jobmeta = JobMeta()
+        jobmeta.mdata["versions"] = classversions([Proc, Hinv, CpuUsage, Memory])
+        self.source.rerunversions(self.job, jobmeta, Partial([], [], self.job, None))
+        self.assertEqual(classversions([Proc, Hinv, CpuUsage, Memory]), jobmeta.mdata["versions"])
+
+    def test_errors(self):
+        summary = Partial([instance(Proc, result={"procDump": {}})], [instance(CpuUsage)], self.job, None)
+        summary.adderror("cpu", "no data")
+        self.assertEqual({"proc": [], "cpu": ["no data"]}, summary.summaryerrors())
+
+        self.job.rerun = None
+        self.assertEqual({"cpu": ["no data"]}, summary.summaryerrors())
+
+
+if __name__ == '__main__':
+    unittest.main()
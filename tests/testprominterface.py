@@ -0,0 +1,306 @@
+import os
+import json
+import zlib
+import pickle
+import shutil
+import tempfile
+import unittest
+from mock import Mock, patch
+import numpy
+
+from supremm.datasource.prometheus.prominterface import PromClient, Context
+from supremm.datasource.prometheus.prommapping import MappingManager
+from supremm.datasource.prometheus.promcache import PromCache, encode
+from supremm.datasource.prometheus.promremoteread import PromRemoteReadClient
+from supremm.datasource.prometheus.promstream import StreamDecoder
+
+
+def vector(instances):
+    """ Build a Prometheus instant vector response """
+    result = [{"metric": {"host": "node1", "device": dev}, "value": [1000, str(val)]} for dev, val in instances]
+    return {"status": "success", "data": {"resultType": "vector", "result": result}}
+
+
+class TestFirstlastPushdown(unittest.TestCase):
+
+    def setUp(self):
+        self.params = ["host"]
+        self.defaults = {"environment": "prod"}
+        self.metric = {"name": "node_disk_reads_completed_total", "groupby": "device"}
+
+    def build(self, firstlast):
+        mmap = MappingManager.query_builder(self.params, self.defaults, self.metric, firstlast)
+        mmap.query = mmap.queryformat.format("node1")
+        return mmap
+
+    def test_default_is_raw(self):
+        mmap = MappingManager.query_builder(self.params, self.defaults, self.metric)
+        self.assertEqual("raw", mmap.firstlast)
+
+    def test_invalid_mode(self):
+        mmap = self.build("bogus")
+        self.assertEqual("raw", mmap.firstlast)
+
+    def test_metric_override(self):
+        self.metric["firstlast"] = "increase"
+        mmap = self.build("offset")
+        self.assertEqual("increase", mmap.firstlast)
+
+    def test_queries(self):
+        mmap = self.build("offset")
+        self.assertEqual("{0} - {0} offset 3600s".format(mmap.query), mmap.apply_firstlast(1000, 4600))
+
+        mmap = self.build("increase")
+        self.assertEqual("increase({0}[3600s])".format(mmap.query), mmap.apply_firstlast(1000, 4600))
+
+    def test_fetch_raw(self):
+        client = Mock(spec=PromClient)
+        client.query.return_value = vector([("sda", 10)])
+
+        ctx = Context(1000, 4600, client)
+        ctx.mode = "firstlast"
+        results = list(ctx.fetch([self.build("raw")]))
+
+        self.assertEqual(2, len(results))
+        self.assertEqual(2, client.query.call_count)
+
+    def test_fetch_pushdown(self):
+        client = Mock(spec=PromClient)
+        client.query.return_value = vector([("sda", 10), ("sdb", 20)])
+
+        ctx = Context(1000, 4600, client)
+        ctx.mode = "firstlast"
+        mmap = self.build("offset")
+        results = ctx.fetch([mmap])
+
+        first = next(results)
+        data, description = next(ctx.extract_values(first))
+        self.assertTrue(numpy.all(data[0] == numpy.array([0, 0])))
+        self.assertEqual(["sda", "sdb"], description[0][1])
+
+        last = next(results)
+        data, description = next(ctx.extract_values(last))
+        self.assertTrue(numpy.all(data[0] == numpy.array([10, 20])))
+        self.assertEqual(["sda", "sdb"], description[0][1])
+
+        self.assertEqual(1, client.query.call_count)
+        client.query.assert_called_with(mmap.apply_firstlast(1000, 4600), 4600)
+
+
+class TestMergedQueries(unittest.TestCase):
+
+    def setUp(self):
+        self.params = ["host"]
+        self.defaults = {"environment": "prod"}
+
+    def build(self, name, groupby, defaults=None, firstlast="raw"):
+        metric = {"name": name, "groupby": groupby}
+        if defaults:
+            metric["defaults"] = defaults
+        mmap = MappingManager.query_builder(self.params, self.defaults, metric, firstlast)
+        mmap.query = mmap.queryformat.format("node1")
+        return mmap
+
+    @staticmethod
+    def matrix(series):
+        result = [{"metric": labels, "values": numpy.array([[1000, val], [1030, val]])} for labels, val in series]
+        return {"status": "success", "data": {"resultType": "matrix", "result": result}}
+
+    def cpumetrics(self, firstlast="raw"):
+        return [self.build("node_cpu_seconds_total", "cpu", {"mode": mode}, firstlast) for mode in ("user", "system", "idle")]
+
+    def test_merge_label(self):
+        metrics = self.cpumetrics()
+        metrics.append(self.build("node_load1", "host"))
+
+        queries = MappingManager.mergequeries(metrics)
+        self.assertEqual(2, len(queries))
+        self.assertEqual([0, 1, 2], queries[0].indices)
+        self.assertEqual("mode", queries[0].label)
+        self.assertEqual("node_cpu_seconds_total{mode=~'user|system|idle',host='node1',environment='prod'}", queries[0].query)
+        self.assertEqual([3], queries[1].indices)
+        self.assertEqual(metrics[3].query, queries[1].query)
+
+    def test_merge_name(self):
+        metrics = [self.build("node_disk_reads_completed_total", "device"), self.build("node_disk_writes_completed_total", "device")]
+
+        queries = MappingManager.mergequeries(metrics)
+        self.assertEqual(1, len(queries))
+        self.assertEqual("{__name__=~'node_disk_reads_completed_total|node_disk_writes_completed_total',host='node1',environment='prod'}", queries[0].query)
+
+        # Arithmetic drops the metric name so the results could not be split
+        queries = MappingManager.mergequeries(metrics, pushdown=True)
+        self.assertEqual(2, len(queries))
+
+    def test_escape(self):
+        metrics = [self.build("node_filesystem_size_bytes", "device", {"mountpoint": mp}) for mp in ("/", "/home.d")]
+        queries = MappingManager.mergequeries(metrics)
+        self.assertEqual(1, len(queries))
+        self.assertIn("mountpoint=~'/|/home\\\\.d'", queries[0].query)
+
+    def test_fetch_split(self):
+        client = Mock(spec=PromClient)
+        client.query_raw.return_value = self.matrix([
+            ({"host": "node1", "cpu": "0", "mode": "idle"}, 3),
+            ({"host": "node1", "cpu": "0", "mode": "user"}, 1),
+            ({"host": "node1", "cpu": "1", "mode": "idle"}, 6),
+            ({"host": "node1", "cpu": "1", "mode": "user"}, 4)
+        ])
+
+        ctx = Context(1000, 1030, client)
+        ctx.mode = "all"
+        result = next(ctx.fetch(self.cpumetrics()))
+
+        self.assertEqual(1, client.query_raw.call_count)
+        self.assertEqual(3, len(result))
+        self.assertEqual(["0", "1"], [inst["metric"]["cpu"] for inst in result[0]["data"]["result"]])
+        self.assertEqual([1, 4], [inst["values"][0][1] for inst in result[0]["data"]["result"]])
+        self.assertEqual([], result[1]["data"]["result"])
+        self.assertEqual([3, 6], [inst["values"][0][1] for inst in result[2]["data"]["result"]])
+
+    def test_fetch_unmerged(self):
+        client = Mock(spec=PromClient)
+        client.query_raw.return_value = self.matrix([])
+
+        ctx = Context(1000, 1030, client, merge=False)
+        ctx.mode = "all"
+        next(ctx.fetch(self.cpumetrics()))
+        self.assertEqual(3, client.query_raw.call_count)
+
+
+class TestPromCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.cache = PromCache(self.cachedir, 10 * 1024 * 1024, 3600)
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def test_disabled(self):
+        self.assertIsNone(PromCache.fromconfig({}))
+
+    def test_roundtrip(self):
+        response = vector([("sda", 10)])
+        self.cache.put("node_load1{host='node1'}", 1000, 4600, response)
+
+        self.assertEqual(response, self.cache.get("node_load1{host='node1'}", 1000, 4600))
+        self.assertEqual(response, self.cache.get(" node_load1{ host = 'node1' }", 1000, 4600))
+        self.assertIsNone(self.cache.get("node_load1{host='node 1'}", 1000, 4600))
+        self.assertIsNone(self.cache.get("node_load1{host='node1'}", 1000, 4601))
+
+    def test_matrix(self):
+        response = {"status": "success", "data": {"resultType": "matrix", "result": [
+            {"metric": {"host": "node1"}, "values": numpy.array([[1000.5, 1.5], [1030.5, numpy.nan]])},
+            {"metric": {"host": "node2"}, "values": numpy.empty((0, 2))}
+        ]}}
+        self.cache.put("up", 1000, 4600, response)
+
+        result = self.cache.get("up", 1000, 4600)["data"]["result"]
+        self.assertEqual({"host": "node1"}, result[0]["metric"])
+        numpy.testing.assert_array_equal(response["data"]["result"][0]["values"], result[0]["values"])
+        self.assertEqual((0, 2), result[1]["values"].shape)
+
+    def test_namespace(self):
+        other = PromCache(self.cachedir, 10 * 1024 * 1024, 3600, "http://other:9090 remote_read")
+        self.cache.put("up", 1000, 4600, vector([("sda", 10)]))
+        self.assertIsNone(other.get("up", 1000, 4600))
+
+        resconf = {"prom_host": "localhost:9090", "prom_user": "", "prom_cache_dir": self.cachedir}
+        with patch.object(PromClient, "build_info", return_value=True):
+            self.assertEqual("http://localhost:9090 query", PromClient(resconf)._cache._namespace)
+            self.assertEqual("http://localhost:9090 remote_read", PromRemoteReadClient(resconf)._cache._namespace)
+
+    def test_not_unpickled(self):
+        path = self.cache.path("up", 1000, 4600)
+        os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as fp:
+            fp.write(zlib.compress(pickle.dumps({"status": "success"})))
+        self.assertIsNone(self.cache.get("up", 1000, 4600))
+
+    def test_recent_data_not_cached(self):
+        self.cache.put("up", 1000, 2e10, vector([("sda", 10)]))
+        self.assertIsNone(self.cache.get("up", 1000, 2e10))
+
+    def test_eviction(self):
+        # Room for four entries
+        value = numpy.random.random(2048)
+        cache = PromCache(self.cachedir, int(4.3 * len(encode(value))), 3600)
+
+        for i in range(4):
+            cache.put("up", i, 4600, value)
+            os.utime(cache.path("up", i, 4600), (i, i))
+
+        # Access the first entry so that the second one is least recently used
+        self.assertIsNotNone(cache.get("up", 0, 4600))
+        cache.put("up", 4, 4600, value)
+
+        self.assertIsNotNone(cache.get("up", 0, 4600))
+        self.assertIsNone(cache.get("up", 1, 4600))
+        self.assertIsNotNone(cache.get("up", 4, 4600))
+
+    def test_client(self):
+        client = PromClient.__new__(PromClient)
+        client._cache = self.cache
+        client.fetch_instant = Mock(return_value=vector([("sda", 10)]))
+
+        client.query("up", 1000)
+        client.query("up", 1000)
+
+        self.assertEqual(1, client.fetch_instant.call_count)
+
+
+class TestStreamDecoder(unittest.TestCase):
+
+    @staticmethod
+    def chunked(text, size):
+        body = text.encode()
+        return [body[i:i + size] for i in range(0, len(body), size)]
+
+    def test_matrix(self):
+        response = {
+            "status": "success",
+            "data": {
+                "resultType": "matrix",
+                "result": [
+                    {"metric": {"host": "n\u00f6de1", "cpu": "0"}, "values": [[1000.5, "1.5"], [1030.5, "NaN"]]},
+                    {"metric": {"host": "n\u00f6de1", "cpu": "1"}, "values": [[1000.5, "2"], [1030.5, "+Inf"], [1060.5, "1e+21"]]}
+                ]
+            },
+            "warnings": ["test"]
+        }
+        text = json.dumps(response, indent=1, ensure_ascii=False)
+
+        for size in (1, 7, 1024):
+            result = StreamDecoder(self.chunked(text, size)).decode()
+
+            self.assertEqual("success", result["status"])
+            self.assertEqual("matrix", result["data"]["resultType"])
+            self.assertEqual(2, len(result["data"]["result"]))
+
+            for expected, actual in zip(response["data"]["result"], result["data"]["result"]):
+                self.assertEqual(expected["metric"], actual["metric"])
+                expvalues = numpy.array([[ts, float(v)] for ts, v in expected["values"]])
+                self.assertTrue(numpy.array_equal(expvalues, actual["values"], equal_nan=True))
+
+    def test_vector(self):
+        response = vector([("sda", 10), ("sdb", 20)])
+        result = StreamDecoder(self.chunked(json.dumps(response), 5)).decode()
+        self.assertEqual(response, result)
+
+    def test_empty(self):
+        response = {"status": "success", "data": {"resultType": "matrix", "result": []}}
+        self.assertEqual(response, StreamDecoder(self.chunked(json.dumps(response), 3)).decode())
+
+    def test_error(self):
+        response = {"status": "error", "errorType": "bad_data", "error": "parse error"}
+        self.assertEqual(response, StreamDecoder(self.chunked(json.dumps(response), 3)).decode())
+
+    def test_truncated(self):
+        text = json.dumps(vector([("sda", 10), ("sdb", 20)]))
+        with self.assertRaises(ValueError):
+            StreamDecoder(self.chunked(text[:-20], 5)).decode()
+
+
+if __name__ == '__main__':
+    unittest.main()
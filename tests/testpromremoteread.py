@@ -0,0 +1,144 @@
+import json
+import struct
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import numpy
+
+from supremm.datasource.prometheus import promremoteread
+from supremm.datasource.prometheus.promremoteread import encode_field, encode_int_field, iterfields, parse_selector
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+STALE = struct.pack("<Q", promremoteread.STALE_NAN)
+
+
+def encode_sample(value, timestamp_ms):
+    """ Encode a Sample message the same way as the Go protobuf library
+        (zero values are omitted) """
+    sample = b""
+    if value != 0.0:
+        sample += bytes([0x09]) + struct.pack("<d", value)
+    if timestamp_ms != 0:
+        sample += encode_int_field(2, timestamp_ms)
+    return encode_field(2, sample)
+
+
+def encode_series(labels, samples):
+    """ Encode a TimeSeries message """
+    msg = b""
+    for name, value in labels.items():
+        msg += encode_field(1, encode_field(1, name.encode()) + encode_field(2, value.encode()))
+    for value, timestamp_ms in samples:
+        if isinstance(value, bytes):
+            msg += encode_field(2, bytes([0x09]) + value + encode_int_field(2, timestamp_ms))
+        else:
+            msg += encode_sample(value, timestamp_ms)
+    return encode_field(1, msg)
+
+
+class StandInPrometheus(BaseHTTPRequestHandler):
+    """ Minimal Prometheus server that supports buildinfo and remote read """
+
+    series = []
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = json.dumps({"status": "success", "data": {}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        request = snappy.uncompress(self.rfile.read(length))
+
+        # Decode the matchers of the first query
+        matchers = []
+        for fieldnum, _, qstart, qend in iterfields(request, 0, len(request)):
+            if fieldnum != 1:
+                continue
+            for qfield, _, mstart, mend in iterfields(request, qstart, qend):
+                if qfield == 3:
+                    matcher = {}
+                    for mfield, wiretype, value, vend in iterfields(request, mstart, mend):
+                        matcher[mfield] = value if wiretype == 0 else request[value:vend].decode()
+                    matchers.append((matcher.get(1, 0), matcher[2], matcher[3]))
+            break
+        StandInPrometheus.requests.append(matchers)
+
+        body = b"".join(encode_series(labels, samples) for labels, samples in StandInPrometheus.series)
+        body = snappy.compress(encode_field(1, body))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-protobuf")
+        self.send_header("Content-Encoding", "snappy")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestSelectorParsing(unittest.TestCase):
+
+    def test_selector(self):
+        matchers = parse_selector("node_cpu_seconds_total{host='node1',mode=~\"user|idle\",cpu!='0'}")
+        self.assertEqual([(0, "__name__", "node_cpu_seconds_total"), (0, "host", "node1"), (2, "mode", "user|idle"), (1, "cpu", "0")], matchers)
+
+    def test_no_labels(self):
+        self.assertEqual([(0, "__name__", "up")], parse_selector("up"))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            parse_selector("rate(up[5m])")
+
+
+@unittest.skipIf(snappy is None, "python-snappy is not installed")
+class TestRemoteReadClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), StandInPrometheus)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+        resconf = {"prom_host": "127.0.0.1:{}".format(self.server.server_port), "prom_user": ""}
+        self.client = promremoteread.PromRemoteReadClient(resconf)
+
+        StandInPrometheus.requests = []
+        StandInPrometheus.series = [
+            ({"__name__": "node_load1", "host": "node1", "cpu": "0"},
+             [(1.5, 1600000000000), (2.5, 1600000030000), (0.0, 1600000060000), (3.5, 1600000090000), (STALE, 1600000120000)]),
+            ({"__name__": "node_load1", "host": "node1", "cpu": "1"}, [])
+        ]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_query_raw(self):
+        self.assertTrue(self.client.connection)
+
+        result = self.client.query_raw("node_load1{host='node1'}", 1600000000, 1600000120)
+
+        self.assertEqual([[(0, "__name__", "node_load1"), (0, "host", "node1")]], StandInPrometheus.requests)
+        self.assertEqual("matrix", result["data"]["resultType"])
+
+        # Series without samples are dropped, like the query API does
+        self.assertEqual(1, len(result["data"]["result"]))
+
+        inst = result["data"]["result"][0]
+        self.assertEqual("0", inst["metric"]["cpu"])
+
+        expected = numpy.array([[1600000000.0, 1.5], [1600000030.0, 2.5], [1600000060.0, 0.0], [1600000090.0, 3.5]])
+        self.assertTrue(numpy.array_equal(expected, inst["values"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
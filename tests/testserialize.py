@@ -0,0 +1,59 @@
+import json
+import datetime
+import unittest
+import numpy
+import bson
+
+from supremm.serialize import tonative, dumps, CODEC_OPTIONS
+
+
+class TestSerialize(unittest.TestCase):
+
+    def setUp(self):
+        self.document = {
+            "times": numpy.arange(3, dtype=numpy.float64),
+            "hosts": {"0": {"all": numpy.array([0.5, 1.5], dtype=numpy.float32), "dev": {"0": numpy.arange(2)}}},
+            "avg": numpy.float64(2.5),
+            "cnt": numpy.int64(7),
+            "ok": numpy.bool_(True),
+            "name": "cpuuser"
+        }
+
+    def test_tonative(self):
+        self.assertEqual(tonative(numpy.arange(3)), [0, 1, 2])
+        self.assertIsInstance(tonative(numpy.int32(4)), int)
+        self.assertIsInstance(tonative(numpy.float32(0.5)), float)
+        self.assertEqual(tonative("x"), "x")
+
+    def test_dumps(self):
+        result = json.loads(dumps(self.document))
+        self.assertEqual(result["times"], [0.0, 1.0, 2.0])
+        self.assertEqual(result["hosts"]["0"]["all"], [0.5, 1.5])
+        self.assertEqual(result["hosts"]["0"]["dev"]["0"], [0, 1])
+        self.assertEqual(result["avg"], 2.5)
+        self.assertEqual(result["cnt"], 7)
+        self.assertIs(result["ok"], True)
+
+    def test_compact(self):
+        text = dumps({"a": [1, 2], "b": {"c": 1}})
+        self.assertEqual(text, '{"a":[1,2],"b":{"c":1}}')
+        self.assertIn("\n", dumps({"a": 1}, indent=4))
+
+    def test_fallback(self):
+        text = dumps({"when": datetime.datetime(2024, 1, 2, 3, 4, 5), "s": set([1])})
+        self.assertEqual(json.loads(text), {"when": "2024-01-02 03:04:05", "s": [1]})
+
+    def test_bson(self):
+        data = bson.encode(self.document, codec_options=CODEC_OPTIONS)
+        result = bson.decode(data)
+        self.assertEqual(result["times"], [0.0, 1.0, 2.0])
+        self.assertEqual(result["hosts"]["0"]["dev"]["0"], [0, 1])
+        self.assertEqual(result["cnt"], 7)
+        self.assertEqual(result["avg"], 2.5)
+
+        with self.assertRaises(bson.errors.InvalidDocument):
+            bson.encode(self.document)
+
+
+if __name__ == '__main__':
+    unittest.main()
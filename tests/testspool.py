@@ -0,0 +1,123 @@
+import os
+import glob
+import shutil
+import datetime
+import tempfile
+import unittest
+from mock import Mock
+
+from supremm.spool import Spool, Replayer, read_segment
+
+
+class TestSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.spool = Spool(self.tmpdir, segment_size=1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def files(self, pattern):
+        return sorted(glob.glob(os.path.join(self.tmpdir, pattern)))
+
+    def test_segments(self):
+        created = datetime.datetime(2024, 1, 1, 12, 0)
+        for i in range(20):
+            self.spool.append({"job": i, "created": created, "data": b"x" * 100})
+        self.spool.close()
+
+        segments = self.files("*.seg")
+        self.assertGreater(len(segments), 1)
+        self.assertEqual([], self.files("*.open"))
+
+        documents = [doc for path in segments for doc in read_segment(path)]
+        self.assertEqual(list(range(20)), [doc["job"] for doc in documents])
+        self.assertEqual(created, documents[0]["created"])
+        self.assertEqual(b"x" * 100, documents[0]["data"])
+
+    def test_truncated(self):
+        self.spool.append({"job": 1})
+        self.spool.append({"job": 2})
+        self.spool.close()
+        path = self.files("*.seg")[0]
+        with open(path, "r+b") as fp:
+            fp.truncate(os.path.getsize(path) - 3)
+
+        self.assertEqual([1], [doc["job"] for doc in read_segment(path)])
+
+    def test_seal_by_age(self):
+        self.spool.append({"job": 1})
+        self.spool.seal()
+        self.assertEqual([], self.files("*.seg"))
+        self.spool.max_age = 0
+        self.spool.seal()
+        self.assertEqual(1, len(self.files("*.seg")))
+
+    def test_recover(self):
+        # Segments of a process that has exited
+        with open(os.path.join(self.tmpdir, "00000000000000000010001-999999999.open"), "wb") as fp:
+            fp.write(b"")
+        with open(os.path.join(self.tmpdir, "00000000000000000020001-1.seg.999999999"), "wb") as fp:
+            fp.write(b"")
+
+        Spool(self.tmpdir)
+        self.assertEqual(2, len(self.files("*.seg")))
+
+    def test_claim(self):
+        self.spool.append({"job": 1})
+        self.spool.close()
+
+        path = self.spool.claim()
+        self.assertTrue(path.endswith(".seg.{0}".format(os.getpid())))
+        self.assertIsNone(self.spool.claim())
+        self.spool.release(path)
+        self.assertEqual(1, self.spool.pending())
+
+
+class TestReplayer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.spool = Spool(self.tmpdir)
+        for i in range(3):
+            self.spool.append({"job": i})
+        self.spool.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_replay(self):
+        write = Mock(return_value=[])
+        self.assertEqual(3, Replayer(self.spool, write).replay())
+        self.assertEqual([0, 1, 2], [doc["job"] for doc in write.call_args[0][0]])
+        self.assertEqual(0, self.spool.pending())
+
+    def test_unavailable(self):
+        write = Mock(side_effect=Exception("down"))
+        with self.assertRaises(Exception):
+            Replayer(self.spool, write).replay()
+        self.assertEqual(1, self.spool.pending())
+
+        write.side_effect = None
+        write.return_value = []
+        self.assertEqual(3, Replayer(self.spool, write).replay())
+
+    def test_refused(self):
+        write = Mock(return_value=[1])
+        self.assertEqual(2, Replayer(self.spool, write).replay())
+        rejected = glob.glob(os.path.join(self.tmpdir, "rejected-*.seg"))
+        self.assertEqual(1, len(rejected))
+        self.assertEqual([{"job": 1}], list(read_segment(rejected[0])))
+
+    def test_background(self):
+        write = Mock(return_value=[])
+        replayer = Replayer(self.spool, write, interval=0.01)
+        replayer.start()
+        replayer.stop()
+        self.assertEqual(0, self.spool.pending())
+        self.assertEqual(3, sum(len(c[0][0]) for c in write.call_args_list))
+
+
+if __name__ == '__main__':
+    unittest.main()
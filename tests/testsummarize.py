@@ -47,7 +47,20 @@ class TestPCPSummarizeJob(unittest.TestCase):
                 'resource': None,
                 'tag': None,
                 'dump_proclist': False,
-                'threads': 1
+                'threads': 1,
+                'journal': None,
+                'resume': False,
+                'daemon': False,
+                'poll_interval': 300,
+                'daemon_lag': 600,
+                'queue': None,
+                'lease_time': 600,
+                'min_threads': None,
+                'memory_budget': None,
+                'max_jobs_per_worker': None,
+                'max_worker_rss': None,
+                'partial_update': False,
+                'process_stale': False
         }
 
         confjob = {
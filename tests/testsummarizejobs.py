@@ -0,0 +1,187 @@
+import time
+import unittest
+from mock import Mock, patch
+
+from supremm import summarize_jobs
+from tests.pools import SerialPool
+
+
+class TestWorkerState(unittest.TestCase):
+
+    def setUp(self):
+        self.config = Mock()
+        self.config.resourceconfigs.return_value = [("cluster", {"resource_id": 1, "datasource": "prometheus"})]
+        self.opts = {"fail_fast": True, "job_output_dir": None}
+
+        with patch("supremm.summarize_jobs.loadpreprocessors", return_value=[]), patch("supremm.summarize_jobs.loadplugins", return_value=[]):
+            summarize_jobs.init_worker(self.config, self.opts)
+
+    def test_tasks(self):
+        jobs = [Mock(), Mock()]
+        self.assertEqual([("cluster", jobs[0]), ("cluster", jobs[1])], list(summarize_jobs.iter_jobs(jobs, "cluster")))
+
+    def test_datasource_created_once(self):
+        summary = Mock()
+        summary.get.return_value = {"summary": 1}
+
+        with patch("supremm.summarize_jobs.DatasourceFactory") as factory:
+            datasource = factory.return_value
+            datasource.summarizejob.return_value = (summary, {}, True, None)
+
+            for _ in range(3):
+                job, result, _, usage = summarize_jobs.do_summarize(("cluster", Mock()))
+                self.assertEqual(({"summary": 1}, {}, True, None), result)
+                self.assertGreaterEqual(usage['cputime'], 0)
+
+        self.assertEqual(1, factory.call_count)
+        self.assertEqual(3, datasource.summarizejob.call_count)
+
+    def test_unknown_resource(self):
+        with self.assertRaises(Exception):
+            summarize_jobs.do_summarize(("other", Mock()))
+
+
+class TestSharedPool(unittest.TestCase):
+
+    def makeresource(self, name, share):
+        ctx = summarize_jobs.ResourceContext(name, {"resource_id": name, "share": share}, Mock(), Mock(), Mock(spec=["process", "flush"]))
+        ctx.costmodel.estimate.return_value = Mock(memory=1)
+        ctx.dbif = Mock(batchsize=1, batchinterval=0)
+        ctx.m.flush.return_value = set()
+        return ctx
+
+    def test_interleaved(self):
+        big = self.makeresource("big", 1)
+        small = self.makeresource("small", 1)
+        jobs = dict((name, [Mock(job_id="{0}{1}".format(name, i)) for i in range(n)]) for name, n in (("big", 6), ("small", 2)))
+
+        order = []
+
+        def summarize(task):
+            order.append(task[1].job_id)
+            return task[1], ({}, {}, True, None), 1.0, {"peakrss": 1, "cputime": 1}
+
+        opts = {"dry_run": False, "fail_fast": True}
+        dispatcher = summarize_jobs.Dispatcher(SerialPool(), 4)
+        with patch("supremm.summarize_jobs.do_summarize", side_effect=summarize):
+            summarize_jobs.summarize_pool([(big, jobs["big"]), (small, jobs["small"])], opts, dispatcher)
+
+        # The small resource does not wait for the big one to finish
+        self.assertEqual(["big0", "small0", "big1", "small1", "big2", "big3", "big4", "big5"], order)
+        self.assertEqual(6, big.m.process.call_count)
+        self.assertEqual(2, small.m.process.call_count)
+        self.assertEqual(2, small.dbif.markasdone.call_count)
+
+
+class TestSerial(unittest.TestCase):
+
+    def test_flush_before_finished(self):
+        calls = Mock()
+        summary = Mock()
+        summary.get.return_value = {"summary": 1}
+        datasource = Mock()
+        datasource.summarizejob.return_value = (summary, {}, True, None)
+        m = Mock(spec=["process", "flush"])
+        m.flush.return_value = set()
+        progress = Mock()
+        progress.select.side_effect = lambda resconf, jobs: jobs
+        calls.attach_mock(m.flush, "outflush")
+        calls.attach_mock(progress.finished, "finished")
+        calls.attach_mock(datasource.cleanup, "cleanup")
+        dbif = Mock(batchsize=100, batchinterval=10)
+        calls.attach_mock(dbif.flush, "dbflush")
+        opts = {"dry_run": False, "fail_fast": True}
+        job = Mock(job_id="1")
+
+        summarize_jobs.summarize_serial([job], m, dbif, {"resource_id": 1}, Mock(), opts, datasource, progress)
+
+        names = [c[0] for c in calls.mock_calls]
+        self.assertLess(names.index("dbflush"), names.index("finished"))
+        progress.finished.assert_called_once_with({"resource_id": 1}, job, True)
+
+    def test_accounting_batch(self):
+        summary = Mock()
+        summary.get.return_value = {"summary": 1}
+        datasource = Mock()
+        datasource.summarizejob.return_value = (summary, {}, True, None)
+        dbif = Mock(batchsize=100, batchinterval=10)
+        progress = Mock()
+        progress.select.side_effect = lambda resconf, jobs: jobs
+        opts = {"dry_run": False, "fail_fast": True}
+        jobs = [Mock(job_id=str(i)) for i in range(3)]
+
+        summarize_jobs.summarize_serial(jobs, Mock(spec=["process"]), dbif, {"resource_id": 1}, Mock(), opts, datasource, progress)
+
+        # The process updates are written together when the job loop ends
+        self.assertEqual(3, dbif.markasdone.call_count)
+        dbif.flush.assert_called_once_with()
+        self.assertEqual(jobs, [c[0][1] for c in progress.finished.call_args_list])
+
+    def test_flush_failure(self):
+        summary = Mock()
+        summary.get.return_value = {"summary": 1}
+        datasource = Mock()
+        datasource.summarizejob.return_value = (summary, {}, True, None)
+        m = Mock(spec=["process", "flush"])
+        m.flush.return_value = set()
+        dbif = Mock(batchsize=100, batchinterval=10)
+        dbif.flush.side_effect = [Exception("lost connection"), None]
+        progress = Mock()
+        progress.select.side_effect = lambda resconf, jobs: jobs
+        opts = {"dry_run": False, "fail_fast": False}
+        job = Mock(job_id="1")
+
+        summarize_jobs.summarize_serial([job], m, dbif, {"resource_id": 1}, Mock(), opts, datasource, progress)
+
+        progress.finished.assert_called_once_with({"resource_id": 1}, job, False)
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.handlers = {}
+        p = patch("supremm.summarize_jobs.signal.signal", side_effect=lambda signum, handler: self.handlers.__setitem__(signum, handler))
+        p.start()
+        self.addCleanup(p.stop)
+
+        self.ctx = summarize_jobs.ResourceContext("cluster", {"resource_id": 1}, Mock(), Mock(), Mock())
+        self.opts = {"dry_run": False, "fail_fast": False, "poll_interval": 0, "daemon_lag": 60}
+        self.job = Mock(job_id="1")
+        self.job.end_datetime.timestamp.return_value = 0
+
+    def stop(self, *args, **kwargs):
+        self.handlers[summarize_jobs.signal.SIGTERM](summarize_jobs.signal.SIGTERM, None)
+
+    def test_reconnect_and_stop(self):
+        failing = Mock()
+        failing.get.side_effect = Exception("lost connection")
+        dbif = Mock()
+        dbif.get.return_value = [self.job]
+
+        with patch("supremm.summarize_jobs.open_resources", return_value=[self.ctx]), \
+                patch("supremm.summarize_jobs.getdbif", side_effect=[failing, dbif]) as getdbif, \
+                patch("supremm.summarize_jobs.summarize_serial", side_effect=self.stop) as serial:
+            summarize_jobs.run_daemon(Mock(), self.opts)
+
+        # The accounting interface is reopened on the poll after the error
+        self.assertEqual(2, getdbif.call_count)
+        serial.assert_called_once()
+        self.assertEqual(([self.job], self.ctx.m, dbif), serial.call_args[0][:3])
+        self.assertLessEqual(dbif.get.call_args[0][1], time.time() - 60)
+
+    def test_pool(self):
+        dbif = Mock()
+        dbif.get.return_value = [self.job]
+        self.ctx.dbif = dbif
+        dispatcher = Mock()
+
+        with patch("supremm.summarize_jobs.open_resources", return_value=[self.ctx]), \
+                patch("supremm.summarize_jobs.summarize_pool", side_effect=self.stop) as pool:
+            summarize_jobs.run_daemon(Mock(), self.opts, dispatcher)
+
+        pool.assert_called_once_with([(self.ctx, [self.job])], self.opts, dispatcher, summarize_jobs.NOPROGRESS)
+        self.assertEqual(1, dbif.get.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from mock import Mock, patch
+
+from supremm.workqueue import WorkQueue
+
+
+def mkjob(pk):
+    job = Mock()
+    job.job_pk_id = pk
+    return job
+
+
+class TestWorkQueue(unittest.TestCase):
+
+    def setUp(self):
+        config = Mock()
+        config.getsection.return_value = {}
+
+        self.con = Mock()
+        self.cur = self.con.cursor.return_value
+
+        patcher = patch("supremm.workqueue.getdbconnection", return_value=self.con)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.queue = WorkQueue(config, "campaign", lease_time=60, batch_size=2)
+
+    def test_claim(self):
+        jobs = [mkjob(i) for i in range(1, 6)]
+
+        # insert, expired leases, owned leases for each batch of two jobs
+        self.cur.fetchall.side_effect = [(), (), ((1,), (2,)),
+                                         (), ((4,),), ((4,),),
+                                         (), (), ()]
+
+        claimed = list(self.queue.claimed(jobs))
+        self.assertEqual([jobs[0], jobs[1], jobs[3]], claimed)
+
+        # The expired lease on job 4 was taken over in a transaction
+        self.assertEqual(3, self.con.begin.call_count)
+        self.assertEqual(3, self.con.commit.call_count)
+        updates = [c for c in self.cur.execute.call_args_list if c[0][0].startswith("UPDATE")]
+        self.assertEqual(1, len(updates))
+        self.assertEqual([self.queue.owner, 60, "campaign", 4], updates[0][0][1])
+
+    def test_claim_rollback(self):
+        self.cur.fetchall.return_value = ()
+        self.cur.execute.side_effect = [None, Exception("lock wait timeout")]
+
+        with self.assertRaises(Exception):
+            self.queue.claim([mkjob(1)])
+        self.con.rollback.assert_called_once_with()
+
+    def test_complete_release(self):
+        self.cur.fetchall.return_value = ()
+        self.queue.complete(mkjob(3))
+        self.queue.release(mkjob(4))
+
+        statements = [c[0] for c in self.cur.execute.call_args_list]
+        self.assertTrue(statements[0][0].startswith("UPDATE"))
+        self.assertEqual(("campaign", 3, self.queue.owner), statements[0][1])
+        self.assertTrue(statements[1][0].startswith("DELETE"))
+        self.assertEqual(("campaign", 4, self.queue.owner), statements[1][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+from mock import patch, Mock, MagicMock
+from pymysql import OperationalError
+
+from supremm.xdmodaccount import XDMoDAcct
+from supremm.accounting import Accounting
+
+
+class TestMarkAsDone(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch("supremm.xdmodaccount.getdbconnection")
+        self.getdbconnection = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.cursor = MagicMock()
+        self.getdbconnection.return_value.cursor.return_value = self.cursor
+
+        self.dbsettings = {"process_batch_size": 3, "process_batch_interval": 3600}
+        config = Mock()
+        config.getsection.return_value = self.dbsettings
+        self.acct = XDMoDAcct(1, "hostname", config)
+        self.cursor.reset_mock()
+
+    def job(self, pk):
+        return Mock(job_pk_id=pk)
+
+    def test_batched(self):
+        self.acct.markasdone(self.job(1), True, 10.0)
+        self.acct.markasdone(self.job(2), False, 11.0)
+        self.cursor.execute.assert_not_called()
+
+        self.acct.markasdone(self.job(3), True, 12.0, 2)
+        self.assertEqual(1, self.cursor.execute.call_count)
+
+        query, data = self.cursor.execute.call_args[0]
+        self.assertEqual(3, query.count("(%s, %s, NOW(), %s)"))
+        version = Accounting.PROCESS_VERSION
+        self.assertEqual([1, version, 10.0, 2, -version, 11.0, 3, -1002, 12.0], data)
+
+    def test_flush(self):
+        self.acct.flush()
+        self.cursor.execute.assert_not_called()
+
+        self.acct.markasdone(self.job(1), True, 10.0)
+        self.acct.flush()
+        self.assertEqual([1, Accounting.PROCESS_VERSION, 10.0], self.cursor.execute.call_args[0][1])
+
+        self.acct.flush()
+        self.assertEqual(1, self.cursor.execute.call_count)
+
+    def test_interval(self):
+        self.acct.batchinterval = 0
+        self.acct.markasdone(self.job(1), True, 10.0)
+        self.assertEqual(1, self.cursor.execute.call_count)
+
+    def test_reconnect(self):
+        self.cursor.execute.side_effect = [OperationalError(2006, "gone away"), None]
+        connections = self.getdbconnection.call_count
+        self.acct.markasdone(self.job(1), True, 10.0)
+        self.acct.flush()
+
+        self.assertEqual(connections + 2, self.getdbconnection.call_count)
+        self.assertEqual(2, self.cursor.execute.call_count)
+        self.assertEqual([], self.acct._pending)
+
+    def test_failed_flush(self):
+        self.cursor.execute.side_effect = OperationalError(2006, "gone away")
+        self.acct.markasdone(self.job(1), True, 10.0)
+        with self.assertRaises(OperationalError):
+            self.acct.flush()
+
+        # The updates are kept for the next flush
+        self.cursor.execute.side_effect = None
+        self.acct.flush()
+        self.assertEqual([1, Accounting.PROCESS_VERSION, 10.0], self.cursor.execute.call_args[0][1])
+
+
+if __name__ == '__main__':
+    unittest.main()